@@ -1,11 +1,27 @@
+import json
 import pandas as pd
 import sqlite3
-import matplotlib.pyplot as plt
-import statsmodels.api as sm
 from datetime import datetime as dt
 import numpy as np
 from time import mktime
 
+from crime_store import CrimeStore, get_store
+from metrics import record_size, stage
+
+#size in degrees of the grid cells used to match crimes to blocks
+GRID_CELL = 0.001
+
+#largest bounding box (in square degrees) searched through the R*Tree;
+#larger boxes are cheaper to read through the Day/Hour index
+RTREE_MAX_AREA = 0.01
+RTREE_SLACK = 1e-4
+
+#Assign relative safety scores for each type of crime 
+#Severity depends on legal definition
+SAFETY_DICT = {'BATTERY': 8, 'ROBBERY': 7, 'THEFT': 2, 'BURGLARY': 6,
+   'ASSAULT': 6, 'CRIM SEXUAL ASSAULT': 10, 'KIDNAPPING': 9, 
+           'SEX OFFENSE': 5, 'HOMICIDE': 10, 'INTIMIDATION': 3}
+
 
 def round2(num, digits = 6, up = True):
     '''
@@ -46,13 +62,167 @@ def edge_to_latlon(edges):
     return ret_dic
 
 
+def assign_crimes(blocks, latitude, longitude, cell = GRID_CELL):
+    '''
+    Finds every (crime, block) pair where the crime lies inside the block's
+    box in one pass.  Blocks are binned into a uniform grid of cell degrees,
+    each crime is looked up in its own grid cell and only tested against the
+    blocks registered there.
+    Inputs:
+        blocks: list of keys from edge_to_latlon, in the form
+            ((min lat, max lat), (min lon, max lon), i)
+        latitude: (numpy array) crime latitudes
+        longitude: (numpy array) crime longitudes
+        cell: (float) grid cell size in degrees
+    Outputs:
+        (tuple of numpy arrays) crime row numbers and the positions in
+        blocks of the matching blocks
+    '''
+
+    boxes = np.array([(block[0][0], block[0][1], block[1][0], block[1][1])
+                      for block in blocks], dtype = np.float64).reshape(-1, 4)
+    latitude = np.asarray(latitude, dtype = np.float64)
+    longitude = np.asarray(longitude, dtype = np.float64)
+    if len(boxes) == 0 or len(latitude) == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    lat0 = boxes[:, 0].min()
+    lon0 = boxes[:, 2].min()
+    row_lo = np.floor((boxes[:, 0] - lat0) / cell).astype(np.int64)
+    row_hi = np.floor((boxes[:, 1] - lat0) / cell).astype(np.int64)
+    col_lo = np.floor((boxes[:, 2] - lon0) / cell).astype(np.int64)
+    col_hi = np.floor((boxes[:, 3] - lon0) / cell).astype(np.int64)
+    n_rows = row_hi.max() + 1
+    n_cols = col_hi.max() + 1
+
+    #register each block in every cell its box overlaps
+    widths = col_hi - col_lo + 1
+    counts = (row_hi - row_lo + 1) * widths
+    block_rep = np.repeat(np.arange(len(boxes)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cells = (row_lo[block_rep] + k // widths[block_rep]) * n_cols + \
+        col_lo[block_rep] + k % widths[block_rep]
+    order = np.argsort(cells, kind = 'stable')
+    cells = cells[order]
+    block_rep = block_rep[order]
+
+    #look every crime up in its own cell
+    crime_row = np.floor((latitude - lat0) / cell)
+    crime_col = np.floor((longitude - lon0) / cell)
+    valid = np.nonzero((crime_row >= 0) & (crime_row < n_rows) &
+                       (crime_col >= 0) & (crime_col < n_cols))[0]
+    crime_cells = crime_row[valid].astype(np.int64) * n_cols + \
+        crime_col[valid].astype(np.int64)
+    start = np.searchsorted(cells, crime_cells, 'left')
+    n_candidates = np.searchsorted(cells, crime_cells, 'right') - start
+    crime_rep = np.repeat(valid, n_candidates)
+    k = np.arange(n_candidates.sum()) - np.repeat(
+        np.cumsum(n_candidates) - n_candidates, n_candidates)
+    candidates = block_rep[np.repeat(start, n_candidates) + k]
+
+    box = boxes[candidates]
+    lat = latitude[crime_rep]
+    lon = longitude[crime_rep]
+    inside = (lat >= box[:, 0]) & (lat <= box[:, 1]) & (
+        lon >= box[:, 2]) & (lon <= box[:, 3])
+    return crime_rep[inside], candidates[inside]
+
+
+def block_score_matrix(blocks, crimes, days):
+    '''
+    Sums the safety scores of the crimes on each block for each day.  As
+    before, only the crimes on the block name that occurs most often inside
+    a block's box are counted for that block.
+    Inputs:
+        blocks: list of keys from edge_to_latlon
+        crimes: (pd dataframe) crimes with Day, Primary_Type (already mapped
+            to safety scores), Block, Latitude and Longitude columns
+        days: (pd Index) the days to score, in order
+    Outputs:
+        (numpy array) blocks x days matrix of daily safety scores
+    '''
+
+    scores = np.zeros((len(blocks), len(days)))
+    rows, block_ids = assign_crimes(blocks, crimes.Latitude.values,
+                                    crimes.Longitude.values)
+    if len(rows) == 0:
+        return scores
+    names = crimes.Block.values[rows]
+    #most frequent block name per block; ties go to the first name in order
+    counts = pd.DataFrame({'block': block_ids, 'name': names}).groupby(
+        ['block', 'name']).size().reset_index(name = 'n')
+    counts = counts.sort_values(['block', 'n'], ascending = [True, False],
+                                kind = 'stable').drop_duplicates('block')
+    block_name = np.empty(len(blocks), dtype = object)
+    block_name[counts.block.values] = counts.name.values
+    day = days.get_indexer(crimes.Day)[rows]
+    keep = (names == block_name[block_ids]) & (day >= 0)
+    np.add.at(scores, (block_ids[keep], day[keep]),
+              crimes.Primary_Type.fillna(0).values[rows][keep])
+    return scores
+
+
+def Crime_Query(c, temp, precip, t_sens, p_sens, time_low = None, 
+                time_up = None, lat = None, lon = None):
+    '''
+    Builds the SQL query behind DataConstructor.  When the database has the
+    CrimeLocation R*Tree (see crime_schema) and the bounding box is small,
+    crimes are found through the R*Tree; otherwise the similar-weather days
+    drive the query through the Day/Hour index.  The exact coordinate
+    predicates are always kept, since the R*Tree stores rounded boxes.
+    Inputs:
+        same as DataConstructor
+    Outputs:
+        (tuple) the SQL string and its parameters
+    '''
+
+    where = ' WHERE DailyWeather.Precip <= ? AND DailyWeather.Precip >= ? '+\
+    'AND DailyWeather.AverageTemp <= ? AND DailyWeather.AverageTemp >= ?'
+    params = [precip + p_sens, precip - p_sens, temp + t_sens, temp - t_sens]
+    if lat:
+        select = 'SELECT CrimeData1.Day, CrimeData1.Hour, '+\
+        'CrimeData1.Primary_Type, CrimeData1.Block, CrimeData1.Latitude, '+\
+        'CrimeData1.Longitude FROM '
+        join = 'DailyWeather JOIN CrimeData1 ON DailyWeather.Date = '+\
+        'CrimeData1.Day'
+        where += ' AND CrimeData1.Latitude >= ? AND CrimeData1.Latitude <= ?'+\
+                  ' AND CrimeData1.Longitude >= ? AND CrimeData1.Longitude <= ?'
+        where += ' AND CrimeData1.Hour >= ? AND CrimeData1.Hour <= ?'
+        params += [*lat, *lon, time_low, time_up]
+        area = (lat[1] - lat[0]) * (lon[1] - lon[0])
+        if area <= RTREE_MAX_AREA and has_rtree(c):
+            #CROSS JOIN makes SQLite start from the R*Tree
+            join = 'CrimeLocation CROSS JOIN CrimeData1 ON CrimeData1.rowid '+\
+            '= CrimeLocation.id JOIN DailyWeather ON DailyWeather.Date = '+\
+            'CrimeData1.Day'
+            where += ' AND CrimeLocation.min_lat >= ? AND '+\
+            'CrimeLocation.max_lat <= ? AND CrimeLocation.min_lon >= ? '+\
+            'AND CrimeLocation.max_lon <= ?'
+            #the R*Tree rounds outward to 32 bit floats, so widen the box
+            params += [lat[0] - RTREE_SLACK, lat[1] + RTREE_SLACK,
+                       lon[0] - RTREE_SLACK, lon[1] + RTREE_SLACK]
+        select += join
+    else:
+        select = 'SELECT Date FROM DailyWeather'
+    return select + where, params
+
+
+def has_rtree(c):
+    '''
+    Checks whether the database has the CrimeLocation R*Tree
+    '''
+
+    return c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND "+\
+                     "name = 'CrimeLocation'").fetchone() is not None
+
+
 def DataConstructor(c, temp, precip, t_sens, p_sens, time_low = None, 
                     time_up = None, lat = None, lon = None):
     '''
     Retrieves a dataframe of all the crime satisfying user's condtions.  Creates
-    a SQL query and uses pandas to execute query.
+    a SQL query (see Crime_Query) and uses pandas to execute query, or runs
+    the same filters as vectorized masks on a CrimeStore.
     Inputs:
-        c: SQL connection
+        c: SQL connection or CrimeStore
         temp: float
         precip: float
         t_sens: sensitivity of temperature (recommened +- 5)
@@ -66,20 +236,31 @@ def DataConstructor(c, temp, precip, t_sens, p_sens, time_low = None,
         df: pandas dataframe of all the crimes satisfying the query
     '''
     
-    where = ' WHERE DailyWeather.Precip <= ? AND DailyWeather.Precip >= ? '+\
-    'AND DailyWeather.AverageTemp <= ? AND DailyWeather.AverageTemp >= ?'
-    params = [precip + p_sens, precip - p_sens, temp + t_sens, temp - t_sens]
+    with stage('crime_query' if lat else 'weather_query'):
+        if isinstance(c, CrimeStore):
+            df = c.query(temp, precip, t_sens, p_sens, time_low, time_up,
+                         lat, lon)
+        else:
+            query, params = Crime_Query(c, temp, precip, t_sens, p_sens,
+                                        time_low, time_up, lat, lon)
+            df = pd.read_sql(query, c, params = params)
     if lat:
-        select = 'SELECT CrimeData1.Day, CrimeData1.Primary_Type, '+\
-        'CrimeData1.Block, CrimeData1.Latitude, CrimeData1.Longitude FROM '+\
-        'DailyWeather JOIN CrimeData1 ON DailyWeather.Date = CrimeData1.Day'
-        where += ' AND CrimeData1.Latitude >= ? AND CrimeData1.Latitude <= ?'+\
-                  ' AND CrimeData1.Longitude >= ? AND CrimeData1.Longitude <= ?'
-        where += ' AND CrimeData1.Hour >= ? AND CrimeData1.Hour <= ?'
-        params += [*lat, *lon, time_low, time_up]
-    else:
-        select = 'SELECT Date FROM DailyWeather'
-    return pd.read_sql(select + where, c, params = params)
+        record_size('crime_rows', len(df))
+    return df
+
+
+def Crime_Source(db = "Crime.db"):
+    '''
+    Opens the crime data: the memory-mapped columnar store when one has been
+    exported (see crime_store), otherwise an SQL connection to db
+    Outputs:
+        CrimeStore or SQL connection, either of which DataConstructor takes
+    '''
+
+    store = get_store()
+    if store is not None:
+        return store
+    return sqlite3.connect(db)
 
 
 def Regression(weather, crimes, date):
@@ -95,6 +276,9 @@ def Regression(weather, crimes, date):
         reg_score: (int) predicted relative safety score for the given date.  
     '''
     
+    #statsmodels takes long to import and only this single-block fit uses it
+    import statsmodels.api as sm
+
     weather['Score'] = crimes.groupby('Day').sum()['Primary_Type']
     weather['Score'] = weather['Score'].fillna(0)
     X = sm.add_constant(weather.Date)
@@ -104,8 +288,236 @@ def Regression(weather, crimes, date):
     return int(max(10**6 * results.params[0] + results.params[1]*date,1))
 
 
-def Regression_List(list_of_blocks, temp, precip, t_sens, p_sens, 
-                    date, time_low, time_up):
+def Weather_Days(c, temp, precip, t_sens, p_sens):
+    '''
+    Retrieves the days with weather similar to the user's conditions, which
+    are the observations every block's regression is fit on
+    Inputs:
+        c: SQL connection
+        temp, precip, t_sens, p_sens: as in DataConstructor
+    Outputs:
+        weather: (pd dataframe) indexed and sorted by date, with a 'Date'
+            column in seconds since the epoch
+    '''
+
+    weather = DataConstructor(c, temp, precip, t_sens, p_sens).set_index(
+            'Date')
+    weather = weather.sort_index()
+    weather['Date'] = pd.to_datetime(weather.index).values.astype(
+            'datetime64[s]').astype(np.int64)
+    return weather
+
+
+def Regression_Params(weather, scores):
+    '''
+    Fits the regression of Regression for many blocks at once.  Every block
+    shares the same design matrix (the days with similar weather), so its
+    pseudo-inverse is computed once and all least-squares fits are a single
+    matrix product.
+    Input:
+        weather: (pd dataframe) from Weather_Days
+        scores: (numpy array) blocks x days matrix of daily safety scores,
+            days aligned with the rows of weather
+    Output:
+        (numpy array) 2 x blocks array of the constant and date coefficient
+            of each block, or None when there are too few similar days
+    '''
+
+    #Occurs when event has never occured - ex. temperature = 200
+    if len(weather) < 2:
+        return None
+    X = np.column_stack((np.ones(len(weather)),
+                         weather.Date.values.astype(np.float64)))
+    return np.linalg.pinv(X) @ scores.T
+
+
+def Regression_Batch(weather, scores, date):
+    '''
+    Predicts the safety score of many blocks for the given date with one
+    batched fit (see Regression_Params)
+    Input:
+        weather: (pd dataframe) from Weather_Days
+        scores: (numpy array) blocks x days matrix of daily safety scores
+        date: date as a string (yyyy-mm-dd format)
+    Output:
+        (numpy array of ints) predicted relative safety score of each block
+    '''
+
+    params = Regression_Params(weather, scores)
+    if params is None:
+        return np.ones(len(scores), dtype = np.int64)
+    date = mktime(dt.strptime(date, '%Y-%m-%d').timetuple())
+    projection = 10**6 * params[0] + params[1] * date
+    return np.maximum(projection, 1).astype(np.int64)
+
+
+def Projection_Weights(weather, date):
+    '''
+    The projection of Regression_Batch is linear in the daily safety scores:
+    a block's projected score (before the floor of 1) is the sum over days of
+    its daily score times the day's weight
+    Input:
+        weather: (pd dataframe) from Weather_Days
+        date: date as a string (yyyy-mm-dd format)
+    Output:
+        (numpy array) weight of each day of weather, or None when there are
+            too few similar days
+    '''
+
+    if len(weather) < 2:
+        return None
+    X = np.column_stack((np.ones(len(weather)),
+                         weather.Date.values.astype(np.float64)))
+    pinv = np.linalg.pinv(X)
+    date = mktime(dt.strptime(date, '%Y-%m-%d').timetuple())
+    return 10**6 * pinv[0] + pinv[1] * date
+
+
+def Window_Scores(block_ids, names, day, hour, crimes, severity, n_blocks,
+                  weights, windows):
+    '''
+    Predicts the safety score of blocks for many hour windows at once, as
+    Regression_Batch over the block_score_matrix of each window would: for
+    every window only the crimes on the block name most frequent within the
+    window count for a block (ties go to the first name in order)
+    Inputs:
+        block_ids, names, day, hour, crimes, severity: (numpy arrays) one
+            entry per block, block name, day (position in weather, -1 for
+            other days) and hour, with its number of crimes and the sum of
+            their safety scores
+        n_blocks: (int) number of blocks
+        weights: from Projection_Weights
+        windows: list of (time_low, time_up) hour windows
+    Outputs:
+        (numpy array of ints) windows x blocks predicted safety scores
+    '''
+
+    scores = np.zeros((len(windows), n_blocks))
+    keep = day >= 0
+    if weights is None or not keep.any():
+        return np.maximum(scores, 1).astype(np.int64)
+    block_ids, names, day, hour, crimes, severity = (
+        block_ids[keep], names[keep], day[keep], hour[keep].astype(np.int64),
+        crimes[keep], severity[keep])
+    hours = np.arange(max(hour.max() + 1, 24))
+    member = np.array([(hours >= low) & (hours <= up)
+                       for low, up in windows])
+
+    #(block, name) pairs, numbered in block then name order
+    pair_index = pd.MultiIndex.from_arrays([block_ids, names]).unique(
+        ).sort_values()
+    pair = pair_index.get_indexer(pd.MultiIndex.from_arrays([block_ids,
+                                                             names]))
+    pair_block = pair_index.get_level_values(0).values
+    hourly = np.zeros((len(pair_index), len(hours)))
+    np.add.at(hourly, (pair, hour), crimes)
+    counts = hourly @ member.T
+
+    #most frequent name of each block in each window: the first pair of the
+    #block reaching the block's highest count
+    starts = np.nonzero(np.r_[True, pair_block[1:] != pair_block[:-1]])[0]
+    group = np.cumsum(np.r_[True, pair_block[1:] != pair_block[:-1]]) - 1
+    best = np.maximum.reduceat(counts, starts, axis = 0)[group]
+    candidate = np.where((counts == best) & (counts > 0),
+                         np.arange(len(pair_index))[:, None],
+                         len(pair_index))
+    chosen = np.minimum.reduceat(candidate, starts, axis = 0)[group[pair]]
+
+    entry, window = np.nonzero(member.T[hour] & (chosen == pair[:, None]))
+    np.add.at(scores, (window, block_ids[entry]),
+              (severity * weights[day])[entry])
+    return np.maximum(scores, 1).astype(np.int64)
+
+
+def Crime_Data(temp, precip, t_sens, p_sens, time_low, time_up, lat, lon):
+    '''
+    Loads what the regression needs for a region: the days with similar
+    weather and the crimes in the region during those days, with their
+    types converted to safety scores
+    Inputs:
+        temp, precip, t_sens, p_sens, time_low, time_up: as in
+            Regression_Array
+        lat: tuple of (min lat, max lat) of the region
+        lon: tuple of (min lon, max lon) of the region
+    Outputs:
+        (tuple) weather and crimes dataframes
+    '''
+
+    c = Crime_Source()
+    weather = Weather_Days(c, temp, precip, t_sens, p_sens)
+    crimes = DataConstructor(
+            c, temp, precip, t_sens, p_sens, time_low, time_up, lat, lon)
+    c.close()
+    crimes['Primary_Type'] = crimes['Primary_Type'].map(SAFETY_DICT)
+    return weather, crimes
+
+
+def Severity_Matrix(c, edges, days, time_low, time_up):
+    '''
+    Computes the daily safety scores of snapshot edges from the
+    EdgeBlockSeverity aggregate (see severity): the same sums, with the same
+    choice of block name per edge, as block_score_matrix over raw crimes
+    Inputs:
+        c: SQL connection to a Crime.db with the aggregate
+        edges: (array of ints) snapshot edge ids
+        days: (pd Index) the days to score, in order
+        time_low: hour of minimum time considered
+        time_up: hour of maximum time considered
+    Outputs:
+        (numpy array) edges x days matrix of daily safety scores
+    '''
+
+    scores = np.zeros((len(edges), len(days)))
+    rows = pd.read_sql('SELECT Edge, Block, Day, SUM(Crimes) AS Crimes, '
+                       'SUM(Severity) AS Severity FROM EdgeBlockSeverity '
+                       'WHERE Edge IN (SELECT value FROM json_each(?)) AND '
+                       'Hour >= ? AND Hour <= ? GROUP BY Edge, Block, Day', c,
+                       params = (json.dumps([int(e) for e in edges]),
+                                 time_low, time_up))
+    rows = rows[days.get_indexer(rows.Day) >= 0]
+    if rows.empty:
+        return scores
+    #most frequent block name per edge, among the crimes of the request
+    counts = rows.groupby(['Edge', 'Block'], as_index = False).Crimes.sum()
+    counts = counts.sort_values(['Edge', 'Crimes', 'Block'],
+                                ascending = [True, False, True],
+                                kind = 'stable').drop_duplicates('Edge')
+    rows = rows.merge(counts[['Edge', 'Block']], on = ['Edge', 'Block'])
+    row = pd.Index(edges).get_indexer(rows.Edge)
+    day = days.get_indexer(rows.Day)
+    keep = row >= 0
+    np.add.at(scores, (row[keep], day[keep]), rows.Severity.values[keep])
+    return scores
+
+
+def Regression_Edges(edges, temp, precip, t_sens, p_sens, date, time_low,
+                     time_up, db = "Crime.db"):
+    '''
+    Predicts safety score for snapshot edges from the EdgeBlockSeverity
+    aggregate, without reading raw crimes
+    Inputs:
+        edges: (array of ints) snapshot edge ids
+        db: (string) path to a Crime.db with the aggregate built for the
+            snapshot (see severity)
+        others: as in Regression_Array
+    Outputs:
+        scores: numpy array of safety scores aligned with edges
+    '''
+
+    c = sqlite3.connect(db)
+    try:
+        weather = Weather_Days(c, temp, precip, t_sens, p_sens)
+        record_size('blocks', len(edges))
+        with stage('regression'):
+            block_scores = Severity_Matrix(c, edges, pd.Index(weather.index),
+                                           time_low, time_up)
+            return Regression_Batch(weather, block_scores, date)
+    finally:
+        c.close()
+
+
+def Regression_Array(list_of_blocks, temp, precip, t_sens, p_sens, 
+                     date, time_low, time_up, data = None):
     '''
     Predicts safety score for each block in a list of blocks
     Inputs:
@@ -117,43 +529,117 @@ def Regression_List(list_of_blocks, temp, precip, t_sens, p_sens,
         date: date to project to
         time_low: hour of minimum time considered 
         time_up: hour of maximum time considered
+        data: optional result of Crime_Data for the same conditions and a
+            region containing every block, e.g. loaded ahead of time
     Outputs: 
-        ret_dic: dictionary connecting list_of_blocks to safety score
+        scores: numpy array of safety scores aligned with list_of_blocks
     '''
-    
-    #Assign relative safety scores for each type of crime 
-    #Severity depends on legal definition
-    SAFETY_DICT = {'BATTERY': 8, 'ROBBERY': 7, 'THEFT': 2, 'BURGLARY': 6,
-       'ASSAULT': 6, 'CRIM SEXUAL ASSAULT': 10, 'KIDNAPPING': 9, 
-               'SEX OFFENSE': 5, 'HOMICIDE': 10, 'INTIMIDATION': 3}
 
+    if not list_of_blocks:
+        return np.ones(0, dtype = np.int64)
     blocks_dic = edge_to_latlon(list_of_blocks)
     blocks = list(blocks_dic.keys())
-    lat = (min([block[0][0] for block in blocks]), max([block[0][1
-           ] for block in blocks]))
-    lon = (min([block[1][0] for block in blocks]), max([block[1][1
-           ] for block in blocks]))
-    c = sqlite3.connect("Crime.db")
-    weather = DataConstructor(c, temp, precip, t_sens, p_sens).set_index(
-            'Date')
-    crimes = DataConstructor(
-            c, temp, precip, t_sens, p_sens, time_low, time_up, lat, lon)
-    c.close()
-    crimes['Primary_Type'] = crimes['Primary_Type'].map(SAFETY_DICT)
-    weather = weather.sort_index()
-    weather['Date'] = pd.to_datetime(weather.index).astype(np.int64) // 10**9
-    ret_dic = {}
-    for block in blocks: 
-        crime = crimes[((crimes.Latitude >= block[0][0]) & (
-            crimes.Latitude <= block[0][1]) & (crimes.Longitude >= block[1][0]
-            ) & (crimes.Longitude <= block[1][1]))]
-        if len(crime) > 0:
-            block_name = crime.groupby('Block').count().sort_values(
-                    'Longitude', ascending = False).index[0]
-            crime = crime[crime.Block == block_name]
-        try:
-            ret_dic[blocks_dic[block]] = Regression(weather, crime, date)
-        #Occurs when event has never occured - ex. temperature = 200
-        except ValueError:
-            ret_dic[blocks_dic[block]] = 1
-    return ret_dic
\ No newline at end of file
+    if data is None:
+        lat = (min([block[0][0] for block in blocks]), max([block[0][1
+               ] for block in blocks]))
+        lon = (min([block[1][0] for block in blocks]), max([block[1][1
+               ] for block in blocks]))
+        data = Crime_Data(temp, precip, t_sens, p_sens, time_low, time_up,
+                          lat, lon)
+    weather, crimes = data
+    record_size('blocks', len(blocks))
+    with stage('regression'):
+        #blocks are in the same order as list_of_blocks
+        block_scores = block_score_matrix(blocks, crimes,
+                                          pd.Index(weather.index))
+        return Regression_Batch(weather, block_scores, date)
+
+
+def Regression_Hours(list_of_blocks, temp, precip, t_sens, p_sens, date,
+                     windows, data = None):
+    '''
+    Predicts safety score for each block in a list of blocks for many hour
+    windows, from one crime pull covering every window (see Window_Scores)
+    Inputs:
+        windows: list of (time_low, time_up) hour windows
+        data: optional result of Crime_Data for the same conditions, hours
+            covering every window and a region containing every block
+        others: as in Regression_Array
+    Outputs:
+        scores: windows x blocks numpy array of safety scores, blocks
+            aligned with list_of_blocks
+    '''
+
+    if not list_of_blocks:
+        return np.ones((len(windows), 0), dtype = np.int64)
+    blocks = list(edge_to_latlon(list_of_blocks).keys())
+    if data is None:
+        lat = (min([block[0][0] for block in blocks]), max([block[0][1
+               ] for block in blocks]))
+        lon = (min([block[1][0] for block in blocks]), max([block[1][1
+               ] for block in blocks]))
+        data = Crime_Data(temp, precip, t_sens, p_sens,
+                          min(low for low, _ in windows),
+                          max(up for _, up in windows), lat, lon)
+    weather, crimes = data
+    record_size('blocks', len(blocks))
+    with stage('regression'):
+        rows, block_ids = assign_crimes(blocks, crimes.Latitude.values,
+                                        crimes.Longitude.values)
+        day = pd.Index(weather.index).get_indexer(crimes.Day)[rows]
+        return Window_Scores(block_ids, crimes.Block.values[rows], day,
+                             crimes.Hour.values[rows], np.ones(len(rows)),
+                             crimes.Primary_Type.fillna(0).values[rows],
+                             len(blocks), Projection_Weights(weather, date),
+                             windows)
+
+
+def Regression_Edge_Hours(edges, temp, precip, t_sens, p_sens, date, windows,
+                          db = "Crime.db"):
+    '''
+    Predicts safety score for snapshot edges for many hour windows from the
+    EdgeBlockSeverity aggregate (see Regression_Hours and Regression_Edges)
+    Outputs:
+        scores: windows x edges numpy array of safety scores
+    '''
+
+    c = sqlite3.connect(db)
+    try:
+        weather = Weather_Days(c, temp, precip, t_sens, p_sens)
+        record_size('blocks', len(edges))
+        with stage('regression'):
+            rows = pd.read_sql('SELECT Edge, Block, Day, Hour, Crimes, '
+                               'Severity FROM EdgeBlockSeverity WHERE Edge '
+                               'IN (SELECT value FROM json_each(?)) AND '
+                               'Hour >= ? AND Hour <= ?', c, params = (
+                                   json.dumps([int(e) for e in edges]),
+                                   min(low for low, _ in windows),
+                                   max(up for _, up in windows)))
+            return Window_Scores(
+                pd.Index(edges).get_indexer(rows.Edge), rows.Block.values,
+                pd.Index(weather.index).get_indexer(rows.Day),
+                rows.Hour.values, rows.Crimes.values, rows.Severity.values,
+                len(edges), Projection_Weights(weather, date), windows)
+    finally:
+        c.close()
+
+
+def Regression_List(list_of_blocks, temp, precip, t_sens, p_sens, 
+                    date, time_low, time_up, edges = None):
+    '''
+    Predicts safety score for each block in a list of blocks
+    Inputs:
+        same as Regression_Array
+        edges: optional snapshot edge ids of the blocks, to read the scores
+            from the EdgeBlockSeverity aggregate (see Regression_Edges)
+    Outputs: 
+        ret_dic: dictionary connecting list_of_blocks to safety score
+    '''
+
+    if edges is not None:
+        scores = Regression_Edges(edges, temp, precip, t_sens, p_sens, date,
+                                  time_low, time_up)
+    else:
+        scores = Regression_Array(list_of_blocks, temp, precip, t_sens,
+                                  p_sens, date, time_low, time_up)
+    return {block: int(score) for block, score in zip(list_of_blocks, scores)}
@@ -0,0 +1,15 @@
+'''
+Reproducible benchmarks of the routing pipeline.
+
+Everything a route request depends on is generated or stubbed: a seeded
+Chicago-like street grid written as a graph snapshot, a synthetic Crime.db
+with the CrimeData1 and DailyWeather tables of the real one, a geocoder
+answering from a fixed table and a weather provider returning fixed
+conditions. The stages of go() are then timed for several route lengths and
+crime table sizes and the timings written as JSON, so two runs (e.g. before
+and after a change) can be compared.
+
+Run from the "saferoutesite" folder:
+    python -m benchmarks.run [--crimes 10000 100000] [--lengths 0.5 2 8]
+    python -m benchmarks.run compare BASELINE.json RESULTS.json
+'''
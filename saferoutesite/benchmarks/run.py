@@ -0,0 +1,327 @@
+'''
+Times the stages of a route request on synthetic data.
+
+For every crime table size a directory under the work directory holds the
+grid snapshot and the synthetic Crime.db (and, with --store, the exported
+crime store); they are generated on the first run and reused afterwards.
+The benchmark runs from inside that directory, so go() finds them exactly as
+it finds the real ones. For every route length the same seeded routes are
+timed stage by stage (get_graph, Regression_List, update_edge_lengths,
+get_path) and end to end (go, with the stub geocoder and weather and an
+emptied route cache), after one untimed warm-up route.
+
+Usage:
+    python -m benchmarks.run [--crimes 10000 100000] [--lengths 0.5 2 8]
+        [--routes 5] [--repeat 3] [--rows 120] [--cols 160] [--seed 0]
+        [--store] [--work benchmark_data] [--out benchmark_results.json]
+    python -m benchmarks.run compare BASELINE.json RESULTS.json
+        [--threshold 1.2]
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.stubs import STUB_PRECIP, STUB_TEMP, install_stubs
+from benchmarks.synthetic import route_ends, write_crime_db, \
+    write_grid_snapshot
+from crime_store import STORE_DIR, export_store
+from dijkstra_path1 import HOUR_WINDOW, P_SENS, T_SENS, edge_scores, \
+    edge_to_latlon_pair, get_bounding_box, get_graph, get_path, go, \
+    update_edge_lengths
+from graph_snapshot import SNAPSHOT_ROOT, available_snapshots, load_snapshot
+from route_cache import get_route_cache
+from SQLRequest3 import Crime_Data, Regression_List
+
+WORK_DIR = 'benchmark_data'
+RESULTS_FILE = 'benchmark_results.json'
+CRIME_SIZES = [10000, 100000]
+ROUTE_LENGTHS = [0.5, 2, 8]
+ROUTES = 5
+REPEAT = 3
+GRID_ROWS = 120
+GRID_COLS = 160
+#travel conditions of every benchmark route
+TRAVEL_DATE = '2019-06-01'
+TRAVEL_HOUR = 18
+#a stage is reported as slower when its median grows by this factor and
+#by more than the noise floor (seconds)
+THRESHOLD = 1.2
+NOISE_FLOOR = 0.001
+
+STAGES = ['get_graph', 'Regression_List', 'update_edge_lengths', 'get_path',
+          'go']
+
+
+def data_path(work, rows, cols, seed, crimes):
+    '''
+    Directory of the synthetic data for one crime table size
+    '''
+
+    return os.path.join(work, 'grid{}x{}-seed{}'.format(rows, cols, seed),
+                        'crimes{}'.format(crimes))
+
+
+def prepare(path, rows, cols, crimes, seed = 0, store = False):
+    '''
+    Generates whatever synthetic data a directory is missing
+    Inputs:
+        path: (string) directory from data_path
+        rows, cols: (ints) size of the street grid
+        crimes: (int) number of crimes
+        seed: (int) random seed
+        store: (bool) whether go() should read an exported crime store
+            instead of Crime.db
+    '''
+
+    snapshots = os.path.join(path, SNAPSHOT_ROOT)
+    if not available_snapshots(snapshots):
+        write_grid_snapshot(snapshots, rows, cols, seed)
+    db = os.path.join(path, 'Crime.db')
+    if not os.path.exists(db):
+        write_crime_db(db + '.tmp', load_snapshot(root = snapshots), crimes,
+                       seed)
+        os.replace(db + '.tmp', db)
+    store_path = os.path.join(path, STORE_DIR)
+    if store and not os.path.exists(os.path.join(store_path,
+                                                 'manifest.json')):
+        export_store(db, store_path)
+    elif not store and os.path.exists(store_path):
+        shutil.rmtree(store_path)
+
+
+def timed(times, stage, fn, *args):
+    '''
+    Calls fn(*args), adding its duration in seconds to times[stage]
+    '''
+
+    start = time.perf_counter()
+    result = fn(*args)
+    times.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def route_stages(start, end, times):
+    '''
+    Runs the stages of go() for one route, timing each
+    Outputs:
+        (dict) size of the graph and of the crime data of the route
+    '''
+
+    temp, precip, date, hour = STUB_TEMP, STUB_PRECIP, TRAVEL_DATE, \
+        TRAVEL_HOUR
+    bbox = get_bounding_box(start, end)
+    G = timed(times, 'get_graph', get_graph, *bbox)
+    edges = np.nonzero(G.named)[0]
+    edges_lst = [edge_to_latlon_pair(G, edge) for edge in edges]
+    scored = timed(times, 'Regression_List', Regression_List, edges_lst,
+                   temp, precip, T_SENS, P_SENS, date, hour - HOUR_WINDOW,
+                   hour + HOUR_WINDOW)
+    scores = edge_scores(G, edges, [scored[block] for block in edges_lst])
+    timed(times, 'update_edge_lengths', update_edge_lengths, G, scores)
+    timed(times, 'get_path', get_path, start, end, G, scores)
+
+    n_lat, s_lat, e_lon, w_lon = bbox
+    crimes = Crime_Data(temp, precip, T_SENS, P_SENS, hour - HOUR_WINDOW,
+                        hour + HOUR_WINDOW, (s_lat, n_lat), (w_lon, e_lon))[1]
+    return {'nodes': G.num_nodes, 'edges': G.num_edges,
+            'blocks': len(edges), 'rows': len(crimes)}
+
+
+def route_args(geocoder, i, start, end):
+    '''
+    Arguments of go() for a benchmark route, registering its addresses with
+    the stub geocoder
+    '''
+
+    start_address = 'benchmark route {} start'.format(i)
+    end_address = 'benchmark route {} end'.format(i)
+    geocoder.add(start_address, start)
+    geocoder.add(end_address, end)
+    return {'start_address': start_address, 'end_address': end_address,
+            'date_of_travel': TRAVEL_DATE, 'hour_of_travel': TRAVEL_HOUR,
+            'temperature': None, 'precipitation': None}
+
+
+def summarize(times, sizes):
+    '''
+    Statistics of the timings of each stage (in seconds) and the median
+    sizes of the routes
+    '''
+
+    summary = {}
+    for stage in STAGES:
+        values = np.array(times.get(stage, []))
+        if not len(values):
+            continue
+        summary[stage] = {'runs': len(values),
+                          'min': float(values.min()),
+                          'median': float(np.median(values)),
+                          'mean': float(values.mean()),
+                          'max': float(values.max())}
+    for key in ('nodes', 'edges', 'blocks', 'rows'):
+        summary[key] = float(np.median([size[key] for size in sizes]))
+    return summary
+
+
+def benchmark(path, lengths, routes, repeat, seed = 0):
+    '''
+    Times every route length on the data of one directory
+    Outputs:
+        (list of dicts) the summary of each route length
+    '''
+
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        geocoder = install_stubs()
+        cache = get_route_cache()
+        snapshot = load_snapshot()
+        results = []
+        for length in lengths:
+            ends = route_ends(snapshot, length, routes, seed)
+            #loads the snapshot, its node index and the database pages
+            route_stages(*ends[0], {})
+            times = {}
+            sizes = []
+            for i, (start, end) in enumerate(ends):
+                args = route_args(geocoder, i, start, end)
+                for _ in range(repeat):
+                    sizes.append(route_stages(start, end, times))
+                    cache.clear()
+                    timed(times, 'go', go, args)
+            results.append({'length': length, **summarize(times, sizes)})
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def git_commit():
+    '''
+    Short hash of the checked out commit, or None outside a git checkout
+    '''
+
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+            text = True, check = True,
+            cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    '''
+    Generates the data and runs the benchmark for every crime table size,
+    writing the results to args.out
+    '''
+
+    work = os.path.abspath(args.work)
+    results = []
+    for crimes in args.crimes:
+        path = data_path(work, args.rows, args.cols, args.seed, crimes)
+        start = time.perf_counter()
+        prepare(path, args.rows, args.cols, crimes, args.seed, args.store)
+        print('{} crimes: data ready in {:.1f} s'.format(
+            crimes, time.perf_counter() - start))
+        for result in benchmark(path, args.lengths, args.routes,
+                                args.repeat, args.seed):
+            results.append({'crimes': crimes, **result})
+            print('  {} km ({:.0f} nodes, {:.0f} rows): {}'.format(
+                result['length'], result['nodes'], result['rows'],
+                ', '.join('{} {:.1f} ms'.format(
+                    stage, 1000 * result[stage]['median'])
+                    for stage in STAGES if stage in result)))
+    output = {'created': datetime.datetime.now().isoformat(
+                  timespec = 'seconds'),
+              'commit': git_commit(),
+              'environment': {'python': platform.python_version(),
+                              'numpy': np.__version__,
+                              'platform': platform.platform(),
+                              'cpus': os.cpu_count()},
+              'config': {'crimes': args.crimes, 'lengths': args.lengths,
+                         'routes': args.routes, 'repeat': args.repeat,
+                         'rows': args.rows, 'cols': args.cols,
+                         'seed': args.seed, 'store': args.store,
+                         'date': TRAVEL_DATE, 'hour': TRAVEL_HOUR},
+              'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(output, f, indent = 2)
+    print(args.out)
+
+
+def compare(baseline, current, threshold = THRESHOLD):
+    '''
+    Prints the median time of every stage in two result files side by side
+    Inputs:
+        baseline, current: (strings) paths of result files
+        threshold: (float) ratio above which a stage counts as slower,
+            unless it takes less than NOISE_FLOOR longer
+    Outputs:
+        (int) number of stages slower than the threshold
+    '''
+
+    with open(baseline) as f:
+        base = {(r['crimes'], r['length']): r for r in json.load(f)['results']}
+    with open(current) as f:
+        new = json.load(f)['results']
+    slower = 0
+    print('{:>9} {:>6} {:<20} {:>10} {:>10} {:>7}'.format(
+        'crimes', 'km', 'stage', 'base ms', 'new ms', 'ratio'))
+    for result in new:
+        old = base.get((result['crimes'], result['length']))
+        if old is None:
+            continue
+        for stage in STAGES:
+            if stage not in result or stage not in old:
+                continue
+            before = old[stage]['median']
+            after = result[stage]['median']
+            ratio = after / before if before else float('inf')
+            flag = ''
+            if ratio > threshold and after - before > NOISE_FLOOR:
+                slower += 1
+                flag = ' slower'
+            print('{:>9} {:>6} {:<20} {:>10.1f} {:>10.1f} {:>7.2f}{}'.format(
+                result['crimes'], result['length'], stage, 1000 * before,
+                1000 * after, ratio, flag))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark the route stages on synthetic data')
+    parser.add_argument('command', nargs = '?', default = 'run',
+                        choices = ['run', 'compare'])
+    parser.add_argument('inputs', nargs = '*',
+                        help = 'baseline and new result files (compare)')
+    parser.add_argument('--crimes', type = int, nargs = '+',
+                        default = CRIME_SIZES)
+    parser.add_argument('--lengths', type = float, nargs = '+',
+                        default = ROUTE_LENGTHS, help = 'route lengths in km')
+    parser.add_argument('--routes', type = int, default = ROUTES,
+                        help = 'routes per length')
+    parser.add_argument('--repeat', type = int, default = REPEAT,
+                        help = 'timed runs per route')
+    parser.add_argument('--rows', type = int, default = GRID_ROWS)
+    parser.add_argument('--cols', type = int, default = GRID_COLS)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--store', action = 'store_true',
+                        help = 'read the crimes from an exported crime store')
+    parser.add_argument('--work', default = WORK_DIR)
+    parser.add_argument('--out', default = RESULTS_FILE)
+    parser.add_argument('--threshold', type = float, default = THRESHOLD)
+    args = parser.parse_args()
+    if args.command == 'compare':
+        if len(args.inputs) != 2:
+            parser.error('compare takes a baseline and a new result file')
+        sys.exit(1 if compare(*args.inputs, args.threshold) else 0)
+    run(args)
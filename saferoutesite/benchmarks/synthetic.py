@@ -0,0 +1,268 @@
+'''
+Seeded synthetic inputs for the benchmarks: a Chicago-like street grid and a
+Crime.db of crimes along its streets.
+
+The grid has east-west streets every 1/8 mile and north-south streets every
+1/16 mile, with a few segments missing and some unnamed (alleys, which get
+no crime data). Crimes fall on named segments with heavy-tailed hot spots,
+carry a block name such as "012XX W 31 ST" shared by every crime of their
+segment, and a small share are scattered anywhere. Crime types follow rough
+Chicago proportions, hours a daily cycle, and every day of the period has a
+seasonal temperature and occasional precipitation in DailyWeather.
+'''
+
+import math
+import os
+import sqlite3
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from crime_schema import build_indexes
+from graph_snapshot import write_snapshot
+from routing import great_circle
+
+#south-west corner of the grid and spacing of its streets in degrees
+GRID_ORIGIN = (41.75, -87.75)
+BLOCK_LAT = 0.00181
+BLOCK_LON = 0.00121
+#node position noise (degrees), missing and unnamed shares of the segments
+JITTER = 0.00005
+MISSING = 0.03
+UNNAMED = 0.1
+EXTRACT_DATE = '2000-01-01'
+
+#crimes: distance from their street (degrees) and share placed at random
+CRIME_NOISE = 0.00003
+SCATTER = 0.05
+FIRST_DAY = '2012-01-01'
+LAST_DAY = '2018-12-31'
+WRITE_CHUNK = 200000
+TYPE_SHARES = {'THEFT': 0.36, 'BATTERY': 0.27, 'ASSAULT': 0.11,
+               'BURGLARY': 0.09, 'ROBBERY': 0.07, 'SEX OFFENSE': 0.03,
+               'CRIM SEXUAL ASSAULT': 0.02, 'INTIMIDATION': 0.03,
+               'KIDNAPPING': 0.01, 'HOMICIDE': 0.01}
+#crimes per hour, lowest around 5am and highest in the evening
+HOUR_SHARES = 1.2 + np.sin(2 * np.pi * (np.arange(24) - 11) / 24)
+HOUR_SHARES = HOUR_SHARES / HOUR_SHARES.sum()
+
+
+def grid_graph(rows, cols, seed = 0):
+    '''
+    Builds the street grid as the undirected networkx graph the snapshot
+    build step writes
+    Inputs:
+        rows: (int) number of east-west streets
+        cols: (int) number of north-south streets
+        seed: (int) random seed
+    Outputs:
+        networkx MultiGraph with x/y node and length/name edge attributes
+    '''
+
+    rng = np.random.default_rng(seed)
+    lat0, lon0 = GRID_ORIGIN
+    lat = lat0 + np.arange(rows)[:, None] * BLOCK_LAT + \
+        rng.uniform(-JITTER, JITTER, (rows, cols))
+    lon = lon0 + np.arange(cols)[None, :] * BLOCK_LON + \
+        rng.uniform(-JITTER, JITTER, (rows, cols))
+    osmid = 10**8 + np.arange(rows * cols).reshape(rows, cols)
+
+    G = nx.MultiGraph()
+    for i in range(rows):
+        for j in range(cols):
+            G.add_node(int(osmid[i, j]), y = float(lat[i, j]),
+                       x = float(lon[i, j]))
+    for i in range(rows):
+        for j in range(cols):
+            #east along street i, then north along avenue j
+            for di, dj, street in ((0, 1, 'W {} ST'.format(i + 1)),
+                                   (1, 0, 'S AVE {}'.format(j + 1))):
+                if i + di >= rows or j + dj >= cols:
+                    continue
+                if rng.random() < MISSING:
+                    continue
+                attrs = {'length': float(great_circle(
+                    lat[i, j], lon[i, j], lat[i + di, j + dj],
+                    lon[i + di, j + dj]))}
+                if rng.random() >= UNNAMED:
+                    attrs['name'] = street
+                G.add_edge(int(osmid[i, j]), int(osmid[i + di, j + dj]),
+                           **attrs)
+    return G
+
+
+def write_grid_snapshot(root, rows, cols, seed = 0):
+    '''
+    Writes the street grid as a graph snapshot under root
+    Outputs:
+        (string) path of the written snapshot
+    '''
+
+    return write_snapshot(grid_graph(rows, cols, seed), EXTRACT_DATE, root)
+
+
+def block_names(snapshot, edges):
+    '''
+    Block name of some snapshot edges, e.g. "012XX W 31 ST", numbered by
+    the edge's position along its street
+    '''
+
+    u = np.asarray(snapshot.u)[edges]
+    v = np.asarray(snapshot.v)[edges]
+    lat = np.asarray(snapshot.lat)
+    lon = np.asarray(snapshot.lon)
+    north = np.abs(lat[v] - lat[u]) / BLOCK_LAT > \
+        np.abs(lon[v] - lon[u]) / BLOCK_LON
+    number = np.where(
+        north, ((lat[u] + lat[v]) / 2 - lat.min()) // BLOCK_LAT,
+        ((lon[u] + lon[v]) / 2 - lon.min()) // BLOCK_LON).astype(int)
+    names = np.asarray(snapshot.name)[edges]
+    return np.array(['{:03d}XX {}'.format(n, snapshot.names[name])
+                     for n, name in zip(number, names)], dtype = object)
+
+
+def daily_weather(rng, first_day = FIRST_DAY, last_day = LAST_DAY):
+    '''
+    DailyWeather rows for every day of the period
+    '''
+
+    days = pd.date_range(first_day, last_day)
+    season = np.cos(2 * np.pi * (days.dayofyear.values - 15) / 365.25)
+    temp = np.round(50 - 25 * season + rng.normal(0, 8, len(days)), 1)
+    precip = np.where(rng.random(len(days)) < 0.3,
+                      np.round(rng.exponential(0.25, len(days)), 2), 0.0)
+    return pd.DataFrame({'Date': days.strftime('%Y-%m-%d'),
+                         'AverageTemp': temp, 'Precip': precip})
+
+
+def crime_rows(rng, snapshot, edges, weights, names, days, start, count):
+    '''
+    One chunk of CrimeData1 rows
+    Inputs:
+        rng: numpy Generator
+        snapshot: GraphSnapshot the crimes are placed on
+        edges: (array of ints) the named snapshot edges
+        weights: (array of floats) probability of a crime on each edge
+        names: (array of strings) block name of each edge
+        days: (pd DatetimeIndex) days crimes can happen on
+        start: (int) ID of the first row
+        count: (int) number of rows
+    Outputs:
+        pandas dataframe indexed by ID
+    '''
+
+    lat = np.asarray(snapshot.lat)
+    lon = np.asarray(snapshot.lon)
+    pick = rng.choice(len(edges), count, p = weights)
+    u = np.asarray(snapshot.u)[edges[pick]]
+    v = np.asarray(snapshot.v)[edges[pick]]
+    t = rng.random(count)
+    crime_lat = lat[u] + (lat[v] - lat[u]) * t + \
+        rng.normal(0, CRIME_NOISE, count)
+    crime_lon = lon[u] + (lon[v] - lon[u]) * t + \
+        rng.normal(0, CRIME_NOISE, count)
+    block = names[pick]
+    scatter = rng.random(count) < SCATTER
+    crime_lat[scatter] = rng.uniform(lat.min(), lat.max(), scatter.sum())
+    crime_lon[scatter] = rng.uniform(lon.min(), lon.max(), scatter.sum())
+    block[scatter] = names[rng.integers(0, len(names), scatter.sum())]
+
+    date = days[rng.integers(0, len(days), count)] + pd.to_timedelta(
+        rng.choice(24, count, p = HOUR_SHARES), unit = 'h') + \
+        pd.to_timedelta(rng.integers(0, 60, count), unit = 'm')
+    types = rng.choice(list(TYPE_SHARES), count,
+                       p = np.array(list(TYPE_SHARES.values())) /
+                       sum(TYPE_SHARES.values()))
+    ids = np.arange(start, start + count)
+    crimes = pd.DataFrame({
+        'Case_Number': ['JZ{:07d}'.format(i) for i in ids],
+        'Date': date.strftime('%Y-%m-%d %H:%M:%S'),
+        'Block': block,
+        'IUCR': '0000',
+        'Primary_Type': types,
+        'Description': 'SYNTHETIC',
+        'Location_Description': 'STREET',
+        'Arrest': False,
+        #state plane feet, roughly
+        'X_Coordinate': np.round((crime_lon + 87.75) * 275000 + 1150000),
+        'Y_Coordinate': np.round((crime_lat - 41.75) * 364000 + 1860000),
+        'Latitude': crime_lat,
+        'Longitude': crime_lon,
+        'Day': date.strftime('%Y-%m-%d'),
+        'Hour': date.hour}, index = pd.Index(ids, name = 'ID'))
+    return crimes
+
+
+def write_crime_db(db, snapshot, crimes, seed = 0, chunk_size = WRITE_CHUNK):
+    '''
+    Writes a synthetic Crime.db with the tables and indexes of the real one
+    Inputs:
+        db: (string) path of the database, replaced if it exists
+        snapshot: GraphSnapshot the crimes are placed on
+        crimes: (int) number of CrimeData1 rows
+        seed: (int) random seed
+        chunk_size: (int) rows generated and written at once
+    Outputs:
+        (string) path of the database
+    '''
+
+    rng = np.random.default_rng(seed)
+    if os.path.exists(db):
+        os.remove(db)
+    c = sqlite3.connect(db)
+    weather = daily_weather(rng)
+    weather.to_sql('DailyWeather', c, index = False)
+
+    edges = np.nonzero(np.asarray(snapshot.name) >= 0)[0]
+    #a few segments get most of the crimes
+    weights = rng.pareto(1.5, len(edges)) + 0.1
+    weights = weights / weights.sum()
+    names = block_names(snapshot, edges)
+    days = pd.DatetimeIndex(pd.to_datetime(weather.Date))
+    for start in range(0, crimes, chunk_size):
+        rows = crime_rows(rng, snapshot, edges, weights, names, days, start,
+                          min(chunk_size, crimes - start))
+        rows.to_sql('CrimeData1', c, if_exists = 'append', index = True)
+    c.commit()
+    build_indexes(c)
+    c.close()
+    return db
+
+
+def route_ends(snapshot, length, count, seed = 0):
+    '''
+    Random route ends a given straight-line distance apart, both inside the
+    grid
+    Inputs:
+        snapshot: GraphSnapshot of the grid
+        length: (float) distance between the ends in km
+        count: (int) number of routes
+        seed: (int) random seed
+    Outputs:
+        list of ((lat, lon), (lat, lon)) pairs
+    '''
+
+    rng = np.random.default_rng([seed, int(length * 1000)])
+    lat = np.asarray(snapshot.lat)
+    lon = np.asarray(snapshot.lon)
+    n_lat, s_lat, e_lon, w_lon = lat.max(), lat.min(), lon.max(), lon.min()
+    ends = []
+    for _ in range(1000 * count):
+        if len(ends) == count:
+            break
+        center_lat = rng.uniform(s_lat, n_lat)
+        center_lon = rng.uniform(w_lon, e_lon)
+        angle = rng.uniform(0, 2 * np.pi)
+        d_lat = length / 2 * math.cos(angle) / 111.32
+        d_lon = length / 2 * math.sin(angle) / (
+            111.32 * math.cos(math.radians(center_lat)))
+        start = (center_lat - d_lat, center_lon - d_lon)
+        end = (center_lat + d_lat, center_lon + d_lon)
+        if all(s_lat <= p[0] <= n_lat and w_lon <= p[1] <= e_lon
+               for p in (start, end)):
+            ends.append((start, end))
+    if len(ends) < count:
+        raise ValueError('Routes of {} km do not fit in the grid'.format(
+            length))
+    return ends
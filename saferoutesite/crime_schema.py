@@ -0,0 +1,152 @@
+'''
+Indexes for the Crime.db schema.
+
+CreatingCrimedb.ipynb writes CrimeData1 and DailyWeather without any
+indexes, so every request scans the whole crime table. This module adds:
+
+  CrimeLocation: an R*Tree over crime coordinates, keyed by CrimeData1 rowid
+  CrimeData1_Day_Hour: CrimeData1(Day, Hour), for weather-driven queries
+  DailyWeather_Temp_Precip: covering DailyWeather(AverageTemp, Precip, Date)
+  DailyWeather_Date: covering DailyWeather(Date, AverageTemp, Precip), for
+      joining crimes back to their day's weather
+
+and checks with EXPLAIN QUERY PLAN that the queries of DataConstructor use
+them. The R*Tree is keyed by rowid, so rerun build (with --rebuild) after a
+VACUUM. Planner statistics are gathered in full on the first build; later
+builds that add rows (after an ingest) only sample ANALYZE_LIMIT rows of
+each index.
+
+Usage:
+    python crime_schema.py build [--db Crime.db] [--rebuild]
+    python crime_schema.py check [--db Crime.db]
+'''
+
+import argparse
+import sqlite3
+
+from SQLRequest3 import Crime_Query
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS CrimeData1_Day_Hour ON CrimeData1(Day, Hour)',
+    'CREATE INDEX IF NOT EXISTS DailyWeather_Temp_Precip ON '
+    'DailyWeather(AverageTemp, Precip, Date)',
+    'CREATE INDEX IF NOT EXISTS DailyWeather_Date ON '
+    'DailyWeather(Date, AverageTemp, Precip)',
+]
+
+#rows of each index read by ANALYZE once the statistics exist
+ANALYZE_LIMIT = 10000
+
+#(temp, precip, t_sens, p_sens, time_low, time_up, lat, lon) of the sample
+#queries checked: a neighbourhood route, a cross-city route and the
+#similar-weather days
+SAMPLE_QUERIES = [
+    (50, 0, 12, 0.5, 10, 14, (41.880, 41.890), (-87.640, -87.620)),
+    (50, 0, 12, 0.5, 10, 14, (41.700, 41.990), (-87.800, -87.550)),
+    (50, 0, 12, 0.5, None, None, None, None),
+]
+
+
+def refresh_rtree(c):
+    '''
+    Adds to the R*Tree every CrimeData1 row it does not cover yet, so the
+    same call builds it from scratch or brings it up to date after an ingest
+    Inputs:
+        c: SQL connection
+    Outputs:
+        (int) number of rows added
+    '''
+
+    c.execute('CREATE VIRTUAL TABLE IF NOT EXISTS CrimeLocation USING '
+              'rtree(id, min_lat, max_lat, min_lon, max_lon)')
+    last = c.execute('SELECT MAX(id) FROM CrimeLocation').fetchone()[0]
+    cursor = c.execute(
+        'INSERT INTO CrimeLocation SELECT rowid, Latitude, Latitude, '
+        'Longitude, Longitude FROM CrimeData1 WHERE rowid > ? AND '
+        'Latitude IS NOT NULL AND Longitude IS NOT NULL',
+        (-1 if last is None else last,))
+    return cursor.rowcount
+
+
+def build_indexes(c, rebuild = False):
+    '''
+    Creates (or brings up to date) the R*Tree and the B-tree indexes and
+    refreshes the planner statistics when rows were added
+    Inputs:
+        c: SQL connection
+        rebuild: (bool) drop and rebuild the R*Tree from scratch
+    Outputs:
+        (int) number of rows added to the R*Tree
+    '''
+
+    if rebuild:
+        c.execute('DROP TABLE IF EXISTS CrimeLocation')
+    added = refresh_rtree(c)
+    for statement in INDEXES:
+        c.execute(statement)
+    analyzed = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                         "AND name = 'sqlite_stat1'").fetchone() is not None
+    if rebuild or not analyzed:
+        c.execute('ANALYZE')
+    elif added:
+        #an ingest adds a small share of the rows, so a sample keeps the
+        #statistics close enough without reading every index in full
+        c.execute('PRAGMA analysis_limit = {}'.format(ANALYZE_LIMIT))
+        c.execute('ANALYZE')
+        c.execute('PRAGMA analysis_limit = 0')
+    c.commit()
+    return added
+
+
+def query_plan(c, query, params):
+    '''
+    Returns the detail lines of EXPLAIN QUERY PLAN for a query
+    '''
+
+    return [row[-1] for row in
+            c.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()]
+
+
+def check_query_plans(c):
+    '''
+    Verifies that none of the sample DataConstructor queries scans a table
+    without an index
+    Inputs:
+        c: SQL connection
+    Outputs:
+        (list of tuples) each sample query's plan; raises AssertionError
+        naming the query and plan when a full scan is found
+    '''
+
+    plans = []
+    for sample in SAMPLE_QUERIES:
+        query, params = Crime_Query(c, *sample)
+        plan = query_plan(c, query, params)
+        for line in plan:
+            #SQLite reports "SCAN <table>" (or "SCAN TABLE <table>" in
+            #older versions) only when it reads a table without an index
+            words = line.split()
+            if words[0] == 'SCAN' and 'INDEX' not in words and \
+                    'VIRTUAL' not in words:
+                raise AssertionError('Full table scan in {}: {}'.format(
+                    query, plan))
+        plans.append((query, plan))
+    return plans
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Build or check the Crime.db indexes')
+    parser.add_argument('command', choices = ['build', 'check'])
+    parser.add_argument('--db', default = 'Crime.db')
+    parser.add_argument('--rebuild', action = 'store_true')
+    args = parser.parse_args()
+    c = sqlite3.connect(args.db)
+    if args.command == 'build':
+        print('{} rows added to CrimeLocation'.format(
+            build_indexes(c, args.rebuild)))
+    for query, plan in check_query_plans(c):
+        print(query)
+        for line in plan:
+            print('    ' + line)
+    c.close()
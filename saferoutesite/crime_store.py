@@ -0,0 +1,366 @@
+'''
+Columnar, memory-mapped copy of Crime.db.
+
+The export step writes CrimeData1 and DailyWeather as typed numpy columns:
+float64 coordinates, temperatures and precipitation (the REAL values of
+SQLite, so every comparison gives the same answer as the SQL query), int8
+hour, int16 day number, int8 crime type code and int32 block name code, with
+crimes sorted by latitude. Serving processes
+memory-map the columns read-only, so every worker on the machine shares the
+same pages, and DataConstructor queries become vectorized masks over a
+latitude slice of the columns instead of SQL row decoding.
+
+After an ingest, update adds only the crimes written since the export
+(by CrimeData1 rowid) and merges them into the sorted columns.
+
+Usage:
+    python crime_store.py export [--db Crime.db] [--out crime_store]
+    python crime_store.py update [--db Crime.db] [--out crime_store]
+'''
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = 'crime_store'
+STORE_FORMAT = 2
+EXPORT_CHUNK = 500000
+
+CRIME_COLUMNS = {'lat': np.float64, 'lon': np.float64, 'hour': np.int8,
+                 'day': np.int16, 'type': np.int8, 'block': np.int32}
+WEATHER_COLUMNS = {'weather_day': np.int16, 'temp': np.float64,
+                   'precip': np.float64}
+
+_STORES = {}
+
+
+class CrimeStore:
+    '''
+    Read-only columnar crime data.
+
+    Days are stored as the number of days since manifest['first_day']; type
+    and block are codes into the types and blocks lists. It can be passed to
+    DataConstructor in place of an SQL connection.
+    '''
+
+    def __init__(self, path, manifest, columns, blocks):
+        self.path = path
+        self.manifest = manifest
+        self.types = np.array(manifest['types'], dtype = object)
+        self.blocks = np.array(blocks, dtype = object)
+        first_day = np.datetime64(manifest['first_day'])
+        self.day_names = np.datetime_as_string(
+            first_day + np.arange(manifest['days']), unit = 'D').astype(object)
+        for key, column in columns.items():
+            setattr(self, key, column)
+
+    def close(self):
+        '''
+        Kept for symmetry with SQL connections; the columns stay mapped and
+        are shared by every caller in the process
+        '''
+
+    def similar_days(self, temp, precip, t_sens, p_sens):
+        '''
+        Boolean mask over day numbers with weather similar to the given one
+        '''
+
+        keep = (self.precip <= precip + p_sens) & (
+            self.precip >= precip - p_sens) & (
+            self.temp <= temp + t_sens) & (self.temp >= temp - t_sens)
+        days = np.zeros(self.manifest['days'], dtype = bool)
+        days[self.weather_day[keep]] = True
+        return days
+
+    def query(self, temp, precip, t_sens, p_sens, time_low = None,
+              time_up = None, lat = None, lon = None):
+        '''
+        Same query, rows and output columns as DataConstructor on Crime.db
+        (rows come in latitude order rather than in SQLite's)
+        '''
+
+        days = self.similar_days(temp, precip, t_sens, p_sens)
+        if not lat:
+            return pd.DataFrame({'Date': self.day_names[np.nonzero(days)[0]]})
+        #crimes are sorted by latitude, so the latitude range is a view
+        lat = np.asarray(lat, dtype = np.float64)
+        lon = np.asarray(lon, dtype = np.float64)
+        start = np.searchsorted(self.lat, lat[0], 'left')
+        end = np.searchsorted(self.lat, lat[1], 'right')
+        lon_col = self.lon[start:end]
+        hour = self.hour[start:end]
+        day = self.day[start:end]
+        mask = (lon_col >= lon[0]) & (lon_col <= lon[1]) & (
+            hour >= time_low) & (hour <= time_up)
+        mask &= days[day]
+        rows = np.nonzero(mask)[0] + start
+        return pd.DataFrame({
+            'Day': self.day_names[self.day[rows]],
+            'Hour': self.hour[rows].astype(np.int64),
+            'Primary_Type': self.types[self.type[rows]],
+            'Block': self.blocks[self.block[rows]],
+            'Latitude': self.lat[rows],
+            'Longitude': self.lon[rows]})
+
+
+def read_weather(c):
+    '''
+    Reads the days of DailyWeather with both a temperature and a
+    precipitation
+    '''
+
+    return pd.read_sql('SELECT Date, AverageTemp, Precip FROM DailyWeather',
+                       c).dropna()
+
+
+def read_crimes(c, first, types, blocks, after, last):
+    '''
+    Reads the store columns of the CrimeData1 rows with rowid in
+    (after, last], in rowid order
+    Inputs:
+        c: SQL connection
+        first: (numpy datetime64) day number 0
+        types, blocks: (dicts) codes of the crime types and block names,
+            extended with any new ones in order of appearance
+        after, last: (ints) rowid range
+    Outputs:
+        (dict) column name to numpy array
+    '''
+
+    parts = {key: [] for key in CRIME_COLUMNS}
+    for chunk in pd.read_sql('SELECT Day, Hour, Primary_Type, Block, '
+                             'Latitude, Longitude FROM CrimeData1 WHERE '
+                             'rowid > ? AND rowid <= ? ORDER BY rowid', c,
+                             params = (after, last),
+                             chunksize = EXPORT_CHUNK):
+        #rows the SQL query can never return (no day, hour or coordinates)
+        chunk = chunk.dropna(subset = ['Day', 'Hour', 'Latitude',
+                                       'Longitude'])
+        parts['lat'].append(chunk.Latitude.values.astype(np.float64))
+        parts['lon'].append(chunk.Longitude.values.astype(np.float64))
+        parts['hour'].append(chunk.Hour.values.astype(np.int8))
+        parts['day'].append((np.array(chunk.Day.tolist(),
+                                      dtype = 'datetime64[D]') -
+                             first).astype(np.int16))
+        parts['type'].append(np.array(
+            [types.setdefault(t, len(types)) for t in chunk.Primary_Type],
+            dtype = np.int8))
+        parts['block'].append(np.array(
+            [blocks.setdefault(b, len(blocks)) for b in chunk.Block],
+            dtype = np.int32))
+    return {key: np.concatenate(parts[key]) if parts[key] else
+            np.zeros(0, dtype = dtype)
+            for key, dtype in CRIME_COLUMNS.items()}
+
+
+def crime_range(c, after = -1):
+    '''
+    Returns the last rowid and the first and last days of the CrimeData1
+    rows after a rowid (None for each when there are none)
+    '''
+
+    return c.execute('SELECT MAX(rowid), MIN(Day), MAX(Day) FROM CrimeData1 '
+                     'WHERE rowid > ?', (after,)).fetchone()
+
+
+def write_store(out, columns, weather, first_day, last_day, types, blocks,
+                last_rowid):
+    '''
+    Writes the columns of a store under a temporary name and renames it into
+    place, so readers never see a partial store
+    Inputs:
+        out: (string) directory of the store
+        columns: (dict) crime columns, sorted by latitude
+        weather: pandas dataframe of DailyWeather days
+        first_day, last_day: (strings) range of the day numbers
+        types, blocks: (dicts) codes of the crime types and block names
+        last_rowid: (int) last CrimeData1 rowid the store covers
+    Outputs:
+        (string) path of the written store
+    '''
+
+    first = np.datetime64(first_day)
+    columns = dict(columns)
+    columns['weather_day'] = (np.array(weather.Date.tolist(),
+                                       dtype = 'datetime64[D]') -
+                              first).astype(np.int16)
+    columns['temp'] = weather.AverageTemp.values.astype(np.float64)
+    columns['precip'] = weather.Precip.values.astype(np.float64)
+
+    tmp_path = out + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for key, dtype in {**CRIME_COLUMNS, **WEATHER_COLUMNS}.items():
+        np.save(os.path.join(tmp_path, key + '.npy'),
+                columns[key].astype(dtype))
+    with open(os.path.join(tmp_path, 'blocks.json'), 'w') as f:
+        json.dump(list(blocks), f)
+    manifest = {'format': STORE_FORMAT,
+                'built': datetime.datetime.now().isoformat(timespec='seconds'),
+                'first_day': str(first_day),
+                'days': int((np.datetime64(last_day) - first).astype(int)) + 1,
+                'crimes': int(len(columns['lat'])),
+                'types': list(types),
+                'last_rowid': int(last_rowid)}
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    os.replace(tmp_path, out)
+    return out
+
+
+def export_store(db = 'Crime.db', out = STORE_DIR):
+    '''
+    Writes the columns of a Crime.db into a store directory
+    Inputs:
+        db: (string) path to the crime database
+        out: (string) directory of the store
+    Outputs:
+        (string) path of the written store
+    '''
+
+    c = sqlite3.connect(db)
+    weather = read_weather(c)
+    last_rowid, first_crime, last_crime = crime_range(c)
+    first_day = min(weather.Date.min(), first_crime)
+    last_day = max(weather.Date.max(), last_crime)
+    types = {}
+    blocks = {}
+    columns = read_crimes(c, np.datetime64(first_day), types, blocks, -1,
+                          last_rowid)
+    c.close()
+
+    order = np.argsort(columns['lat'], kind = 'stable')
+    columns = {key: column[order] for key, column in columns.items()}
+    return write_store(out, columns, weather, first_day, last_day, types,
+                       blocks, last_rowid)
+
+
+def update_store(db = 'Crime.db', out = STORE_DIR):
+    '''
+    Adds the CrimeData1 rows written since a store was exported, and the
+    current DailyWeather, without reading the older crimes from Crime.db
+    again. The result is the same as a new export; a store exported before
+    stores recorded their last rowid is exported in full.
+    Inputs:
+        db: (string) path to the crime database
+        out: (string) directory of the store
+    Outputs:
+        (string) path of the written store
+    '''
+
+    path = os.path.join(out, 'manifest.json')
+    if not os.path.exists(path):
+        return export_store(db, out)
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest['format'] != STORE_FORMAT or 'last_rowid' not in manifest:
+        return export_store(db, out)
+    store = load_store(out)
+
+    c = sqlite3.connect(db)
+    weather = read_weather(c)
+    last_rowid, first_crime, last_crime = crime_range(
+        c, manifest['last_rowid'])
+    old_first = np.datetime64(manifest['first_day'])
+    old_last = str(old_first + manifest['days'] - 1)
+    first_day = min(day for day in (manifest['first_day'],
+                                    weather.Date.min(), first_crime) if day)
+    last_day = max(day for day in (old_last, weather.Date.max(), last_crime)
+                   if day)
+    first = np.datetime64(first_day)
+    #new types and blocks get the codes a full export would give them, as
+    #they first appear after every older row
+    types = {t: i for i, t in enumerate(manifest['types'])}
+    blocks = {b: i for i, b in enumerate(store.blocks)}
+    if last_rowid is None:
+        last_rowid = manifest['last_rowid']
+    new = read_crimes(c, first, types, blocks, manifest['last_rowid'],
+                      last_rowid)
+    c.close()
+
+    #ties with older rows go after them, as in the stable sort of a full
+    #export
+    order = np.argsort(new['lat'], kind = 'stable')
+    at = np.searchsorted(store.lat, new['lat'][order], 'right')
+    shift = int((old_first - first).astype(int))
+    columns = {}
+    for key in CRIME_COLUMNS:
+        old = np.asarray(getattr(store, key))
+        if key == 'day':
+            old = old + shift
+        columns[key] = np.insert(old, at, new[key][order])
+    return write_store(out, columns, weather, first_day, last_day, types,
+                       blocks, last_rowid)
+
+
+def load_store(path = STORE_DIR):
+    '''
+    Memory-maps a store read-only
+    Inputs:
+        path: (string) directory of the store
+    Outputs:
+        CrimeStore
+    '''
+
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['format'] != STORE_FORMAT:
+        raise ValueError("Crime store '{}' has format {}, expected {}".format(
+            path, manifest['format'], STORE_FORMAT))
+    columns = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode = 'r')
+               for key in {**CRIME_COLUMNS, **WEATHER_COLUMNS}}
+    with open(os.path.join(path, 'blocks.json')) as f:
+        blocks = json.load(f)
+    return CrimeStore(path, manifest, columns, blocks)
+
+
+def store_version(path = STORE_DIR):
+    '''
+    Version of the store at path: the modification time of its manifest,
+    which every export writes anew, or None when no store has been exported
+    there
+    '''
+
+    try:
+        return os.stat(os.path.join(path, 'manifest.json')).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_store(path = STORE_DIR):
+    '''
+    Returns the store at path, loading it on first use and again whenever
+    it has been exported anew, or None when no store has been exported there
+    '''
+
+    #keyed by absolute path, as the relative default depends on the
+    #working directory
+    path = os.path.abspath(path)
+    version = store_version(path)
+    if version is None:
+        return None
+    if path not in _STORES or _STORES[path][0] != version:
+        _STORES[path] = (version, load_store(path))
+    return _STORES[path][1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Export Crime.db into a columnar memory-mapped store')
+    parser.add_argument('command', choices = ['export', 'update'])
+    parser.add_argument('--db', default = 'Crime.db')
+    parser.add_argument('--out', default = STORE_DIR)
+    args = parser.parse_args()
+    if args.command == 'update':
+        print(update_store(args.db, args.out))
+    else:
+        print(export_store(args.db, args.out))
@@ -0,0 +1,188 @@
+'''
+Compact array-backed walk graph used for routing.
+
+Nodes are numbered 0..n-1 and edges 0..m-1. Node coordinates are float
+arrays and each undirected edge is stored once in the u, v, length and name
+arrays (the same layout as a GraphSnapshot). Adjacency is kept in CSR form:
+the neighbours of node i are targets[offsets[i]:offsets[i + 1]] and the
+edge ids of those entries are in edge_ids, so per-edge values such as
+lengths or safety weights are plain arrays indexed by edge id.
+'''
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from spatial_index import NodeIndex
+
+
+class CSRGraph:
+    '''
+    Undirected walk graph in compressed sparse row form.
+
+    Inputs:
+        osmid, lat, lon: node arrays
+        u, v, length: edge arrays (endpoints as node numbers, length in m)
+        name: optional edge array indexing into names, -1 when unnamed
+        names: optional list of street names
+        nid, eid: optional node and edge ids in the graph this one was cut
+            from (the citywide snapshot); default to 0..n-1 and 0..m-1
+    '''
+
+    def __init__(self, osmid, lat, lon, u, v, length, name = None,
+                 names = None, nid = None, eid = None):
+        self.osmid = np.asarray(osmid, dtype = np.int64)
+        self.lat = np.asarray(lat, dtype = np.float64)
+        self.lon = np.asarray(lon, dtype = np.float64)
+        self.u = np.asarray(u, dtype = np.int32)
+        self.v = np.asarray(v, dtype = np.int32)
+        self.length = np.asarray(length, dtype = np.float64)
+        n = len(self.osmid)
+        m = len(self.u)
+        self.name = np.full(m, -1, dtype = np.int32) if name is None \
+            else np.asarray(name, dtype = np.int32)
+        self.names = names if names is not None else []
+        self.nid = np.arange(n) if nid is None else np.asarray(nid)
+        self.eid = np.arange(m) if eid is None else np.asarray(eid)
+        #cache for values derived from the graph, as networkx's G.graph
+        self.graph = {}
+
+        heads = np.concatenate((self.u, self.v))
+        order = np.argsort(heads, kind = 'stable')
+        self.targets = np.concatenate((self.v, self.u))[order]
+        self.edge_ids = np.concatenate((np.arange(m), np.arange(m)))[
+            order].astype(np.int32)
+        self.offsets = np.zeros(n + 1, dtype = np.int64)
+        np.cumsum(np.bincount(heads, minlength = n), out = self.offsets[1:])
+
+    @classmethod
+    def from_networkx(cls, G):
+        '''
+        Converts a networkx (multi)graph with x/y node attributes and length
+        (and optionally name) edge attributes
+        '''
+
+        nodes = list(G.nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        lat = [G.nodes[node]['y'] for node in nodes]
+        lon = [G.nodes[node]['x'] for node in nodes]
+        names = []
+        name_index = {}
+        u, v, length, name = [], [], [], []
+        for start, end, attrs in G.edges(data = True):
+            u.append(index[start])
+            v.append(index[end])
+            length.append(attrs['length'])
+            street = attrs.get('name')
+            if street is None:
+                name.append(-1)
+                continue
+            if isinstance(street, list):
+                street = '; '.join(street)
+            if street not in name_index:
+                name_index[street] = len(names)
+                names.append(street)
+            name.append(name_index[street])
+        return cls(nodes, lat, lon, u, v, length, name, names)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        '''
+        Builds the citywide graph from a GraphSnapshot
+        '''
+
+        return cls(snapshot.osmid, snapshot.lat, snapshot.lon, snapshot.u,
+                   snapshot.v, snapshot.length, snapshot.name, snapshot.names)
+
+    @property
+    def num_nodes(self):
+        return len(self.osmid)
+
+    @property
+    def num_edges(self):
+        return len(self.u)
+
+    @property
+    def named(self):
+        return self.name >= 0
+
+    def adjacency(self):
+        '''
+        Returns the offsets, targets and edge_ids arrays as Python lists,
+        converted once per graph, which is what the pure Python search loop
+        indexes fastest
+        '''
+
+        if 'adjacency' not in self.graph:
+            self.graph['adjacency'] = (self.offsets.tolist(),
+                                       self.targets.tolist(),
+                                       self.edge_ids.tolist())
+        return self.graph['adjacency']
+
+    def node_index(self, with_edges = False):
+        '''
+        Returns the KD-tree NodeIndex over node numbers, built on first use.
+        With edges, nearest_edge returns (u, v, edge id) tuples.
+        '''
+
+        index = self.graph.get('node_index')
+        if index is None or (with_edges and index.edges is None):
+            edges = None
+            if with_edges:
+                edges = list(zip(self.u.tolist(), self.v.tolist(),
+                                 range(self.num_edges)))
+            index = NodeIndex(range(self.num_nodes), self.lat, self.lon, edges)
+            self.graph['node_index'] = index
+        return index
+
+    def subgraph(self, node_mask):
+        '''
+        Induced subgraph on the nodes selected by a boolean mask
+        '''
+
+        return induced_subgraph(self, node_mask)
+
+    def largest_component(self):
+        '''
+        Subgraph made of the largest connected component
+        '''
+
+        n = self.num_nodes
+        if n == 0:
+            return self
+        matrix = csr_matrix((np.ones(len(self.targets)), self.targets,
+                             self.offsets), shape = (n, n))
+        _, labels = connected_components(matrix, directed = False)
+        largest = np.argmax(np.bincount(labels))
+        return self.subgraph(labels == largest)
+
+
+def induced_subgraph(source, node_mask):
+    '''
+    Cuts the nodes selected by node_mask, and the edges between them, out of
+    a CSRGraph or a GraphSnapshot (both expose the same node and edge arrays)
+    Inputs:
+        source: CSRGraph or GraphSnapshot
+        node_mask: boolean array over the nodes of source
+    Outputs:
+        CSRGraph whose nid and eid refer back to the ids of source's parent
+        (or of source itself when it is a snapshot)
+    '''
+
+    node_mask = np.asarray(node_mask, dtype = bool)
+    u = np.asarray(source.u)
+    v = np.asarray(source.v)
+    nodes = np.nonzero(node_mask)[0]
+    edges = np.nonzero(node_mask[u] & node_mask[v])[0]
+    local = np.full(len(node_mask), -1, dtype = np.int64)
+    local[nodes] = np.arange(len(nodes))
+    nid = getattr(source, 'nid', None)
+    eid = getattr(source, 'eid', None)
+    return CSRGraph(np.asarray(source.osmid)[nodes],
+                    np.asarray(source.lat)[nodes],
+                    np.asarray(source.lon)[nodes],
+                    local[u[edges]], local[v[edges]],
+                    np.asarray(source.length)[edges],
+                    np.asarray(source.name)[edges], source.names,
+                    nodes if nid is None else nid[nodes],
+                    edges if eid is None else eid[edges])
@@ -1,5 +1,15 @@
-import requests
-import bs4
+import os
+import threading
+import time
+
+from metrics import record_event, stage
+
+KMDW_URL = 'https://w1.weather.gov/data/obhistory/KMDW.html'
+#observations at Midway are hourly, so a few minutes old is still current
+WEATHER_TTL = 600
+#saved observation page used in place of weather.gov in tests
+WEATHER_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'fixtures', 'KMDW.html')
 
 #The following two functions are from util.py in PA2
 def get_request(url):
@@ -18,6 +28,8 @@ def get_request(url):
     '''
 
     #modified; only accepts absolute urls 
+    import requests
+
     try:
         r = requests.get(url)
         if r.status_code == 404 or r.status_code == 403:
@@ -59,16 +71,24 @@ def url_to_html(url):
     return html
 
 
-def get_current_weather():
+class WeatherUnavailable(Exception):
     '''
-    Retrieves most recent weather from Midway Airport.
+    Raised when the weather cannot be fetched and no earlier value is known
+    '''
+
+
+def parse_observations(html):
+    '''
+    Reads the latest observation off the weather.gov observation history
+    page.
     Inputs:
-        None 
+        html: (string) the page
     Outputs:
         Tuple of (Temperature, Precipitation)
     '''
-    
-    html = url_to_html('https://w1.weather.gov/data/obhistory/KMDW.html')
+
+    import bs4
+
     soup = bs4.BeautifulSoup(html, "html5lib")
     table_tags = soup.find_all('table')
     table = table_tags[3]
@@ -82,3 +102,156 @@ def get_current_weather():
         precip = float(precip)
     return temp, precip
 
+
+def fetch_current_weather(url = KMDW_URL):
+    '''
+    Retrieves most recent weather from Midway Airport.
+    Inputs:
+        url: (string) observation history page
+    Outputs:
+        Tuple of (Temperature, Precipitation); raises WeatherUnavailable if
+        the page cannot be read
+    '''
+
+    html = url_to_html(url)
+    if not html:
+        raise WeatherUnavailable('Could not read ' + url)
+    return parse_observations(html)
+
+
+def fixture_fetcher(path = WEATHER_FIXTURE):
+    '''
+    Returns a fetch function reading a saved observation page instead of
+    weather.gov, for tests and benchmarks
+    '''
+
+    def fetch():
+        with open(path) as f:
+            return parse_observations(f.read())
+    return fetch
+
+
+class WeatherProvider:
+    '''
+    Current weather with a TTL cache.
+
+    A fresh value is served from memory. Once it is older than ttl seconds
+    the stale value is still served while one background thread refreshes
+    it; only when nothing has been fetched yet does a caller wait, and then
+    concurrent callers share a single fetch. A failed fetch keeps the last
+    good value.
+    '''
+
+    def __init__(self, fetch = fetch_current_weather, ttl = WEATHER_TTL,
+                 clock = time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.value = None
+        self.fetched_at = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+
+    def after_fork(self):
+        '''
+        Resets the lock and the refresh flag in a forked process, where the
+        thread that held them does not exist
+        '''
+
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.refreshing = False
+
+    def refresh(self):
+        '''
+        Fetches the weather once, keeping the last good value on failure
+        Outputs:
+            (bool) whether the fetch succeeded
+        '''
+
+        try:
+            with stage('weather_fetch'):
+                value = self.fetch()
+        except Exception:
+            record_event('weather_fetch_failed')
+            value = None
+        with self.ready:
+            if value is not None:
+                self.value = value
+                self.fetched_at = self.clock()
+            self.refreshing = False
+            self.ready.notify_all()
+        return value is not None
+
+    def current(self):
+        '''
+        Returns the cached weather, refreshing it as described above
+        Outputs:
+            Tuple of (Temperature, Precipitation)
+        '''
+
+        with self.lock:
+            value = self.value
+            stale = value is None or \
+                self.clock() - self.fetched_at >= self.ttl
+            start = stale and not self.refreshing
+            if start:
+                self.refreshing = True
+        if value is not None:
+            if start:
+                threading.Thread(target = self.refresh, daemon = True).start()
+            return value
+        if start:
+            self.refresh()
+        with self.ready:
+            #another caller may be fetching; wait for its result
+            self.ready.wait_for(lambda: not self.refreshing)
+            if self.value is None:
+                raise WeatherUnavailable('No weather observation available')
+            return self.value
+
+    def get(self, temp = None, precip = None):
+        '''
+        Fills in whichever of temperature and precipitation was not given
+        with the current weather; nothing is fetched when both are given
+        Outputs:
+            Tuple of (Temperature, Precipitation)
+        '''
+
+        if temp is not None and precip is not None:
+            return temp, precip
+        current_temp, current_precip = self.current()
+        if temp is None:
+            temp = current_temp
+        if precip is None:
+            precip = current_precip
+        return temp, precip
+
+
+_PROVIDER = WeatherProvider()
+os.register_at_fork(after_in_child = lambda: _PROVIDER.after_fork())
+
+
+def set_provider(provider):
+    '''
+    Replaces the provider used by get_current_weather, e.g. with one built
+    on fixture_fetcher in tests
+    '''
+
+    global _PROVIDER
+    _PROVIDER = provider
+
+
+def get_current_weather(temp = None, precip = None):
+    '''
+    Retrieves most recent weather from Midway Airport through the cached
+    provider.
+    Inputs:
+        temp, precip: values given by the user, if any; they are kept and
+            the weather is not fetched when both are given
+    Outputs:
+        Tuple of (Temperature, Precipitation)
+    '''
+
+    return _PROVIDER.get(temp, precip)
@@ -1,15 +1,59 @@
-import osmnx as ox
-import networkx as nx
-import geopy.geocoders
+import asyncio
 import datetime
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import math
 from math import radians, cos, sin, asin, sqrt
-from scipy import stats
 
-from geopy.geocoders import Nominatim
-from SQLRequest3 import Regression_List 
+from geocoding import get_geocoder
+from SQLRequest3 import Regression_Array, Regression_Edges, \
+    Regression_Hours, Regression_Edge_Hours, Crime_Data
 from current_weather import get_current_weather
+from graph_snapshot import get_snapshot, bbox_subgraph
+from graph_tiles import get_tiles
+from routing import bidirectional_astar, one_to_many, alternative_paths, \
+    NoPath
+from score_cube import get_cube
+from route_cache import get_route_cache
+from landmarks import alt_potential, get_landmarks
+from metrics import record_event, record_size, stage, submit
+from severity import severity_ready
+
+# temperature, precipitation and time sensitivities of the scores
+T_SENS = 12
+P_SENS = 0.5
+HOUR_WINDOW = 2
+#hours of departure compared by go_sweep
+SWEEP_HOURS = range(24)
+#routes offered by go_alternatives, and seconds after which it starts no
+#new search
+ALT_ROUTES = 3
+ALT_BUDGET = 2
+#blocks are boxes rounded outward to 4 decimals around their edge
+BLOCK_MARGIN = 0.0001
+
+#threads running the independent stages of go() side by side
+STAGE_WORKERS = 4
+_STAGES = None
+
+
+def new_stage_pool():
+    '''
+    Create the thread pool for the stages of go(); called again in every
+    forked process (see worker_pool), whose copy of the parent's pool has
+    no threads
+    '''
+
+    global _STAGES
+    _STAGES = ThreadPoolExecutor(max_workers = STAGE_WORKERS,
+                                 thread_name_prefix = 'go-stage')
+
+
+new_stage_pool()
+os.register_at_fork(after_in_child = new_stage_pool)
+
    
 def get_coordinates(start_address, end_address):
     '''
@@ -25,16 +69,15 @@ def get_coordinates(start_address, end_address):
           ending addresses
     '''
 
-    geolocator = Nominatim(user_agent="saferoute",\
-                           format_string="%s, Chicago IL")
-
-    start_loc = geolocator.geocode(start_address)
-    end_loc = geolocator.geocode(end_address)
+    #both ends in one lookup; most addresses never reach Nominatim
+    with stage('geocode'):
+        start_loc, end_loc = get_geocoder().geocode_many([start_address,
+                                                          end_address])
     start_coord = None
     end_coord = None
     if start_loc and end_loc:
-        start_coord = (start_loc.latitude, start_loc.longitude)
-        end_coord = (end_loc.latitude, end_loc.longitude)
+        start_coord = start_loc
+        end_coord = end_loc
     return start_coord, end_coord
 
 
@@ -78,7 +121,10 @@ def get_bounding_box(start_coord, end_coord):
 def get_graph(n_lat, s_lat, e_lon, w_lon): 
     '''
     Using the bounding box, obtain an undirected graph representing the 
-    desired section of the city in which the route will take place
+    desired section of the city in which the route will take place. The
+    graph is cut out of the prebuilt citywide snapshot (see graph_snapshot),
+    so no network access happens here; when the snapshot has been cut into
+    tiles (see graph_tiles), only the tiles the box intersects are read.
     
     Inputs:
       n_lat (float): the northermost latitude of the bounding box
@@ -87,42 +133,60 @@ def get_graph(n_lat, s_lat, e_lon, w_lon):
       w_lon (float): the westernmost longitude of the bounding box
      
     Output:
-      A networkx graph  
+      (CSRGraph) the array-backed graph
     '''
 
-    B = ox.core.graph_from_bbox(n_lat, s_lat, e_lon, w_lon,\
-                                network_type= 'walk', simplify=True,\
-                                retain_all=False, truncate_by_edge=False,\
-                                name='bounded', timeout=180, memory=None,\
-                                max_query_area_size=2500000000,\
-                                clean_periphery=True,\
-                                infrastructure='way["highway"]',\
-                                custom_filter=None)
-    
-    B_undirected = ox.save_load.get_undirected(B)
-    
-    return B_undirected
+    snapshot = get_snapshot()
+    tiles = get_tiles(snapshot)
+    with stage('get_graph'):
+        if tiles is not None:
+            G = tiles.subgraph(n_lat, s_lat, e_lon, w_lon)
+        else:
+            G = bbox_subgraph(snapshot, n_lat, s_lat, e_lon, w_lon)
+    record_size('graph_nodes', G.num_nodes)
+    record_size('graph_edges', G.num_edges)
+    return G
+
+
+#score of unnamed edges, which have no crime data; used only as a last resort
+UNSCORED = 10**12
 
 
 def update_edge_lengths(G, scores):
     '''
-    Update the lengths of each edge in the graph in order to weight them
-    according to their safety scores
+    Weight the length of each edge in the graph according to its safety
+    score with one vectorized multiply. The base lengths in G are left
+    untouched, so the same graph can be reweighted for another request.
     
     Inputs:
-      G (networkx graph): the graph
-      scores (dictionary): the safety score for each edge
+      G (CSRGraph): the graph
+      scores (array of floats): the safety score of each edge, indexed by
+          edge id
+
+    Output:
+      (array of floats): the weight of every edge, indexed by edge id
     '''
 
-    set_edge_dict = {}
-    new_attrs = {}
-    for start, end, attrs in list(G.edges(data = True)):
-        length = attrs['length']
-        score = scores.get(edge_to_latlon_pair(G, (start, end)), 10**12)
-        weight = score * length
-        set_edge_dict[(start, end,0)] = {'length': weight}
+    return G.length * scores
+
+
+def edge_scores(G, edges, block_scores):
+    '''
+    Spread the safety scores computed for some edges over an array covering
+    every edge of the graph
     
-    nx.set_edge_attributes(G, set_edge_dict)
+    Inputs:
+      G (CSRGraph): the graph
+      edges (array of ints): the ids of the scored edges
+      block_scores (array of floats): the score of each edge in edges
+
+    Output:
+      (array of floats): the safety score of every edge, indexed by edge id
+    '''
+
+    scores = np.full(G.num_edges, UNSCORED, dtype=float)
+    scores[edges] = block_scores
+    return scores
 
 
 def edge_to_latlon_pair(G, edge):
@@ -131,70 +195,103 @@ def edge_to_latlon_pair(G, edge):
     corresponding to the nodes of the edge
     
     Inputs:
-      G (networkx graph): the graph
-      edge (networkx edge): the desired edge to convert
+      G (CSRGraph): the graph
+      edge (int): the id of the desired edge to convert
     
     Output:
       (tuple of tuple of floats): the pair of coordinates 
     '''
 
-    node1 = G.nodes[edge[0]]
-    node2 = G.nodes[edge[1]]
-    n1 = (node1['y'], node1['x'])
-    n2 = (node2['y'], node2['x'])
+    node1 = G.u[edge]
+    node2 = G.v[edge]
+    n1 = (float(G.lat[node1]), float(G.lon[node1]))
+    n2 = (float(G.lat[node2]), float(G.lon[node2]))
     return ((n1),(n2))
 
 
-def get_path(start_coord, end_coord, G, nodes, scores):
+def get_path(start_coord, end_coord, G, scores):
     '''
     Find the closest nodes to the start and the destination in the graph
-    and use them to compute the shortest weighted path in between
+    (using the graph's KD-tree node index) and use them to compute the
+    shortest weighted path in between with a bidirectional A* search
     
     Inputs:
       start_coord (tuple of floats): the coordinates of the starting point in
           the route
       end_coord (tuple of floats): the coordinates of the destination of the 
           route 
-      G (networkx graph): the graph
-      nodes (list of nodes): the list of graph nodes
-      scores (dictionary): the safety score dictionary
+      G (CSRGraph): the graph
+      scores (array of floats): the safety score of each edge
     
     Output:
-      (list of nodes) the safest path in terms of graph nodes
+      (tuple) the safest path in terms of graph node numbers and its
+          weighted length
     '''
 
-    update_edge_lengths(G, scores)
+    weights = update_edge_lengths(G, scores)
 
-    s_min_lon_dist = 0.001
-    s_min_lat_dist = 0.001
-    e_min_lon_dist = 0.001
-    e_min_lat_dist = 0.001
-    start_node = None
-    end_node = None
-    
-    for node, attrs in nodes:
-        lat = attrs['y']
-        lon = attrs['x']
-        s_lat_dist = abs(start_coord[0] - lat)
-        s_lon_dist = abs(start_coord[1] - lon)
-        e_lat_dist = abs(end_coord[0] - lat)
-        e_lon_dist = abs(end_coord[1] - lon)
-        if s_lat_dist <= s_min_lat_dist and s_lon_dist <= s_min_lon_dist:
-            s_min_lat_dist = s_lat_dist
-            s_min_lon_dist = s_lon_dist
-            start_node = node
-        if e_lat_dist <= e_min_lat_dist and e_lon_dist <= e_min_lon_dist:
-            e_min_lat_dist = e_lat_dist
-            e_min_lon_dist = e_lon_dist
-            end_node = node
-    
-    path = nx.dijkstra_path(G, start_node, end_node, weight='length')
-    #length of the shortest path
-    s_length = nx.shortest_path_length(
-        G, source=start_node, target=end_node, weight='length')    
+    index = G.node_index()
+    start_node, end_node = index.nearest_many([start_coord, end_coord])
+
+    with stage('search'):
+        #landmark bounds, when built for the snapshot, guide the search
+        potential = alt_potential(G, start_node, end_node, weights,
+                                  get_landmarks(get_snapshot()))
+        #one search gives both the path and its length
+        path, s_length = bidirectional_astar(G, start_node, end_node,
+                                             weights, potential)
     return path, s_length
 
 
+def get_alternatives(start_coord, end_coord, G, scores, count = ALT_ROUTES,
+                     budget = ALT_BUDGET):
+    '''
+    Find up to count different routes between the nodes closest to the
+    start and the destination, from the safest to the shortest: the
+    cheapest path is searched under the weights length * score ** alpha for
+    alpha going from 1 (the weights of get_path) to 0 (plain length), then
+    penalty-based alternatives to the safest path fill in the remaining
+    routes (see routing.alternative_paths)
+
+    Inputs:
+      start_coord, end_coord, G, scores: as in get_path
+      count (int): most routes returned
+      budget (float): seconds after which no new search starts; the safest
+          route is always found
+
+    Output:
+      (list of tuples) path in terms of graph node numbers, its length in
+          meters, its safety cost (its weighted length in get_path) over
+          the scored edges and its length in meters over the unscored ones,
+          for each route from the safest to the least safe
+    '''
+
+    deadline = time.perf_counter() + budget
+    alphas = np.linspace(1, 0, count) if count > 1 else [1]
+    weight_sets = [G.length * scores ** alpha for alpha in alphas]
+
+    index = G.node_index()
+    start_node, end_node = index.nearest_many([start_coord, end_coord])
+    landmarks = get_landmarks(get_snapshot())
+
+    with stage('alternatives'):
+        found = alternative_paths(
+            G, start_node, end_node, weight_sets, count,
+            lambda weights: alt_potential(G, start_node, end_node, weights,
+                                          landmarks), deadline = deadline)
+    #unscored edges weigh UNSCORED times their length in the search; the
+    #cost only counts the scored ones, so it stays a weighted length
+    unscored = scores >= UNSCORED
+    routes = []
+    for path, edges in found:
+        off = unscored[edges]
+        routes.append((path, float(G.length[edges].sum()),
+                       float(weight_sets[0][edges[~off]].sum()),
+                       float(G.length[edges[off]].sum())))
+    #as the search ranks them: least unscored length, then least cost
+    return sorted(routes, key = lambda route: (route[3], route[2]))
+
+
 #From PA3 (modified)
 def haversine(t1, t2):
     '''
@@ -233,6 +330,166 @@ def lognorm(x):
     return p
 
 
+def travel_conditions(date = None, hour = None, temp = None, precip = None):
+    '''
+    Fill in the travel conditions the user left out: today, the current hour
+    and the current weather at Midway
+
+    Output:
+      (tuple) date (string), hour (int), temp and precip
+    '''
+
+    current_DT = datetime.datetime.now()
+    # handle optional args and set to defaults if necessary
+    if not date:
+        date = current_DT.strftime('%Y-%m-%d') 
+    #hour 0 (midnight) is a given hour
+    if hour is None:
+        hour = current_DT.hour
+    #weather.gov is only asked (through the cache) for the missing values
+    with stage('weather'):
+        temp, precip = get_current_weather(temp, precip)
+    return date, hour, temp, precip
+
+
+def graph_scores(G, date, hour, temp, precip, data = None):
+    '''
+    Compute the safety score of every edge of a graph under the given
+    travel conditions, from the score cube when it covers them and from the
+    regression otherwise; the regression reads the per-edge daily severity
+    (see severity) when it has been built for the snapshot, and raw crimes
+    if not
+
+    Inputs:
+      data: optional crime and weather data for the regression, loaded
+          ahead of time by region_data
+
+    Output:
+      (array of floats): the safety score of every edge, indexed by edge id
+    '''
+
+    edges = np.nonzero(G.named)[0]
+
+    #common conditions are served from the precomputed score cube
+    block_scores = None
+    cube = get_cube(get_snapshot())
+    if cube is not None:
+        with stage('score_cube'):
+            block_scores = cube.scores(G.eid[edges], hour, temp, precip,\
+                                       date, T_SENS, P_SENS)
+        if block_scores is not None:
+            record_event('score_cube_hit')
+    if block_scores is None and data is None and \
+            severity_ready(get_snapshot()):
+        block_scores = Regression_Edges(G.eid[edges], temp, precip, T_SENS,\
+                                        P_SENS, date, hour - HOUR_WINDOW,\
+                                        hour + HOUR_WINDOW)
+    if block_scores is None:
+        with stage('blocks'):
+            edges_lst = [edge_to_latlon_pair(G, edge) for edge in edges]
+        block_scores = Regression_Array(edges_lst, temp, precip, T_SENS,\
+                                        P_SENS, date, hour - HOUR_WINDOW,\
+                                        hour + HOUR_WINDOW, data)
+    return edge_scores(G, edges, block_scores)
+
+
+def region_data(n_lat, s_lat, e_lon, w_lon, hour, temp, precip,
+                sweep = False):
+    '''
+    Load the crime and weather data the regression needs for every block
+    of the graph cut out of a bounding box, or None when the score cube
+    covers the conditions or the per-edge severity has been built, and the
+    data will not be needed
+
+    Inputs:
+      sweep (bool): load the data of every hour of SWEEP_HOURS (see
+          sweep_scores) rather than of hour alone
+    '''
+
+    hours = SWEEP_HOURS if sweep else [hour]
+    snapshot = get_snapshot()
+    cube = get_cube(snapshot)
+    if cube is not None and all(cube.key(hour, temp, precip, T_SENS, P_SENS)\
+                                is not None for hour in hours):
+        return None
+    if severity_ready(snapshot):
+        return None
+    return Crime_Data(temp, precip, T_SENS, P_SENS, min(hours) - HOUR_WINDOW,
+                      max(hours) + HOUR_WINDOW, (s_lat - BLOCK_MARGIN,
+                      n_lat + BLOCK_MARGIN), (w_lon - BLOCK_MARGIN,
+                      e_lon + BLOCK_MARGIN))
+
+
+def sweep_scores(G, date, temp, precip, data = None):
+    '''
+    Compute the safety score of every edge of a graph for every hour of
+    SWEEP_HOURS, as graph_scores would for each hour: from the score cube
+    when it covers the conditions and otherwise from a single regression
+    pass over every hour window (see SQLRequest3.Window_Scores)
+
+    Inputs:
+      data: optional crime and weather data covering the whole day, loaded
+          ahead of time by region_data
+
+    Output:
+      (list of arrays of floats): the safety score of every edge, indexed
+          by edge id, for each hour of SWEEP_HOURS
+    '''
+
+    edges = np.nonzero(G.named)[0]
+    windows = [(hour - HOUR_WINDOW, hour + HOUR_WINDOW) for hour in
+               SWEEP_HOURS]
+
+    block_scores = None
+    cube = get_cube(get_snapshot())
+    if cube is not None:
+        with stage('score_cube'):
+            block_scores = [cube.scores(G.eid[edges], hour, temp, precip,\
+                                        date, T_SENS, P_SENS)
+                            for hour in SWEEP_HOURS]
+        if any(scores is None for scores in block_scores):
+            block_scores = None
+        else:
+            record_event('score_cube_hit')
+    if block_scores is None and data is None and \
+            severity_ready(get_snapshot()):
+        block_scores = Regression_Edge_Hours(G.eid[edges], temp, precip,\
+                                             T_SENS, P_SENS, date, windows)
+    if block_scores is None:
+        with stage('blocks'):
+            edges_lst = [edge_to_latlon_pair(G, edge) for edge in edges]
+        block_scores = Regression_Hours(edges_lst, temp, precip, T_SENS,\
+                                        P_SENS, date, windows, data)
+    return [edge_scores(G, edges, scores) for scores in block_scores]
+
+
+def path_steps(G, path):
+    '''
+    Convert a path of node numbers into a list of [lat, lon] steps
+    '''
+
+    return np.column_stack((G.lat[path], G.lon[path])).tolist()
+
+
+def route_result(route_steps, s_length, start_coord, end_coord):
+    '''
+    Turn the steps of a route into the route coordinates and the relative
+    safety score shown to the user
+
+    Output:
+      (tuple) list of [lat, lon] steps from start_coord to end_coord and the
+          percentage of Chicago paths this one is safer than (all of them
+          when both addresses are at the same place)
+    '''
+
+    path_coords = [[start_coord[0],start_coord[1]]] + route_steps +\
+                  [[end_coord[0],end_coord[1]]]
+    distance = haversine(start_coord, end_coord)
+    if not distance:
+        return path_coords, 100.0
+    return path_coords,(1-lognorm(s_length/distance))*100
+
+
 def go(args):
     '''
     Pull data from the crime database and weather information in order to 
@@ -254,51 +511,240 @@ def go(args):
       coordinates
     '''
 
-    start_address = args["start_address"]
-    end_address = args["end_address"]
-    date = args["date_of_travel"]
-    hour = args["hour_of_travel"]
-    temp = args["temperature"]
-    precip = args["precipitation"]
+    #the weather and both addresses are looked up side by side
+    conditions = submit(
+        _STAGES, travel_conditions, args["date_of_travel"],
+        args["hour_of_travel"], args["temperature"], args["precipitation"])
+    coords = submit(_STAGES, get_coordinates, args["start_address"],
+                    args["end_address"])
+    date, hour, temp, precip = conditions.result()
+    start_coord, end_coord = coords.result()
 
-    current_DT = datetime.datetime.now()
-    # handle optional args and set to defaults if necessary
-    if not date:
-        date = current_DT.strftime('%Y-%m-%d') 
-    if not hour:
-        hour = current_DT.hour
-    current_temp, current_precip = get_current_weather()
-    if not temp:
-        temp = current_temp
-    if not precip:
-        precip = current_precip
-    start_coord, end_coord = get_coordinates(start_address, end_address)
+    if not start_coord or not end_coord:
+        return "Please enter valid addresses within the City of Chicago."
+
+    #repeated requests are answered from the route cache
+    cache = get_route_cache()
+    key = cache.key(start_coord, end_coord, date, hour, temp, precip)
+    cached = cache.get(key)
+    if cached is not None:
+        record_event('route_cache_hit')
+        route_steps, s_length = cached
+        return route_result(route_steps, s_length, start_coord, end_coord)
+
+    record_event('route_cache_miss')
+
+    #the crime data is read while the graph is cut
+    bbox = get_bounding_box(start_coord, end_coord)
+    data = submit(_STAGES, region_data, *bbox, hour, temp, precip)
+    G = get_graph(*bbox)
+    #no street of the snapshot near the addresses
+    if G.num_nodes == 0:
+        return "Please enter valid addresses within the City of Chicago."
+    scores = graph_scores(G, date, hour, temp, precip, data.result())
+    
+    path, s_length = get_path(start_coord, end_coord, G, scores)
+    route_steps = path_steps(G, path)
+    cache.put(key, (route_steps, s_length))
+    
+    return route_result(route_steps, s_length, start_coord, end_coord)
+
+
+def go_sweep(args):
+    '''
+    Find the safest route from start_address to end_address for every hour
+    of departure in SWEEP_HOURS, on the same date and in the same weather,
+    to show when it is safest to leave. One graph is cut and scored for
+    every hour in one pass (see sweep_scores) and the searches then run
+    back to back; each route also goes into the route cache, so asking for
+    one of the hours afterwards is answered from it.
+
+    Inputs:
+    {args} as for go(); hour_of_travel is ignored
+
+    Outputs:
+      (list of tuples): (hour, path_coords, relative score, route cost) for
+      each hour of SWEEP_HOURS, path_coords being an error message and the
+      score and cost None when there is no route; or an error message when
+      the addresses are not valid
+    '''
+
+    conditions = submit(
+        _STAGES, travel_conditions, args["date_of_travel"], None,
+        args["temperature"], args["precipitation"])
+    coords = submit(_STAGES, get_coordinates, args["start_address"],
+                    args["end_address"])
+    date, _, temp, precip = conditions.result()
+    start_coord, end_coord = coords.result()
 
     if not start_coord or not end_coord:
         return "Please enter valid addresses within the City of Chicago."
 
-    n_lat, s_lat, e_lon, w_lon = get_bounding_box(start_coord, end_coord)
-    G = get_graph(n_lat, s_lat, e_lon, w_lon)
-    nodes = list(G.nodes(data = True))
-    edges = [(start, end, attrs) for (start, end, attrs) in G.edges(data = True)\
-             if 'name' in attrs.keys()]
-    node_dic = dict(G.nodes(data = True))
-    edges_lst = [edge_to_latlon_pair(G, edge) for edge in edges]
-
-    # adjust temperature and time sensitivities
-    t_sens = 12
-    time_low = hour - 2
-    time_up = hour + 2
-    p_sens = 0.5
-    scores = Regression_List(edges_lst, temp, precip, t_sens, p_sens, date,\
-                             time_low, time_up)
+    #the crime data of the whole day is read while the graph is cut
+    bbox = get_bounding_box(start_coord, end_coord)
+    data = submit(_STAGES, region_data, *bbox, None, temp, precip, True)
+    G = get_graph(*bbox)
+    if G.num_nodes == 0:
+        return "Please enter valid addresses within the City of Chicago."
+    hourly_scores = sweep_scores(G, date, temp, precip, data.result())
+
+    start_node, end_node = G.node_index().nearest_many([start_coord,
+                                                        end_coord])
+    landmarks = get_landmarks(get_snapshot())
+    cache = get_route_cache()
+    results = []
+    for hour, scores in zip(SWEEP_HOURS, hourly_scores):
+        weights = update_edge_lengths(G, scores)
+        try:
+            with stage('search'):
+                potential = alt_potential(G, start_node, end_node, weights,
+                                          landmarks)
+                path, s_length = bidirectional_astar(G, start_node, end_node,
+                                                     weights, potential)
+        except NoPath:
+            results.append((hour, "No route found between these addresses.",
+                            None, None))
+            continue
+        route_steps = path_steps(G, path)
+        cache.put(cache.key(start_coord, end_coord, date, hour, temp, precip),
+                  (route_steps, s_length))
+        results.append((hour,) + route_result(route_steps, s_length,
+                                              start_coord, end_coord) +
+                       (s_length,))
+    return results
+
+
+def go_alternatives(args, count = ALT_ROUTES):
+    '''
+    Find up to count different routes from start_address to end_address,
+    from the safest to the shortest (see get_alternatives), on one graph
+    scored once as in go().
+
+    Inputs:
+    {args} as for go()
+      count (int): most routes returned
+
+    Outputs:
+      (list of tuples): path_coords, relative score (from the safety cost),
+      length in meters, safety cost over the scored edges and length in
+      meters over the unscored ones of each route, safest first; or an
+      error message
+    '''
+
+    conditions = submit(
+        _STAGES, travel_conditions, args["date_of_travel"],
+        args["hour_of_travel"], args["temperature"], args["precipitation"])
+    coords = submit(_STAGES, get_coordinates, args["start_address"],
+                    args["end_address"])
+    date, hour, temp, precip = conditions.result()
+    start_coord, end_coord = coords.result()
+
+    if not start_coord or not end_coord:
+        return "Please enter valid addresses within the City of Chicago."
+
+    bbox = get_bounding_box(start_coord, end_coord)
+    data = submit(_STAGES, region_data, *bbox, hour, temp, precip)
+    G = get_graph(*bbox)
+    if G.num_nodes == 0:
+        return "Please enter valid addresses within the City of Chicago."
+    scores = graph_scores(G, date, hour, temp, precip, data.result())
+
+    try:
+        routes = get_alternatives(start_coord, end_coord, G, scores, count)
+    except NoPath:
+        return "No route found between these addresses."
+    return [route_result(path_steps(G, path), cost, start_coord, end_coord) +
+            (distance, cost, unscored)
+            for path, distance, cost, unscored in routes]
+
+
+async def go_async(args):
+    '''
+    Awaitable version of go() for async views: the route is computed in a
+    worker thread so the event loop keeps serving other requests
+    
+    Inputs and outputs:
+      same as go()
+    '''
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, go, args)
+
+
+def go_batch(pairs, date = None, hour = None, temp = None, precip = None):
+    '''
+    Find the safest routes for many (start address, end address) pairs
+    travelled under the same conditions. The addresses are geocoded in one
+    lookup, and one graph covering every address is cut and scored once.
+    Pairs sharing a start are then routed with a single one-to-many
+    search; the others use the same search as go().
     
-    path, s_length = get_path(start_coord, end_coord, G, nodes, scores)
+    Inputs:
+      pairs (list of tuples of strings): (start_address, end_address)
+      date, hour, temp, precip: shared travel conditions, as in go(); the
+          missing ones are filled in the same way
     
-    route_steps = [[G.nodes[node]['y'],G.nodes[node]['x']] for node in path]
-    path_coords = [[start_coord[0],start_coord[1]]] + route_steps +\
-                  [[end_coord[0],end_coord[1]]]
-    if type(s_length) == dict:
-        s_length = s_length[end_node]
-        
-    return path_coords,(1-lognorm(s_length/haversine(start_coord,end_coord)))*100
\ No newline at end of file
+    Outputs:
+      generator of (index in pairs, path_coords, relative score) tuples,
+      yielded as each route is found; for a pair that cannot be routed
+      path_coords is an error message and the score None
+    '''
+
+    date, hour, temp, precip = travel_conditions(date, hour, temp, precip)
+    addresses = list({address for pair in pairs for address in pair})
+    coords = dict(zip(addresses, get_geocoder().geocode_many(addresses)))
+
+    valid = []
+    for i, (start_address, end_address) in enumerate(pairs):
+        if coords[start_address] and coords[end_address]:
+            valid.append(i)
+        else:
+            yield i, "Please enter valid addresses within the City of "\
+                     "Chicago.", None
+    if not valid:
+        return
+
+    #one bounding box around every address of the batch
+    found = np.array([coords[address] for i in valid for address in pairs[i]])
+    n_lat, s_lat, e_lon, w_lon = get_bounding_box(found.min(axis = 0),
+                                                  found.max(axis = 0))
+    G = get_graph(n_lat, s_lat, e_lon, w_lon)
+    if G.num_nodes == 0:
+        for i in valid:
+            yield i, "Please enter valid addresses within the City of "\
+                     "Chicago.", None
+        return
+    weights = update_edge_lengths(G, graph_scores(G, date, hour, temp,
+                                                  precip))
+    nodes = np.array(G.node_index().nearest_many(found)).reshape(-1, 2)
+
+    landmarks = get_landmarks(get_snapshot())
+    by_start = {}
+    for i, (start_node, end_node) in zip(valid, nodes.tolist()):
+        by_start.setdefault(start_node, []).append((i, end_node))
+    for start_node, group in by_start.items():
+        if len(group) == 1:
+            i, end_node = group[0]
+            try:
+                potential = alt_potential(G, start_node, end_node,
+                                          weights, landmarks)
+                path, s_length = bidirectional_astar(G, start_node,
+                                                     end_node, weights,
+                                                     potential)
+            except NoPath:
+                path, s_length = None, None
+            routes = [(end_node, path, s_length)]
+        else:
+            routes = one_to_many(G, start_node, {end for _, end in group},
+                                 weights)
+        for end_node, path, s_length in routes:
+            for i, end in group:
+                if end != end_node:
+                    continue
+                start_coord = coords[pairs[i][0]]
+                end_coord = coords[pairs[i][1]]
+                if path is None:
+                    yield i, "No route found between these addresses.", None
+                else:
+                    yield (i,) + route_result(path_steps(G, path), s_length,
+                                              start_coord, end_coord)
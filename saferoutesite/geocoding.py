@@ -0,0 +1,346 @@
+'''
+Address lookup for route requests.
+
+Addresses are normalized (upper case, no punctuation, standard street type
+and direction abbreviations, no trailing city/state/zip) and resolved, in
+order, from:
+
+  an in-memory LRU of recent lookups
+  the GeocodeCache table of geocode.db, which keeps every earlier result
+  the AddressPoints table of geocode.db, built offline from a CSV of
+      Chicago address points; a house number missing from it is
+      interpolated between its neighbours on the same street
+  a remote geocoder (Nominatim by default, at most one request a second)
+
+Results from the last two sources are written to GeocodeCache, so a given
+address goes to the remote geocoder at most once. All addresses of a request
+are looked up together with geocode_many.
+
+Usage:
+    python geocoding.py build POINTS.csv [--address-col Address]
+        [--lat-col Latitude] [--lon-col Longitude] [--db geocode.db]
+    python geocoding.py lookup ADDRESS [ADDRESS ...] [--db geocode.db]
+'''
+
+import argparse
+import collections
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+GEOCODE_DB = 'geocode.db'
+HOT_SIZE = 4096
+#Nominatim usage policy: at most one request per second
+REMOTE_INTERVAL = 1.0
+#largest house number gap bridged when the exact number is not a point
+MAX_NUMBER_GAP = 100
+BUILD_CHUNK = 200000
+
+STREET_TYPES = {'STREET': 'ST', 'AVENUE': 'AVE', 'AV': 'AVE',
+                'BOULEVARD': 'BLVD', 'ROAD': 'RD', 'DRIVE': 'DR',
+                'PLACE': 'PL', 'COURT': 'CT', 'PARKWAY': 'PKWY',
+                'LANE': 'LN', 'TERRACE': 'TER', 'HIGHWAY': 'HWY',
+                'EXPRESSWAY': 'EXPY', 'SQUARE': 'SQ', 'PLAZA': 'PLZ'}
+DIRECTIONS = {'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W'}
+#trailing words dropped from an address
+PLACE_WORDS = {'CHICAGO', 'IL', 'ILLINOIS', 'US', 'USA'}
+
+_GEOCODERS = {}
+
+
+def normalize_address(address):
+    '''
+    Canonical form of an address used as the lookup key
+    Inputs:
+        address: (string) e.g. "1234 North Main Street, Chicago IL 60614"
+    Outputs:
+        (string) e.g. "1234 N MAIN ST"
+    '''
+
+    words = re.sub(r'[^A-Z0-9 ]', ' ', str(address).upper()).split()
+    while words and (words[-1] in PLACE_WORDS or re.fullmatch(
+            r'\d{5}', words[-1])) and len(words) > 1:
+        words.pop()
+    return ' '.join(DIRECTIONS.get(w, STREET_TYPES.get(w, w))
+                    for w in words)
+
+
+def split_address(key):
+    '''
+    Splits a normalized address into its house number and street, or
+    returns None when it does not start with a house number
+    '''
+
+    number, _, street = key.partition(' ')
+    if not number.isdigit() or not street:
+        return None
+    return int(number), street
+
+
+class LRUCache:
+    '''
+    Thread-safe least recently used mapping with a fixed number of entries
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last = False)
+
+
+class NominatimGeocoder:
+    '''
+    Remote geocoder on OpenStreetMap's Nominatim, spacing requests at least
+    REMOTE_INTERVAL seconds apart across threads
+    '''
+
+    def __init__(self, user_agent = 'saferoute', interval = REMOTE_INTERVAL):
+        from geopy.geocoders import Nominatim
+
+        self.geolocator = Nominatim(user_agent = user_agent)
+        self.interval = interval
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, address):
+        '''
+        Outputs:
+            (tuple of floats) (lat, lon), or None if the address is unknown
+        '''
+
+        with self.lock:
+            wait = self.last + self.interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                location = self.geolocator.geocode(address + ', Chicago IL')
+            finally:
+                self.last = time.monotonic()
+        if not location:
+            return None
+        return (location.latitude, location.longitude)
+
+
+def connect(db):
+    '''
+    Opens geocode.db, creating its tables if needed
+    '''
+
+    c = sqlite3.connect(db)
+    c.execute('CREATE TABLE IF NOT EXISTS GeocodeCache (Address TEXT PRIMARY '
+              'KEY, Latitude REAL, Longitude REAL, Source TEXT)')
+    c.execute('CREATE TABLE IF NOT EXISTS AddressPoints (Street TEXT, '
+              'Number INTEGER, Latitude REAL, Longitude REAL)')
+    c.execute('CREATE INDEX IF NOT EXISTS AddressPoints_Street_Number ON '
+              'AddressPoints(Street, Number)')
+    return c
+
+
+def address_point(c, key):
+    '''
+    Looks an address up among the address points
+    Inputs:
+        c: SQL connection to geocode.db
+        key: (string) normalized address
+    Outputs:
+        (tuple of floats) (lat, lon), or None
+    '''
+
+    parts = split_address(key)
+    if parts is None:
+        return None
+    number, street = parts
+    below = c.execute('SELECT Number, Latitude, Longitude FROM AddressPoints '
+                      'WHERE Street = ? AND Number <= ? ORDER BY Number DESC '
+                      'LIMIT 1', (street, number)).fetchone()
+    above = c.execute('SELECT Number, Latitude, Longitude FROM AddressPoints '
+                      'WHERE Street = ? AND Number >= ? ORDER BY Number '
+                      'LIMIT 1', (street, number)).fetchone()
+    if below and above and above[0] - below[0] <= 2 * MAX_NUMBER_GAP:
+        if above[0] == below[0]:
+            return (below[1], below[2])
+        f = (number - below[0]) / (above[0] - below[0])
+        return (below[1] + f * (above[1] - below[1]),
+                below[2] + f * (above[2] - below[2]))
+    for point in (below, above):
+        if point and abs(point[0] - number) <= MAX_NUMBER_GAP:
+            return (point[1], point[2])
+    return None
+
+
+class Geocoder:
+    '''
+    Resolves addresses through the hot tier, the persistent cache, the
+    address points and finally the remote geocoder.
+
+    remote is any callable taking an address and returning (lat, lon) or
+    None; it is created on first use when not given.
+    '''
+
+    def __init__(self, db = GEOCODE_DB, remote = None, hot_size = HOT_SIZE):
+        self.db = db
+        self.remote = remote
+        self.hot = LRUCache(hot_size)
+        self.lock = threading.Lock()
+
+    def get_remote(self):
+        '''
+        Returns the remote geocoder, creating a NominatimGeocoder on first use
+        '''
+
+        #one instance for every thread, so its request spacing holds
+        with self.lock:
+            if self.remote is None:
+                self.remote = NominatimGeocoder()
+            return self.remote
+
+    def geocode_many(self, addresses):
+        '''
+        Looks up several addresses at once
+        Inputs:
+            addresses: (list of strings)
+        Outputs:
+            (list) (lat, lon) tuple, or None, for each address
+        '''
+
+        keys = [normalize_address(address) for address in addresses]
+        #looked up in the order given, without repeats
+        unique = list(dict.fromkeys(keys))
+        found = {key: self.hot.get(key) for key in unique if key in self.hot}
+        missing = [key for key in unique if key not in found]
+        if missing:
+            c = connect(self.db)
+            new = []
+            try:
+                rows = c.execute('SELECT Address, Latitude, Longitude FROM '
+                                 'GeocodeCache WHERE Address IN ({})'.format(
+                                     ', '.join('?' * len(missing))), missing)
+                for key, lat, lon in rows:
+                    found[key] = None if lat is None else (lat, lon)
+                for key in missing:
+                    if key in found:
+                        continue
+                    coord = address_point(c, key)
+                    source = 'points'
+                    if coord is None:
+                        coord = self.get_remote()(key)
+                        source = 'remote'
+                    found[key] = coord
+                    new.append((key,) + (coord or (None, None)) + (source,))
+            finally:
+                #what was resolved is kept even when the remote geocoder
+                #fails part way
+                if new:
+                    c.executemany('INSERT OR REPLACE INTO GeocodeCache '
+                                  'VALUES (?, ?, ?, ?)', new)
+                    c.commit()
+                c.close()
+            for key in missing:
+                self.hot.put(key, found[key])
+        return [found[key] for key in keys]
+
+    def geocode(self, address):
+        '''
+        Looks up a single address, see geocode_many
+        '''
+
+        return self.geocode_many([address])[0]
+
+
+def get_geocoder(db = GEOCODE_DB):
+    '''
+    Returns the geocoder of a database, creating it on first use
+    '''
+
+    if db not in _GEOCODERS:
+        _GEOCODERS[db] = Geocoder(db)
+    return _GEOCODERS[db]
+
+
+def set_geocoder(geocoder, db = GEOCODE_DB):
+    '''
+    Replaces the geocoder get_geocoder returns for a database, e.g. with a
+    stub in benchmarks; it only needs geocode_many and geocode
+    '''
+
+    _GEOCODERS[db] = geocoder
+
+
+def build_address_points(csv_file, db = GEOCODE_DB, address_col = 'Address',
+                         lat_col = 'Latitude', lon_col = 'Longitude',
+                         chunk_size = BUILD_CHUNK):
+    '''
+    Replaces the address points of geocode.db with those of a CSV, e.g. an
+    export of the city's address points dataset
+    Inputs:
+        csv_file: (string) path to the CSV
+        db: (string) path to geocode.db
+        address_col, lat_col, lon_col: (strings) CSV columns holding the
+            street address and its coordinates
+        chunk_size: (int) CSV rows read at once
+    Outputs:
+        (int) number of address points written
+    '''
+
+    c = connect(db)
+    c.execute('DELETE FROM AddressPoints')
+    written = 0
+    for chunk in pd.read_csv(csv_file, chunksize = chunk_size,
+                             usecols = [address_col, lat_col, lon_col]):
+        chunk = chunk.dropna()
+        rows = []
+        for address, lat, lon in zip(chunk[address_col], chunk[lat_col],
+                                     chunk[lon_col]):
+            parts = split_address(normalize_address(address))
+            if parts is not None:
+                rows.append((parts[1], parts[0], float(lat), float(lon)))
+        c.executemany('INSERT INTO AddressPoints VALUES (?, ?, ?, ?)', rows)
+        written += len(rows)
+    #earlier results may have come from the remote geocoder or old points
+    c.execute('DELETE FROM GeocodeCache')
+    c.commit()
+    c.execute('ANALYZE')
+    c.close()
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Build the address points or look up addresses')
+    parser.add_argument('command', choices = ['build', 'lookup'])
+    parser.add_argument('inputs', nargs = '+',
+                        help = 'address points CSV (build) or addresses')
+    parser.add_argument('--address-col', default = 'Address')
+    parser.add_argument('--lat-col', default = 'Latitude')
+    parser.add_argument('--lon-col', default = 'Longitude')
+    parser.add_argument('--db', default = GEOCODE_DB)
+    args = parser.parse_args()
+    if args.command == 'build':
+        print('{} address points written'.format(build_address_points(
+            args.inputs[0], args.db, args.address_col, args.lat_col,
+            args.lon_col)))
+    else:
+        for address, coord in zip(args.inputs,
+                                  Geocoder(args.db).geocode_many(args.inputs)):
+            print('{}: {}'.format(address, coord))
@@ -0,0 +1,270 @@
+'''
+Offline build and request-time loading of the citywide walk network.
+
+The Chicago walk graph is downloaded and simplified once by the build step
+and written to disk as a directory of flat numpy arrays, one directory per
+OSM extract date. At request time the arrays are memory-mapped read-only and
+the bounding box for a route is cut out of them, so serving a route never
+touches the network or reruns osmnx.
+
+Usage:
+    python graph_snapshot.py build [--date YYYY-MM-DD] [--osm-file FILE]
+    python graph_snapshot.py info [--date YYYY-MM-DD]
+'''
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+
+from csr_graph import CSRGraph, induced_subgraph
+from spatial_index import NodeIndex
+
+SNAPSHOT_ROOT = 'graph_snapshots'
+SNAPSHOT_PREFIX = 'chicago_walk_'
+SNAPSHOT_FORMAT = 1
+
+#(north, south, east, west) limits of the City of Chicago
+CHICAGO_BBOX = (42.0230, 41.6440, -87.5240, -87.9400)
+
+NODE_ARRAYS = {'osmid': np.int64, 'lat': np.float64, 'lon': np.float64}
+EDGE_ARRAYS = {'u': np.int32, 'v': np.int32, 'length': np.float64,
+               'name': np.int32}
+
+_SNAPSHOTS = {}
+
+
+class GraphSnapshot:
+    '''
+    Read-only view of a walk network snapshot.
+
+    Nodes are numbered 0..n-1 and described by the osmid, lat and lon arrays.
+    Edges are numbered 0..m-1 (the snapshot edge id) and described by the
+    u, v, length and name arrays, where name indexes into names (-1 when the
+    edge has no street name).
+    '''
+
+    def __init__(self, path, manifest, arrays, names):
+        self.path = path
+        self.manifest = manifest
+        self.extract_date = manifest['extract_date']
+        self.names = names
+        self.index = None
+        for key, array in arrays.items():
+            setattr(self, key, array)
+
+    @property
+    def num_nodes(self):
+        return len(self.osmid)
+
+    @property
+    def num_edges(self):
+        return len(self.u)
+
+    def node_index(self):
+        '''
+        Returns the KD-tree NodeIndex over snapshot node ids, built on first
+        use
+        '''
+
+        if self.index is None:
+            self.index = NodeIndex(range(self.num_nodes), self.lat, self.lon)
+        return self.index
+
+
+def snapshot_path(extract_date, root=SNAPSHOT_ROOT):
+    '''
+    Directory holding the snapshot for a given OSM extract date
+    Inputs:
+        extract_date: (string) yyyy-mm-dd
+        root: (string) directory containing all snapshots
+    Outputs:
+        (string) path of the snapshot directory
+    '''
+
+    return os.path.join(root, SNAPSHOT_PREFIX + extract_date)
+
+
+def available_snapshots(root=SNAPSHOT_ROOT):
+    '''
+    Lists the extract dates of every complete snapshot under root, oldest
+    first
+    '''
+
+    if not os.path.isdir(root):
+        return []
+    dates = []
+    for entry in os.listdir(root):
+        if entry.startswith(SNAPSHOT_PREFIX) and os.path.exists(
+                os.path.join(root, entry, 'manifest.json')):
+            dates.append(entry[len(SNAPSHOT_PREFIX):])
+    return sorted(dates)
+
+
+def write_snapshot(G, extract_date, root=SNAPSHOT_ROOT):
+    '''
+    Converts an undirected osmnx graph into snapshot arrays (the one place
+    the networkx graph is converted) and writes them to disk. The directory
+    is written under a temporary name and renamed into place, so readers
+    never see a partial snapshot.
+    Inputs:
+        G: (networkx MultiGraph) the undirected walk graph
+        extract_date: (string) yyyy-mm-dd date of the OSM data
+        root: (string) directory containing all snapshots
+    Outputs:
+        (string) path of the written snapshot
+    '''
+
+    graph = CSRGraph.from_networkx(G)
+    path = snapshot_path(extract_date, root)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for key, dtype in {**NODE_ARRAYS, **EDGE_ARRAYS}.items():
+        np.save(os.path.join(tmp_path, key + '.npy'),
+                np.asarray(getattr(graph, key), dtype = dtype))
+    with open(os.path.join(tmp_path, 'names.json'), 'w') as f:
+        json.dump(graph.names, f)
+    manifest = {'format': SNAPSHOT_FORMAT,
+                'extract_date': extract_date,
+                'built': datetime.datetime.now().isoformat(timespec='seconds'),
+                'nodes': graph.num_nodes,
+                'edges': graph.num_edges,
+                'bbox': list(CHICAGO_BBOX)}
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_snapshot(extract_date = None, osm_file = None, root = SNAPSHOT_ROOT):
+    '''
+    Downloads (or reads from a local OSM extract) the Chicago walk network,
+    simplifies it once and writes it as a snapshot. This is the only place
+    osmnx and the Overpass API are used.
+    Inputs:
+        extract_date: (string) yyyy-mm-dd date of the OSM data, defaults to
+            today when downloading from Overpass
+        osm_file: (string) optional path to a local .osm extract
+        root: (string) directory containing all snapshots
+    Outputs:
+        (string) path of the written snapshot
+    '''
+
+    import osmnx as ox
+
+    if not extract_date:
+        extract_date = datetime.date.today().strftime('%Y-%m-%d')
+    if osm_file:
+        B = ox.core.graph_from_file(osm_file, network_type = 'walk',
+                                    simplify = True, retain_all = False,
+                                    name = 'chicago')
+        n_lat, s_lat, e_lon, w_lon = CHICAGO_BBOX
+        B = ox.core.truncate_graph_bbox(B, n_lat, s_lat, e_lon, w_lon,
+                                        truncate_by_edge = False,
+                                        retain_all = False)
+    else:
+        n_lat, s_lat, e_lon, w_lon = CHICAGO_BBOX
+        B = ox.core.graph_from_bbox(n_lat, s_lat, e_lon, w_lon,\
+                                    network_type= 'walk', simplify=True,\
+                                    retain_all=False, truncate_by_edge=False,\
+                                    name='chicago', timeout=180, memory=None,\
+                                    max_query_area_size=2500000000,\
+                                    clean_periphery=True,\
+                                    infrastructure='way["highway"]',\
+                                    custom_filter=None)
+    G = ox.save_load.get_undirected(B)
+    return write_snapshot(G, extract_date, root)
+
+
+def load_snapshot(extract_date = None, root = SNAPSHOT_ROOT):
+    '''
+    Memory-maps a snapshot from disk
+    Inputs:
+        extract_date: (string) yyyy-mm-dd, defaults to the newest snapshot
+        root: (string) directory containing all snapshots
+    Outputs:
+        GraphSnapshot
+    '''
+
+    if not extract_date:
+        dates = available_snapshots(root)
+        if not dates:
+            raise FileNotFoundError(
+                "No graph snapshot found in '{}'. Build one with "
+                "'python graph_snapshot.py build'.".format(root))
+        extract_date = dates[-1]
+    path = snapshot_path(extract_date, root)
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['format'] != SNAPSHOT_FORMAT:
+        raise ValueError("Snapshot '{}' has format {}, expected {}".format(
+            path, manifest['format'], SNAPSHOT_FORMAT))
+    arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode = 'r')
+              for key in {**NODE_ARRAYS, **EDGE_ARRAYS}}
+    with open(os.path.join(path, 'names.json')) as f:
+        names = json.load(f)
+    return GraphSnapshot(path, manifest, arrays, names)
+
+
+def get_snapshot(extract_date = None, root = SNAPSHOT_ROOT):
+    '''
+    Returns the snapshot for the given extract date (newest by default),
+    loading it on first use and reusing it for every later request
+    '''
+
+    #an absolute root gives the snapshot (and the score cube and landmarks
+    #cached by its path) the same key from any working directory
+    root = os.path.abspath(root)
+    key = (root, extract_date)
+    if key not in _SNAPSHOTS:
+        _SNAPSHOTS[key] = load_snapshot(extract_date, root)
+    return _SNAPSHOTS[key]
+
+
+def bbox_mask(snapshot, n_lat, s_lat, e_lon, w_lon):
+    '''
+    Boolean mask over snapshot nodes lying inside the bounding box
+    '''
+
+    lat = snapshot.lat
+    lon = snapshot.lon
+    return (lat <= n_lat) & (lat >= s_lat) & (lon <= e_lon) & (lon >= w_lon)
+
+
+def bbox_subgraph(snapshot, n_lat, s_lat, e_lon, w_lon):
+    '''
+    Cuts the bounding box out of a snapshot, keeping nodes inside the box,
+    the edges between them and only the largest connected component (as
+    graph_from_bbox did with retain_all=False)
+    Inputs:
+        snapshot: GraphSnapshot
+        n_lat, s_lat, e_lon, w_lon: (floats) the bounding box
+    Outputs:
+        CSRGraph whose nid and eid are snapshot node and edge ids
+    '''
+
+    mask = bbox_mask(snapshot, n_lat, s_lat, e_lon, w_lon)
+    return induced_subgraph(snapshot, mask).largest_component()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Build or inspect the Chicago walk graph snapshot')
+    parser.add_argument('command', choices = ['build', 'info'])
+    parser.add_argument('--date', help = 'OSM extract date (yyyy-mm-dd)')
+    parser.add_argument('--osm-file', help = 'local .osm extract to build from')
+    parser.add_argument('--root', default = SNAPSHOT_ROOT)
+    args = parser.parse_args()
+    if args.command == 'build':
+        print(build_snapshot(args.date, args.osm_file, args.root))
+    else:
+        snapshot = load_snapshot(args.date, args.root)
+        print(json.dumps(snapshot.manifest, indent = 2))
@@ -0,0 +1,356 @@
+'''
+Fixed geographic tiles of the walk network snapshot, loaded on demand.
+
+An offline step cuts the snapshot into a grid of TILE_SIZE degree tiles
+and writes one file per tile next to the snapshot. A tile holds its own
+nodes, every edge with at least one end in it and, as border nodes, the
+far ends of the edges leaving it, so an edge between two tiles is found in
+both. Nodes and edges keep their snapshot ids.
+
+At request time only the tiles the route's bounding box intersects are
+read. They are kept in a least recently used cache, which drops the tiles
+used longest ago once they take more than its memory cap (TILE_MEMORY
+bytes, see GRAPH_TILE_MEMORY in settings.py). The tiles are stitched by
+snapshot id into one CSRGraph, the same graph (nodes and edges in the same
+order) that graph_snapshot.bbox_subgraph cuts out of the whole snapshot.
+Route ends are snapped to snapshot nodes (for the route cache key) from the
+tiles around them too, so no index over the whole snapshot is built.
+
+Usage:
+    python graph_tiles.py build [--size 0.02] [--date YYYY-MM-DD]
+'''
+
+import argparse
+import collections
+import datetime
+import json
+import math
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from csr_graph import CSRGraph
+from graph_snapshot import CHICAGO_BBOX, get_snapshot, load_snapshot
+from metrics import record_event, record_size
+from routing import EARTH_RADIUS_M, great_circle
+
+TILE_DIR = 'tiles'
+TILE_FORMAT = 1
+#degrees; about 2.2 km north-south and 1.7 km east-west in Chicago
+TILE_SIZE = 0.02
+#bytes of tiles kept in memory by each process
+TILE_MEMORY = 256 * 2**20
+
+TILE_ARRAYS = ('nid', 'osmid', 'lat', 'lon', 'eid', 'u', 'v', 'length',
+               'name')
+
+_TILES = {}
+_TILES_LOCK = threading.Lock()
+
+
+def tiles_path(snapshot):
+    '''
+    Directory of the tiles belonging to a snapshot
+    '''
+
+    return os.path.join(snapshot.path, TILE_DIR)
+
+
+def tile_file(row, col):
+    return 'tile_{}_{}.npz'.format(row, col)
+
+
+def build_tiles(snapshot, size = TILE_SIZE):
+    '''
+    Cuts a snapshot into tiles and writes them to disk
+    Inputs:
+        snapshot: GraphSnapshot
+        size: (float) side of a tile in degrees
+    Outputs:
+        (string) path of the written tiles
+    '''
+
+    n_lat, s_lat, e_lon, w_lon = CHICAGO_BBOX
+    lat = np.asarray(snapshot.lat)
+    lon = np.asarray(snapshot.lon)
+    u = np.asarray(snapshot.u, dtype = np.int64)
+    v = np.asarray(snapshot.v, dtype = np.int64)
+    rows = max(1, math.ceil((n_lat - s_lat) / size))
+    cols = max(1, math.ceil((e_lon - w_lon) / size))
+    #nodes outside the city box go to the nearest tile
+    node_tile = np.clip(np.floor((lat - s_lat) / size), 0, rows - 1).astype(
+        np.int64) * cols + np.clip(np.floor((lon - w_lon) / size), 0,
+                                   cols - 1).astype(np.int64)
+
+    #every edge belongs to the tile of each of its ends
+    edge_tile = np.concatenate((node_tile[u], node_tile[v]))
+    edge_ids = np.concatenate((np.arange(len(u)), np.arange(len(u))))
+    keep = np.r_[np.ones(len(u), dtype = bool), node_tile[u] != node_tile[v]]
+    edge_tile = edge_tile[keep]
+    edge_ids = edge_ids[keep]
+    edge_order = np.argsort(edge_tile, kind = 'stable')
+    edge_tile = edge_tile[edge_order]
+    edge_ids = edge_ids[edge_order]
+    node_order = np.argsort(node_tile, kind = 'stable')
+    sorted_tiles = node_tile[node_order]
+
+    path = tiles_path(snapshot)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    tiles = []
+    for tile in np.unique(node_tile):
+        own = node_order[np.searchsorted(sorted_tiles, tile, 'left'):
+                         np.searchsorted(sorted_tiles, tile, 'right')]
+        eid = edge_ids[np.searchsorted(edge_tile, tile, 'left'):
+                       np.searchsorted(edge_tile, tile, 'right')]
+        eid.sort()
+        nid = np.union1d(own, np.concatenate((u[eid], v[eid])))
+        row, col = divmod(int(tile), cols)
+        np.savez(os.path.join(tmp_path, tile_file(row, col)),
+                 nid = nid, osmid = np.asarray(snapshot.osmid)[nid],
+                 lat = lat[nid], lon = lon[nid], eid = eid,
+                 u = u[eid], v = v[eid],
+                 length = np.asarray(snapshot.length)[eid],
+                 name = np.asarray(snapshot.name)[eid])
+        tiles.append([row, col])
+    manifest = {'format': TILE_FORMAT,
+                'snapshot': snapshot.extract_date,
+                'built': datetime.datetime.now().isoformat(timespec='seconds'),
+                'size': size,
+                'origin': [s_lat, w_lon],
+                'rows': rows,
+                'cols': cols,
+                'tiles': tiles}
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class TileSet:
+    '''
+    The tiles of a snapshot, read from disk on demand and kept in a least
+    recently used cache of at most memory bytes
+    '''
+
+    def __init__(self, path, manifest, names, memory = TILE_MEMORY):
+        self.path = path
+        self.manifest = manifest
+        self.names = names
+        self.size = manifest['size']
+        self.origin = manifest['origin']
+        self.present = {tuple(tile) for tile in manifest['tiles']}
+        self.memory = memory
+        self.cache = collections.OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def keys(self, n_lat, s_lat, e_lon, w_lon):
+        '''
+        (row, col) of every stored tile a bounding box intersects
+        '''
+
+        rows = self.manifest['rows']
+        cols = self.manifest['cols']
+        first_row, last_row = [min(max(int(math.floor(
+            (value - self.origin[0]) / self.size)), 0), rows - 1)
+            for value in (s_lat, n_lat)]
+        first_col, last_col = [min(max(int(math.floor(
+            (value - self.origin[1]) / self.size)), 0), cols - 1)
+            for value in (w_lon, e_lon)]
+        return [(row, col) for row in range(first_row, last_row + 1)
+                for col in range(first_col, last_col + 1)
+                if (row, col) in self.present]
+
+    def tile(self, key):
+        '''
+        The arrays of one tile, from the cache or read from disk
+        '''
+
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                record_event('tile_hit')
+                return self.cache[key]
+        record_event('tile_miss')
+        with np.load(os.path.join(self.path, tile_file(*key))) as f:
+            arrays = {name: f[name] for name in TILE_ARRAYS}
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = arrays
+                self.bytes += sum(array.nbytes for array in arrays.values())
+            self.evict()
+            return arrays
+
+    def evict(self):
+        '''
+        Drops the least recently used tiles while over the memory cap; the
+        tile used last always stays
+        '''
+
+        while self.bytes > self.memory and len(self.cache) > 1:
+            _, arrays = self.cache.popitem(last = False)
+            self.bytes -= sum(array.nbytes for array in arrays.values())
+
+    def subgraph(self, n_lat, s_lat, e_lon, w_lon):
+        '''
+        Stitches the tiles a bounding box intersects and cuts the box out of
+        them as graph_snapshot.bbox_subgraph does
+        Outputs:
+            CSRGraph whose nid and eid are snapshot node and edge ids
+        '''
+
+        tiles = [self.tile(key) for key in self.keys(n_lat, s_lat, e_lon,
+                                                     w_lon)]
+        record_size('tiles', len(tiles))
+        if not tiles:
+            return CSRGraph([], [], [], [], [], [], names = self.names,
+                            nid = [], eid = [])
+
+        def stitched(name):
+            return np.concatenate([tile[name] for tile in tiles])
+
+        #the nodes inside the box, in snapshot order, each once
+        lat = stitched('lat')
+        lon = stitched('lon')
+        rows = np.nonzero((lat <= n_lat) & (lat >= s_lat) &
+                          (lon <= e_lon) & (lon >= w_lon))[0]
+        nid, first = np.unique(stitched('nid')[rows], return_index = True)
+        rows = rows[first]
+
+        #the edges with both ends among them, in snapshot order, each once
+        u = stitched('u')
+        v = stitched('v')
+        if len(nid):
+            local_u = np.minimum(np.searchsorted(nid, u), len(nid) - 1)
+            local_v = np.minimum(np.searchsorted(nid, v), len(nid) - 1)
+            edge_rows = np.nonzero((nid[local_u] == u) &
+                                   (nid[local_v] == v))[0]
+        else:
+            local_u = local_v = edge_rows = np.zeros(0, dtype = np.int64)
+        eid, first = np.unique(stitched('eid')[edge_rows],
+                               return_index = True)
+        edge_rows = edge_rows[first]
+
+        G = CSRGraph(stitched('osmid')[rows], lat[rows], lon[rows],
+                     local_u[edge_rows], local_v[edge_rows],
+                     stitched('length')[edge_rows],
+                     stitched('name')[edge_rows], self.names, nid, eid)
+        return G.largest_component()
+
+
+    def nearest_nodes(self, coords):
+        '''
+        Snapshot ids of the nodes nearest, by great circle distance, to some
+        (lat, lon) points (the lowest id of equally near nodes). The ring of
+        tiles searched around a point grows until no node outside it can be
+        nearer than the nearest one inside.
+        Inputs:
+            coords: sequence of (lat, lon) pairs
+        Outputs:
+            (list of ints) snapshot node ids
+        '''
+
+        rings = max(self.manifest['rows'], self.manifest['cols'])
+        nodes = []
+        for lat, lon in coords:
+            node = None
+            for ring in range(1, rings + 1):
+                reach = ring * self.size
+                tiles = [self.tile(key) for key in self.keys(
+                    lat + reach, lat - reach, lon + reach, lon - reach)]
+                if not tiles:
+                    continue
+                nid = np.concatenate([tile['nid'] for tile in tiles])
+                distances = great_circle(
+                    lat, lon, np.concatenate([tile['lat'] for tile in tiles]),
+                    np.concatenate([tile['lon'] for tile in tiles]))
+                closest = distances.min()
+                node = int(nid[distances == closest].min())
+                #a node outside the tiles is more than reach degrees away in
+                #latitude or longitude; a degree of longitude is the shorter
+                bound = 0.99 * math.radians(reach) * EARTH_RADIUS_M * \
+                    math.cos(math.radians(min(abs(lat) + reach, 90)))
+                if closest <= bound:
+                    break
+            nodes.append(node)
+        return nodes
+
+
+def load_tiles(snapshot, memory = TILE_MEMORY):
+    '''
+    Opens the tiles of a snapshot
+    Inputs:
+        snapshot: GraphSnapshot
+        memory: (int) bytes of tiles kept in memory
+    Outputs:
+        TileSet, or None when no tiles were built for the snapshot
+    '''
+
+    path = tiles_path(snapshot)
+    if not os.path.exists(os.path.join(path, 'manifest.json')):
+        return None
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['format'] != TILE_FORMAT or \
+            manifest['snapshot'] != snapshot.extract_date:
+        return None
+    return TileSet(path, manifest, snapshot.names, memory)
+
+
+def get_tiles(snapshot):
+    '''
+    Returns the tiles of a snapshot (or None), opening them on first use
+    '''
+
+    with _TILES_LOCK:
+        if snapshot.path not in _TILES:
+            _TILES[snapshot.path] = load_tiles(snapshot, TILE_MEMORY)
+        return _TILES[snapshot.path]
+
+
+def snap(snapshot, coords):
+    '''
+    Snapshot ids of the nodes nearest to some (lat, lon) points: from the
+    tiles around them when the snapshot has tiles, and from the node index
+    of the whole snapshot otherwise
+    '''
+
+    tiles = get_tiles(snapshot)
+    if tiles is None:
+        return snapshot.node_index().nearest_many(coords)
+    return tiles.nearest_nodes(coords)
+
+
+def configure(memory = None):
+    '''
+    Sets the bytes of tiles each process keeps in memory
+    '''
+
+    global TILE_MEMORY
+    if memory is not None:
+        TILE_MEMORY = memory
+        with _TILES_LOCK:
+            for tiles in _TILES.values():
+                if tiles is not None:
+                    with tiles.lock:
+                        tiles.memory = memory
+                        tiles.evict()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Cut a graph snapshot into tiles')
+    parser.add_argument('command', choices = ['build'])
+    parser.add_argument('--size', type = float, default = TILE_SIZE,
+                        help = 'side of a tile in degrees')
+    parser.add_argument('--date', help = 'snapshot extract date (yyyy-mm-dd)')
+    args = parser.parse_args()
+    snapshot = load_snapshot(args.date) if args.date else get_snapshot()
+    print(build_tiles(snapshot, args.size))
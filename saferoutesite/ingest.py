@@ -0,0 +1,327 @@
+'''
+Streaming, incremental load of crime and weather data into Crime.db.
+
+Replaces the one-off CreatingCrimedb notebook. The crime CSV (from
+https://data.cityofchicago.org/Public-Safety/Crimes-2001-to-present/ijzp-q8t2)
+is read in chunks and filtered as in the notebook: only the crime types of
+SAFETY_DICT, only locations next to a street or path, upper-case block
+names, coordinates backfilled from the mean of the block and Day/Hour
+columns. Only case numbers not yet in CrimeData1 are appended, so the same
+command builds the database from scratch or adds the newest days of a
+fresh export.
+
+Block means are kept as running sums in the BlockCoordinates table, so they
+cover every crime written so far without rereading CrimeData1; a crime
+dropped for missing data adds nothing to them, so rerunning the same export
+leaves them unchanged. Rows missing
+coordinates are held back until the end of the file, when the sums include
+the whole file, as the notebook's groupby over the full data did.
+
+The daily weather CSV (from https://www.ncdc.noaa.gov/cdo-web/) is cleaned
+as in the notebook and only dates not yet in DailyWeather are appended.
+
+Afterwards the R*Tree and indexes of crime_schema are brought up to date,
+the per-edge severity aggregate of severity gets the new crimes when a graph
+snapshot is available and, when anything was added, the crime store (if one
+was exported) gets the new rows and the score cubes are marked stale.
+
+Usage:
+    python ingest.py [--crimes AllCrimes.csv] [--weather DailyWeather.csv]
+                     [--db Crime.db] [--chunk-size 200000]
+'''
+
+import argparse
+import os
+import sqlite3
+
+import pandas as pd
+
+from crime_schema import build_indexes
+from crime_store import STORE_DIR, update_store
+from graph_snapshot import available_snapshots, get_snapshot
+from score_cube import invalidate_cube
+from severity import refresh_severity
+from SQLRequest3 import SAFETY_DICT
+
+CHUNK_SIZE = 200000
+#format of the Date column of the city data portal export
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+#remove weapons violation, public peace violation, public indecency, offense
+#involving children
+IMPORTANT_TYPES = list(SAFETY_DICT)
+
+#Removes any locations not adjacent to a street or path
+IMPORTANT_LOCATIONS = ['STREET', 'SIDEWALK', 'PARKING LOT/GARAGE(NON.RESID.)',
+                       'DRIVEWAY - RESIDENTIAL', 'ALLEY', 'CTA BUS STOP',
+                       'VACANT LOT/LAND', 'RESIDENTIAL YARD (FRONT/BACK)',
+                       'COLLEGE/UNIVERSITY GROUNDS', 'PARK PROPERTY',
+                       'CHA PARKING LOT/GROUNDS',
+                       'LAKEFRONT/WATERFRONT/RIVERBANK', 'BRIDGE',
+                       'PARKING LOT', 'CEMETARY', 'HIGHWAY/EXPRESSWAY',
+                       'YARD', 'VACANT LOT', 'CHA PARKING LOT', 'DRIVEWAY',
+                       'CHA GROUNDS', 'RIVER', 'LAGOON', 'DUMPSTER',
+                       'WOODED AREA', 'RIVER BANK']
+
+#Keep only relevent columns
+IMPORTANT_COLS = ['Case Number', 'Date', 'Block', 'IUCR', 'Primary Type',
+                  'Description', 'Location Description', 'Arrest',
+                  'X Coordinate', 'Y Coordinate', 'Latitude', 'Longitude']
+
+#columns estimated from the block mean when missing
+FILL_COLS = ['X_Coordinate', 'Y_Coordinate', 'Latitude', 'Longitude']
+
+WEATHER_COLS = {'DATE': 'Date', 'DAILYAverageDryBulbTemp': 'AverageTemp',
+                'DAILYPrecip': 'Precip'}
+
+
+def clean_crimes(chunk):
+    '''
+    Filters and reshapes a chunk of the crime CSV as the notebook did,
+    except for the coordinate backfill and the final dropna
+    Inputs:
+        chunk: pandas dataframe read from the CSV (first column as index)
+    Outputs:
+        pandas dataframe with the CrimeData1 columns
+    '''
+
+    chunk = chunk[(chunk['Primary Type'].isin(IMPORTANT_TYPES)) & (
+        chunk['Location Description'].isin(IMPORTANT_LOCATIONS))]
+    chunk = chunk[IMPORTANT_COLS].copy()
+    chunk['Block'] = chunk.Block.str.upper()
+    chunk['Date'] = pd.to_datetime(chunk['Date'], format = DATE_FORMAT)
+    chunk['Day'] = chunk['Date'].dt.strftime('%Y-%m-%d')
+    chunk['Hour'] = chunk['Date'].dt.hour
+    chunk.columns = [k.replace(' ', '_') for k in chunk.columns]
+    return chunk
+
+
+def prepare(c):
+    '''
+    Creates the tables the ingest keeps besides the crime data: an index on
+    case numbers, the block coordinate sums (seeded from CrimeData1 when the
+    database was built by the notebook) and a scratch table for lookups
+    '''
+
+    sums = ', '.join('{0}_Sum REAL, {0}_Count INTEGER'.format(col)
+                     for col in FILL_COLS)
+    exists = has_table(c, 'BlockCoordinates')
+    c.execute('CREATE TABLE IF NOT EXISTS BlockCoordinates '
+              '(Block TEXT PRIMARY KEY, {})'.format(sums))
+    if has_table(c, 'CrimeData1'):
+        c.execute('CREATE INDEX IF NOT EXISTS CrimeData1_Case_Number ON '
+                  'CrimeData1(Case_Number)')
+        if not exists:
+            #backfilled rows hold the block mean, so they leave it unchanged
+            c.execute('INSERT INTO BlockCoordinates SELECT Block, {} FROM '
+                      'CrimeData1 GROUP BY Block'.format(', '.join(
+                          'SUM({0}), COUNT({0})'.format(col)
+                          for col in FILL_COLS)))
+    c.execute('CREATE TEMP TABLE IF NOT EXISTS IngestKeys (Key TEXT)')
+    c.commit()
+
+
+def has_table(c, name):
+    '''
+    Checks whether the database has a table
+    '''
+
+    return c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND "
+                     "name = ?", (name,)).fetchone() is not None
+
+
+def known_keys(c, table, column, keys):
+    '''
+    Returns the subset of keys already present in a column of a table
+    '''
+
+    if not has_table(c, table):
+        return set()
+    c.execute('DELETE FROM IngestKeys')
+    c.executemany('INSERT INTO IngestKeys VALUES (?)',
+                  [(str(key),) for key in set(keys)])
+    return {row[0] for row in c.execute(
+        'SELECT Key FROM IngestKeys WHERE Key IN (SELECT {} FROM {})'.format(
+            column, table))}
+
+
+def add_block_sums(c, crimes):
+    '''
+    Adds the known coordinates of some crimes to the block sums
+    '''
+
+    grouped = crimes.groupby('Block')[FILL_COLS]
+    sums = grouped.sum()
+    counts = grouped.count()
+    rows = [(block,) + tuple(x for col in FILL_COLS for x in (
+        float(sums.at[block, col]), int(counts.at[block, col])))
+        for block in sums.index]
+    columns = ', '.join('{0}_Sum, {0}_Count'.format(col) for col in FILL_COLS)
+    updates = ', '.join('{0}_Sum = {0}_Sum + excluded.{0}_Sum, '
+                        '{0}_Count = {0}_Count + excluded.{0}_Count'.format(
+                            col) for col in FILL_COLS)
+    c.executemany('INSERT INTO BlockCoordinates (Block, {}) VALUES ({}) ON '
+                  'CONFLICT(Block) DO UPDATE SET {}'.format(
+                      columns, ', '.join('?' * (1 + 2 * len(FILL_COLS))),
+                      updates), rows)
+
+
+def fill_from_blocks(c, crimes):
+    '''
+    Estimate coordinates for any crime where block name is given but
+    coordinates are not, from the block sums
+    '''
+
+    means = pd.read_sql('SELECT Block, {} FROM BlockCoordinates'.format(
+        ', '.join('{0}_Sum / NULLIF({0}_Count, 0) AS {0}'.format(col)
+                  for col in FILL_COLS)), c, index_col = 'Block')
+    for col in FILL_COLS:
+        crimes[col] = crimes[col].fillna(crimes.Block.map(means[col]))
+    return crimes
+
+
+def append_crimes(c, crimes, given = None):
+    '''
+    Writes crimes not yet in CrimeData1, dropping any for which coordinates
+    (or other columns) cannot be obtained, and adds the coordinates of the
+    written ones to the block sums
+    Inputs:
+        c: SQL connection
+        crimes: pandas dataframe with the CrimeData1 columns
+        given: pandas dataframe, the same crimes with only the coordinates
+            they came with, before any backfill (defaults to crimes)
+    Outputs:
+        (int) number of rows written
+    '''
+
+    given = crimes if given is None else given
+    kept = crimes.notna().all(axis = 1).values
+    crimes = crimes[kept]
+    if crimes.empty:
+        return 0
+    add_block_sums(c, given[kept])
+    if not has_table(c, 'CrimeData1'):
+        crimes.to_sql('CrimeData1', c, index = True)
+        prepare(c)
+    else:
+        crimes.to_sql('CrimeData1', c, if_exists = 'append', index = True)
+    return len(crimes)
+
+
+def ingest_crimes(c, csv_file, chunk_size = CHUNK_SIZE):
+    '''
+    Streams a crime CSV into CrimeData1
+    Inputs:
+        c: SQL connection
+        csv_file: (string) path to the CSV export
+        chunk_size: (int) CSV rows read at once
+    Outputs:
+        (int) number of crimes added
+    '''
+
+    prepare(c)
+    added = 0
+    held = []
+    for chunk in pd.read_csv(csv_file, index_col = 0, chunksize = chunk_size):
+        crimes = clean_crimes(chunk)
+        crimes = crimes[~crimes.Case_Number.isin(known_keys(
+            c, 'CrimeData1', 'Case_Number', crimes.Case_Number))]
+        missing = crimes[FILL_COLS].isna().any(axis = 1)
+        held.append(crimes[missing])
+        added += append_crimes(c, crimes[~missing])
+        c.commit()
+
+    held = pd.concat(held) if held else pd.DataFrame()
+    if not held.empty:
+        held = held[~held.Case_Number.isin(known_keys(
+            c, 'CrimeData1', 'Case_Number', held.Case_Number))]
+        added += append_crimes(c, fill_from_blocks(c, held.copy()), held)
+        c.commit()
+    return added
+
+
+def ingest_weather(c, csv_file, chunk_size = CHUNK_SIZE):
+    '''
+    Streams a daily weather CSV into DailyWeather, keeping the first row
+    with data for each date not in the table yet
+    Inputs:
+        c: SQL connection
+        csv_file: (string) path to the CSV
+        chunk_size: (int) CSV rows read at once
+    Outputs:
+        (int) number of days added
+    '''
+
+    prepare(c)
+    added = 0
+    for chunk in pd.read_csv(csv_file, usecols = list(WEATHER_COLS),
+                             dtype = str, chunksize = chunk_size):
+        weather = chunk.rename(columns = WEATHER_COLS)[
+            list(WEATHER_COLS.values())]
+        #Clean data; 'T' is a trace of precipitation, 's' a suspect value
+        weather['Precip'] = pd.to_numeric(weather.Precip.str.replace(
+            'T', '0.001').str.replace('s', ''), errors = 'coerce')
+        weather['AverageTemp'] = pd.to_numeric(
+            weather.AverageTemp.str.replace('s', ''), errors = 'coerce')
+        weather['Date'] = pd.to_datetime(weather['Date']).dt.strftime(
+            '%Y-%m-%d')
+        weather = weather.dropna(subset = ['AverageTemp', 'Precip'],
+                                 how = 'all').drop_duplicates('Date')
+        weather = weather[~weather.Date.isin(known_keys(
+            c, 'DailyWeather', 'Date', weather.Date))]
+        if not weather.empty:
+            weather.to_sql('DailyWeather', c, if_exists = 'append',
+                           index = False)
+            added += len(weather)
+        c.commit()
+    return added
+
+
+def refresh(c, db, added = True, store = STORE_DIR):
+    '''
+    Brings what is derived from Crime.db up to date: the R*Tree gets only
+    the new rows, the indexes and planner statistics are refreshed and the
+    severity aggregate gets the new rows (or is rebuilt for a new snapshot).
+    When the ingest added crimes or days, the crime store, when one has been
+    exported, gets the new rows and the score cube of every snapshot is
+    marked stale, as its scores were fitted on the older data
+    Inputs:
+        c: SQL connection
+        db: (string) path to the crime database
+        added: (bool) whether the ingest wrote any crimes or days
+        store: (string) directory of the crime store
+    '''
+
+    build_indexes(c)
+    snapshots = available_snapshots()
+    if snapshots:
+        refresh_severity(c, get_snapshot())
+    if not added:
+        return
+    for extract_date in snapshots:
+        invalidate_cube(get_snapshot(extract_date))
+    if os.path.exists(os.path.join(store, 'manifest.json')):
+        update_store(db, store)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Append new crime and weather data to Crime.db')
+    parser.add_argument('--crimes', help = 'crime CSV export')
+    parser.add_argument('--weather', help = 'daily weather CSV')
+    parser.add_argument('--db', default = 'Crime.db')
+    parser.add_argument('--chunk-size', type = int, default = CHUNK_SIZE)
+    args = parser.parse_args()
+    c = sqlite3.connect(args.db)
+    added = 0
+    if args.weather:
+        days = ingest_weather(c, args.weather, args.chunk_size)
+        print('{} days added to DailyWeather'.format(days))
+        added += days
+    if args.crimes:
+        crimes = ingest_crimes(c, args.crimes, args.chunk_size)
+        print('{} crimes added to CrimeData1'.format(crimes))
+        added += crimes
+    if has_table(c, 'CrimeData1') and has_table(c, 'DailyWeather'):
+        refresh(c, args.db, added > 0)
+    c.close()
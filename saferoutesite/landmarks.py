@@ -0,0 +1,241 @@
+'''
+Landmark (ALT) lower bounds for the route search.
+
+An offline step picks a few landmark nodes spread around the citywide
+snapshot (each one the node farthest from those already picked) and stores
+the walking distance from every landmark to every node next to the
+snapshot. By the triangle inequality |d(L, t) - d(L, v)| never exceeds the
+distance from v to t, for any landmark L.
+
+Route weights are length * score with scores that change with every
+request, so the bounds are computed on plain lengths and scaled by the
+smallest score of the request's graph: every edge weighs at least
+min_score * length, so min_score * d(v, t) stays a lower bound on the
+weighted distance whatever the reweighting. The A* potential uses the
+larger of the landmark bound and the great circle distance. The bounds are
+tight when scores are close to uniform and weak when a few streets are far
+safer than the rest, so they are only used when the scores are close
+enough (MAX_SCORE_SPREAD).
+
+Usage:
+    python landmarks.py build [--count 16] [--date YYYY-MM-DD]
+'''
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from graph_snapshot import get_snapshot, load_snapshot
+from routing import great_circle
+
+LANDMARK_DIR = 'landmarks'
+LANDMARK_FORMAT = 1
+LANDMARK_COUNT = 16
+#csgraph drops explicit zeros, so zero-length edges get this length (m);
+#the bounds it adds are far below the precision of the weights
+MIN_LENGTH = 1e-9
+#landmarks are skipped when the median score is this many times the
+#smallest one: the scaled bounds then prune too little to pay for the
+#gather
+MAX_SCORE_SPREAD = 4
+
+_LANDMARKS = {}
+
+
+class Landmarks:
+    '''
+    Read-only landmark distances of a snapshot.
+
+    distances has one row per snapshot node and one column per landmark
+    (inf where the landmark cannot reach the node), so the rows of the nodes
+    of a graph are gathered in one contiguous read.
+    '''
+
+    def __init__(self, path, manifest, distances):
+        self.path = path
+        self.manifest = manifest
+        self.nodes = np.array(manifest['landmarks'])
+        self.distances = np.asarray(distances)
+
+    def bounds(self, nid, ends):
+        '''
+        Landmark lower bounds on the walking distance from each node to
+        some end nodes
+        Inputs:
+            nid: (array of ints) snapshot ids of the nodes
+            ends: (list of ints) snapshot ids of the end nodes
+        Outputs:
+            (list of numpy arrays) the bound for each node of nid, one array
+            per end
+        '''
+
+        rows = self.distances[nid]
+        bounds = []
+        for end in ends:
+            #a landmark that cannot reach both nodes bounds nothing
+            with np.errstate(invalid = 'ignore'):
+                gap = np.abs(self.distances[end] - rows)
+            gap[~np.isfinite(gap)] = 0
+            bounds.append(gap.max(axis = 1))
+        return bounds
+
+
+def landmarks_path(snapshot):
+    '''
+    Directory of the landmarks belonging to a snapshot
+    '''
+
+    return os.path.join(snapshot.path, LANDMARK_DIR)
+
+
+def length_matrix(snapshot):
+    '''
+    Symmetric sparse matrix of edge lengths, keeping the shortest of
+    parallel edges
+    '''
+
+    n = snapshot.num_nodes
+    u = np.asarray(snapshot.u, dtype = np.int64)
+    v = np.asarray(snapshot.v, dtype = np.int64)
+    length = np.maximum(np.asarray(snapshot.length), MIN_LENGTH)
+    rows = np.concatenate((u, v))
+    cols = np.concatenate((v, u))
+    data = np.concatenate((length, length))
+    keys = rows * n + cols
+    order = np.lexsort((data, keys))
+    keys = keys[order]
+    first = np.concatenate(([True], keys[1:] != keys[:-1]))
+    keys = keys[first]
+    return csr_matrix((data[order][first], (keys // n, keys % n)),
+                      shape = (n, n))
+
+
+def build_landmarks(snapshot, count = LANDMARK_COUNT):
+    '''
+    Picks landmarks by farthest-point selection and writes their distances
+    to every node next to the snapshot
+    Inputs:
+        snapshot: GraphSnapshot
+        count: (int) number of landmarks
+    Outputs:
+        (string) path of the written landmarks
+    '''
+
+    matrix = length_matrix(snapshot)
+    #start from the node farthest from the center of the city
+    lat = np.asarray(snapshot.lat)
+    lon = np.asarray(snapshot.lon)
+    start = int(np.argmax(great_circle(lat, lon, lat.mean(), lon.mean())))
+    nearest = dijkstra(matrix, indices = start)
+    nodes = []
+    rows = []
+    for _ in range(min(count, snapshot.num_nodes)):
+        reached = np.where(np.isfinite(nearest), nearest, -1)
+        landmark = int(np.argmax(reached))
+        nodes.append(landmark)
+        rows.append(dijkstra(matrix, indices = landmark))
+        nearest = np.minimum(nearest, rows[-1]) if len(rows) > 1 \
+            else rows[-1]
+
+    path = landmarks_path(snapshot)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    distances = np.array(rows, dtype = np.float64).reshape(
+        -1, snapshot.num_nodes)
+    np.save(os.path.join(tmp_path, 'distances.npy'),
+            np.ascontiguousarray(distances.T))
+    manifest = {'format': LANDMARK_FORMAT,
+                'snapshot': snapshot.extract_date,
+                'built': datetime.datetime.now().isoformat(timespec='seconds'),
+                'landmarks': nodes}
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_landmarks(snapshot):
+    '''
+    Memory-maps the landmarks of a snapshot
+    Inputs:
+        snapshot: GraphSnapshot
+    Outputs:
+        Landmarks, or None when none were built for the snapshot
+    '''
+
+    path = landmarks_path(snapshot)
+    if not os.path.exists(os.path.join(path, 'manifest.json')):
+        return None
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['format'] != LANDMARK_FORMAT:
+        return None
+    distances = np.load(os.path.join(path, 'distances.npy'), mmap_mode = 'r')
+    return Landmarks(path, manifest, distances)
+
+
+def get_landmarks(snapshot):
+    '''
+    Returns the landmarks of a snapshot (or None), loading them on first use
+    '''
+
+    if snapshot.path not in _LANDMARKS:
+        _LANDMARKS[snapshot.path] = load_landmarks(snapshot)
+    return _LANDMARKS[snapshot.path]
+
+
+def alt_potential(graph, source, target, weights, landmarks = None):
+    '''
+    Average A* potential for bidirectional_astar from the landmark and
+    great circle lower bounds, scaled by the smallest score of the graph;
+    the landmarks are left out when the scores vary too much for them to
+    help
+    Inputs:
+        graph: CSRGraph cut from the snapshot the landmarks belong to
+        source, target: (ints) node numbers of the ends of the route
+        weights: (array) the cost of every edge, indexed by edge id
+        landmarks: Landmarks, or None for the great circle bound alone
+    Outputs:
+        (numpy array) the potential of every node
+    '''
+
+    #every edge weighs at least scale times its length
+    positive = graph.length > 0
+    scale = 1.0
+    if positive.any():
+        ratios = np.asarray(weights)[positive] / graph.length[positive]
+        scale = float(np.min(ratios))
+        if np.median(ratios) > MAX_SCORE_SPREAD * scale:
+            landmarks = None
+
+    lat = graph.lat
+    lon = graph.lon
+    to_target = great_circle(lat, lon, lat[target], lon[target])
+    from_source = great_circle(lat, lon, lat[source], lon[source])
+    if landmarks is not None:
+        nid = np.asarray(graph.nid)
+        alt_target, alt_source = landmarks.bounds(nid, [nid[target],
+                                                        nid[source]])
+        to_target = np.maximum(to_target, alt_target)
+        from_source = np.maximum(from_source, alt_source)
+    return scale * (to_target - from_source) / 2
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Build landmark distances for a graph snapshot')
+    parser.add_argument('command', choices = ['build'])
+    parser.add_argument('--count', type = int, default = LANDMARK_COUNT)
+    parser.add_argument('--date', help = 'snapshot extract date (yyyy-mm-dd)')
+    args = parser.parse_args()
+    snapshot = load_snapshot(args.date) if args.date else get_snapshot()
+    print(build_landmarks(snapshot, args.count))
@@ -0,0 +1,303 @@
+'''
+Per-stage latency and size metrics of route requests.
+
+Every route request runs inside a trace. The stages of go() (weather,
+geocoding, the crime queries, cutting the graph, the regression, the
+search) record their duration, and some record a size (graph nodes and
+edges, crime rows, scored blocks), on the trace of the request; stages run
+in other threads see the same trace when they are submitted with submit().
+A finished trace is published: its values are added to the histograms of the
+process-wide registry, which the /routemanager/metrics view renders in the
+Prometheus text format, and a sample of traces (plus every slow one) is
+logged as JSON on the 'saferoute.trace' logger.
+
+Routes computed in worker processes (see worker_pool) return their trace
+with the result and the web process publishes it, so the web process's
+registry covers every request it served. Values recorded outside any trace
+(e.g. a background weather refresh, or benchmarks) go straight to the
+registry of the process that recorded them.
+'''
+
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+#seconds
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000,
+                1000000)
+#share of traces logged, and duration (s) above which a trace is always
+#logged
+TRACE_SAMPLE = 0.01
+SLOW_TRACE = 10
+
+#name: (type, help, buckets)
+METRICS = {
+    'saferoute_request_seconds': (
+        'histogram', 'Time to compute a route request', STAGE_BUCKETS),
+    'saferoute_stage_seconds': (
+        'histogram', 'Time spent in each stage of a route request',
+        STAGE_BUCKETS),
+    'saferoute_request_size': (
+        'histogram', 'Sizes of the data a route request worked on',
+        SIZE_BUCKETS),
+    'saferoute_requests_total': (
+        'counter', 'Route requests by outcome', None),
+    'saferoute_events_total': (
+        'counter', 'Cache hits and other events of route requests', None),
+}
+
+logger = logging.getLogger('saferoute.trace')
+
+_TRACE = contextvars.ContextVar('saferoute_trace', default = None)
+
+
+class Histogram:
+    '''
+    Counts of observed values per bucket (upper bounds, plus +Inf), with
+    their sum
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def label_text(labels, **extra):
+    '''
+    Prometheus label set, e.g. {stage="get_graph",le="0.5"}
+    '''
+
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace(
+        '\\', '\\\\').replace('"', '\\"')) for key, value in pairs) + '}'
+
+
+class Registry:
+    '''
+    Thread-safe histograms and counters of the METRICS, per label set
+    '''
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        '''
+        Adds a value to a histogram
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(METRICS[name][2])
+            self.histograms[key].observe(value)
+
+    def inc(self, name, amount = 1, **labels):
+        '''
+        Adds to a counter
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self):
+        '''
+        Outputs:
+            (string) every metric in the Prometheus text exposition format
+        '''
+
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, _) in METRICS.items():
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                if kind == 'counter':
+                    for (key, labels), value in sorted(self.counters.items()):
+                        if key == name:
+                            lines.append('{}{} {}'.format(
+                                name, label_text(labels), value))
+                    continue
+                for (key, labels), hist in sorted(self.histograms.items()):
+                    if key != name:
+                        continue
+                    bounds = [repr(float(bound)) for bound in
+                              hist.buckets] + ['+Inf']
+                    cumulative = 0
+                    for bound, count in zip(bounds, hist.counts):
+                        cumulative += count
+                        lines.append('{}_bucket{} {}'.format(
+                            name, label_text(labels, le = bound),
+                            cumulative))
+                    lines.append('{}_sum{} {}'.format(
+                        name, label_text(labels), hist.sum))
+                    lines.append('{}_count{} {}'.format(
+                        name, label_text(labels), hist.count))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Trace:
+    '''
+    Stage durations, sizes and events of one route request
+    '''
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.seconds = None
+        self.outcome = 'ok'
+        self.stages = []
+        self.sizes = []
+        self.events = []
+
+    def to_dict(self):
+        return {'id': self.id, 'started': self.started,
+                'seconds': self.seconds, 'outcome': self.outcome,
+                'stages': self.stages, 'sizes': self.sizes,
+                'events': self.events}
+
+
+def record_stage(name, seconds):
+    '''
+    Records the duration of a stage on the current trace, or directly in the
+    registry outside a request
+    '''
+
+    request_trace = _TRACE.get()
+    if request_trace is None:
+        REGISTRY.observe('saferoute_stage_seconds', seconds, stage = name)
+    else:
+        request_trace.stages.append((name, seconds))
+
+
+def record_size(name, value):
+    '''
+    Records a size (e.g. 'graph_nodes' or 'crime_rows'), see record_stage
+    '''
+
+    request_trace = _TRACE.get()
+    if request_trace is None:
+        REGISTRY.observe('saferoute_request_size', value, quantity = name)
+    else:
+        request_trace.sizes.append((name, int(value)))
+
+
+def record_event(name):
+    '''
+    Records an event (e.g. 'route_cache_hit'), see record_stage
+    '''
+
+    request_trace = _TRACE.get()
+    if request_trace is None:
+        REGISTRY.inc('saferoute_events_total', event = name)
+    else:
+        request_trace.events.append(name)
+
+
+def count_request(outcome):
+    '''
+    Counts a request that ended without a trace to publish, e.g. one
+    refused because the routing queue was full
+    '''
+
+    REGISTRY.inc('saferoute_requests_total', outcome = outcome)
+
+
+@contextlib.contextmanager
+def stage(name):
+    '''
+    Times the enclosed block as a stage of the current request
+    '''
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def submit(executor, fn, *args):
+    '''
+    executor.submit(fn, *args), with fn running in the caller's trace
+    '''
+
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def publish(request_trace):
+    '''
+    Adds a finished trace to the registry and logs it if sampled or slow
+    '''
+
+    REGISTRY.inc('saferoute_requests_total', outcome = request_trace.outcome)
+    REGISTRY.observe('saferoute_request_seconds', request_trace.seconds)
+    for name, seconds in request_trace.stages:
+        REGISTRY.observe('saferoute_stage_seconds', seconds, stage = name)
+    for name, value in request_trace.sizes:
+        REGISTRY.observe('saferoute_request_size', value, quantity = name)
+    for name in request_trace.events:
+        REGISTRY.inc('saferoute_events_total', event = name)
+    if request_trace.seconds >= SLOW_TRACE:
+        logger.warning('slow route request %s',
+                       json.dumps(request_trace.to_dict()))
+    elif random.random() < TRACE_SAMPLE:
+        logger.info('route request %s', json.dumps(request_trace.to_dict()))
+
+
+@contextlib.contextmanager
+def trace(publish_trace = True):
+    '''
+    Runs the enclosed block as one traced request
+    Inputs:
+        publish_trace: (bool) publish the trace when the block ends; worker
+            processes leave that to the web process
+    Outputs:
+        the Trace, as the value of the with statement
+    '''
+
+    request_trace = Trace()
+    token = _TRACE.set(request_trace)
+    start = time.perf_counter()
+    try:
+        yield request_trace
+    except Exception:
+        request_trace.outcome = 'error'
+        raise
+    finally:
+        request_trace.seconds = time.perf_counter() - start
+        _TRACE.reset(token)
+        if publish_trace:
+            publish(request_trace)
+
+
+def configure(trace_sample = None, slow_trace = None):
+    '''
+    Sets the share of traces logged and the slow trace threshold (seconds)
+    '''
+
+    global TRACE_SAMPLE, SLOW_TRACE
+    if trace_sample is not None:
+        TRACE_SAMPLE = trace_sample
+    if slow_trace is not None:
+        SLOW_TRACE = slow_trace
@@ -0,0 +1,175 @@
+'''
+Cache of computed routes.
+
+A route is keyed by the snapshot nodes nearest to its two ends (see
+graph_tiles.snap) and by its travel conditions discretized into bands: the
+hour, the temperature in TEMP_BAND degree bands, the precipitation in
+PRECIP_BAND inch bands and the projection date. Requests whose ends snap to
+the same nodes under conditions in the same bands share one computation.
+The key also holds the snapshot date and the version of the crime data (see
+data_version), so routes scored before an ingest are not served after it.
+
+Entries live in a per-process LRU of bounded size and, when a shared
+backend is set (any object with Django's cache get/set methods, e.g.
+django.core.cache.caches['routes']), also there, so every worker process
+benefits from a route computed by any of them.
+
+The module imports nothing heavy at load time, so Django can hand it the
+shared backend at startup without loading the routing code.
+'''
+
+import os
+
+ROUTE_CACHE_SIZE = 2048
+TEMP_BAND = 5
+PRECIP_BAND = 0.1
+CRIME_DB = 'Crime.db'
+
+_ROUTE_CACHE = None
+#(backend, timeout) given to set_shared_backend before the cache exists
+_SHARED_BACKEND = (None, None)
+
+
+class RouteCache:
+    '''
+    Two-tier route cache with hit and miss counters.
+
+    Values are (route_steps, weighted length) pairs, the part of a result
+    that does not depend on the exact start and end coordinates.
+    '''
+
+    def __init__(self, size = ROUTE_CACHE_SIZE, backend = None,
+                 timeout = None):
+        from geocoding import LRUCache
+
+        self.local = LRUCache(size)
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def key(self, start_coord, end_coord, date, hour, temp, precip):
+        '''
+        Key of a route request, see the module docstring
+        Inputs:
+            start_coord, end_coord: (tuples of floats) ends of the route
+            date, hour, temp, precip: travel conditions, as in go()
+        Outputs:
+            (string) the key
+        '''
+
+        from graph_snapshot import get_snapshot
+        from graph_tiles import snap
+
+        snapshot = get_snapshot()
+        start_node, end_node = snap(snapshot, [start_coord, end_coord])
+        return 'route:{}:{}:{}:{}:{}:{}:{}:{}'.format(
+            snapshot.extract_date, data_version(snapshot), start_node,
+            end_node, int(hour), int(round(float(temp) / TEMP_BAND)),
+            int(round(float(precip) / PRECIP_BAND)), date)
+
+    def get(self, key):
+        '''
+        Returns the cached value of a key, or None
+        '''
+
+        value = self.local.get(key)
+        shared = False
+        if value is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.local.put(key, value)
+                shared = True
+        #requests are served from several threads, and += is not atomic
+        with self.local.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.shared_hits += shared
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores a value in both tiers
+        '''
+
+        self.local.put(key, value)
+        if self.backend is None:
+            return
+        if self.timeout is None:
+            #the backend's default timeout
+            self.backend.set(key, value)
+        else:
+            self.backend.set(key, value, self.timeout)
+
+    def clear(self):
+        '''
+        Empties the tier held in this process (the shared backend is left
+        alone)
+        '''
+
+        with self.local.lock:
+            self.local.entries.clear()
+
+    def stats(self):
+        '''
+        Counters of the cache: hits (of which from the shared backend),
+        misses and entries held in this process
+        '''
+
+        with self.local.lock:
+            return {'hits': self.hits, 'shared_hits': self.shared_hits,
+                    'misses': self.misses,
+                    'entries': len(self.local.entries)}
+
+
+def data_version(snapshot, db = CRIME_DB):
+    '''
+    Version of the crime data routes are scored from: the time of the
+    latest write to Crime.db (which every ingest makes), the crime store or
+    the snapshot's score cube
+    Inputs:
+        snapshot: GraphSnapshot the score cube belongs to
+        db: (string) path to Crime.db
+    Outputs:
+        (int) nanoseconds since the epoch, 0 when none of them exists
+    '''
+
+    from crime_store import store_version
+    from score_cube import cube_version
+
+    versions = [store_version(), cube_version(snapshot)]
+    try:
+        versions.append(os.stat(db).st_mtime_ns)
+    except OSError:
+        pass
+    return max([version for version in versions if version is not None],
+               default = 0)
+
+
+def get_route_cache():
+    '''
+    Returns the process-wide route cache, creating it on first use
+    '''
+
+    global _ROUTE_CACHE
+    if _ROUTE_CACHE is None:
+        backend, timeout = _SHARED_BACKEND
+        _ROUTE_CACHE = RouteCache(backend = backend, timeout = timeout)
+    return _ROUTE_CACHE
+
+
+def set_shared_backend(backend, timeout = None):
+    '''
+    Makes the process-wide route cache also store routes in a shared
+    backend, for timeout seconds (the backend's default when None); the
+    cache itself is still only created on first use
+    '''
+
+    global _SHARED_BACKEND
+    _SHARED_BACKEND = (backend, timeout)
+    if _ROUTE_CACHE is not None:
+        _ROUTE_CACHE.backend = backend
+        _ROUTE_CACHE.timeout = timeout
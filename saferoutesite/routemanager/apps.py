@@ -3,3 +3,14 @@ from django.apps import AppConfig
 
 class RoutemanagerConfig(AppConfig):
     name = 'routemanager'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.cache import caches
+        from route_cache import set_shared_backend
+        from metrics import configure
+
+        #routes computed by one worker are reused by the others
+        if 'routes' in settings.CACHES:
+            set_shared_backend(caches['routes'])
+        configure(settings.METRICS_TRACE_SAMPLE, settings.METRICS_SLOW_TRACE)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from worker_pool import warm
+
+
+class Command(BaseCommand):
+    help = ('Imports the routing code and loads the graph snapshot, its '
+            'indexes and the crime data, printing how long each step took')
+
+    def handle(self, *args, **options):
+        steps = warm()
+        for name, seconds in steps:
+            self.stdout.write('{:<12} {:8.2f} s'.format(name, seconds))
+        self.stdout.write('{:<12} {:8.2f} s'.format(
+            'total', sum(seconds for _, seconds in steps)))
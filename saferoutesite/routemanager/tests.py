@@ -1,3 +1,1434 @@
-from django.test import TestCase
+import concurrent.futures
+import math
+import os
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+from time import mktime
+from unittest import mock
 
-# Create your tests here.
+import networkx as nx
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+import current_weather
+import dijkstra_path1
+import geocoding
+import route_cache
+import worker_pool
+from benchmarks.stubs import install_stubs
+from benchmarks.synthetic import BLOCK_LAT, block_names, crime_rows, \
+    grid_graph, write_crime_db, write_grid_snapshot
+from crime_schema import SAMPLE_QUERIES, build_indexes, check_query_plans
+from crime_store import (CRIME_COLUMNS, WEATHER_COLUMNS, export_store,
+                         load_store, store_version)
+from csr_graph import CSRGraph, induced_subgraph
+from current_weather import (WeatherProvider, WeatherUnavailable,
+                             fixture_fetcher)
+from dijkstra_path1 import (UNSCORED, edge_to_latlon_pair, get_alternatives,
+                            get_graph, go, go_alternatives, go_batch,
+                            go_sweep, graph_scores)
+from geocoding import Geocoder, address_point, connect, normalize_address
+from graph_snapshot import (SNAPSHOT_ROOT, bbox_subgraph, load_snapshot,
+                            write_snapshot)
+from graph_tiles import build_tiles, load_tiles
+from ingest import (DATE_FORMAT, FILL_COLS, ingest_crimes, ingest_weather,
+                    refresh)
+from landmarks import alt_potential, build_landmarks, load_landmarks
+from route_cache import RouteCache
+from routing import (NoPath, bidirectional_astar, great_circle, one_to_many,
+                     path_edges)
+from score_cube import build_cube, get_cube, load_cube
+from severity import refresh_severity, severity_ready
+from SQLRequest3 import (SAFETY_DICT, Crime_Query, Crime_Source,
+                         DataConstructor, Regression_Array, Regression_Batch,
+                         Regression_Edge_Hours, Regression_Edges,
+                         Regression_Hours, Regression_Params, assign_crimes,
+                         block_score_matrix, edge_to_latlon)
+from worker_pool import PoolBusy, RoutePool, RouteTimeout
+
+
+class FakeClock:
+    '''
+    A clock that only moves when told to
+    '''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingFetcher:
+    '''
+    Wraps a fetch function, counting its calls; fails while fail is set
+    '''
+
+    def __init__(self, fetch = None):
+        self.fetch = fetch or fixture_fetcher()
+        self.calls = 0
+        self.fail = False
+        self.done = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        try:
+            if self.fail:
+                raise OSError('weather.gov is down')
+            return self.fetch()
+        finally:
+            self.done.set()
+
+
+class WeatherProviderTests(SimpleTestCase):
+    '''
+    WeatherProvider on the saved Midway observation page
+    '''
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.fetcher = CountingFetcher()
+        self.provider = WeatherProvider(self.fetcher, ttl = 600,
+                                        clock = self.clock)
+
+    def wait_for_refresh(self):
+        self.assertTrue(self.fetcher.done.wait(5))
+        self.fetcher.done.clear()
+        #the refresh thread releases the provider right after fetching
+        with self.provider.ready:
+            self.provider.ready.wait_for(lambda: not self.provider.refreshing,
+                                         5)
+
+    def test_fixture(self):
+        self.assertEqual(fixture_fetcher()(), (41.0, 0.02))
+
+    def test_ttl(self):
+        self.assertEqual(self.provider.current(), (41.0, 0.02))
+        self.fetcher.done.clear()
+        self.clock.now = 599
+        self.assertEqual(self.provider.current(), (41.0, 0.02))
+        self.assertEqual(self.fetcher.calls, 1)
+
+        #once expired, the old value is served while it is fetched again
+        self.fetcher.fetch = lambda: (50.0, 0.0)
+        self.clock.now = 600
+        self.assertEqual(self.provider.current(), (41.0, 0.02))
+        self.wait_for_refresh()
+        self.assertEqual(self.fetcher.calls, 2)
+        self.assertEqual(self.provider.current(), (50.0, 0.0))
+        self.assertEqual(self.provider.fetched_at, 600)
+
+    def test_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch():
+            started.set()
+            release.wait(5)
+            return fixture_fetcher()()
+
+        self.fetcher.fetch = slow_fetch
+        results = []
+        threads = [threading.Thread(
+            target = lambda: results.append(self.provider.current()))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(started.wait(5))
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.fetcher.calls, 1)
+        self.assertEqual(results, [(41.0, 0.02)] * 8)
+
+    def test_failed_fetch_keeps_last_value(self):
+        self.assertEqual(self.provider.current(), (41.0, 0.02))
+        self.fetcher.done.clear()
+        self.fetcher.fail = True
+        self.clock.now = 1000
+        self.assertEqual(self.provider.current(), (41.0, 0.02))
+        self.wait_for_refresh()
+        self.assertEqual(self.fetcher.calls, 2)
+        self.assertEqual(self.provider.current(), (41.0, 0.02))
+        self.assertFalse(self.provider.refresh())
+
+    def test_failed_first_fetch(self):
+        self.fetcher.fail = True
+        with self.assertRaises(WeatherUnavailable):
+            self.provider.current()
+
+    def test_no_fetch_when_given(self):
+        self.assertEqual(self.provider.get(30, 0.5), (30, 0.5))
+        self.assertEqual(self.provider.get(0, 0), (0, 0))
+        self.assertEqual(self.fetcher.calls, 0)
+        self.assertEqual(self.provider.get(30), (30, 0.02))
+        self.assertEqual(self.provider.get(precip = 0), (41.0, 0))
+        self.assertEqual(self.fetcher.calls, 1)
+
+
+class FailingRemote:
+    '''
+    Remote geocoder answering from a table, that fails on one address
+    '''
+
+    def __init__(self, coordinates, fail):
+        self.coordinates = coordinates
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, address):
+        self.calls.append(address)
+        if address == self.fail:
+            raise OSError('Nominatim is down')
+        return self.coordinates.get(address)
+
+
+class GeocodingTests(SimpleTestCase):
+    '''
+    Address normalization, address point interpolation and the tiers of
+    Geocoder, on a temporary geocode.db
+    '''
+
+    #(number, lat, lon) of the address points on N MAIN ST
+    POINTS = [(1200, 41.90, -87.60), (1300, 41.91, -87.62),
+              (1500, 41.95, -87.64)]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, 'geocode.db')
+        c = connect(self.db)
+        c.executemany('INSERT INTO AddressPoints VALUES (?, ?, ?, ?)',
+                      [('N MAIN ST',) + point for point in self.POINTS])
+        c.commit()
+        self.c = c
+
+    def tearDown(self):
+        self.c.close()
+        shutil.rmtree(self.dir)
+
+    def test_normalize_address(self):
+        for address, key in [
+                ('1234 North Main Street, Chicago IL 60614', '1234 N MAIN ST'),
+                ('1234 n. main st.', '1234 N MAIN ST'),
+                ('55 West Wacker Drive Chicago, Illinois', '55 W WACKER DR'),
+                ('700 S Lake Shore Boulevard, USA', '700 S LAKE SHORE BLVD'),
+                ('Chicago', 'CHICAGO')]:
+            self.assertEqual(normalize_address(address), key)
+
+    def test_address_point(self):
+        #exact, interpolated and snapped to a point within MAX_NUMBER_GAP
+        self.assertEqual(address_point(self.c, '1200 N MAIN ST'),
+                         (41.90, -87.60))
+        lat, lon = address_point(self.c, '1225 N MAIN ST')
+        self.assertAlmostEqual(lat, 41.9025)
+        self.assertAlmostEqual(lon, -87.605)
+        self.assertEqual(address_point(self.c, '1150 N MAIN ST'),
+                         (41.90, -87.60))
+        #the 200 number gap to 1500 is bridged, a gap past it is not
+        lat, lon = address_point(self.c, '1400 N MAIN ST')
+        self.assertAlmostEqual(lat, 41.93)
+        self.assertAlmostEqual(lon, -87.63)
+        self.assertIsNone(address_point(self.c, '1650 N MAIN ST'))
+        self.assertIsNone(address_point(self.c, '1200 S MAIN ST'))
+        self.assertIsNone(address_point(self.c, 'N MAIN ST'))
+
+    def test_resolved_addresses_survive_a_remote_failure(self):
+        remote = FailingRemote({'10 E ELM ST': (41.88, -87.62)},
+                               '20 E ELM ST')
+        geocoder = Geocoder(self.db, remote)
+        addresses = ['1225 N Main Street', '10 East Elm St', '20 E Elm St']
+        with self.assertRaises(OSError):
+            geocoder.geocode_many(addresses)
+        cached = dict((row[0], row[1:]) for row in self.c.execute(
+            'SELECT Address, Latitude, Longitude FROM GeocodeCache'))
+        self.assertEqual(cached['10 E ELM ST'], (41.88, -87.62))
+        self.assertIn('1225 N MAIN ST', cached)
+        self.assertNotIn('20 E ELM ST', cached)
+
+        #a new geocoder (no hot tier) only asks for the failed address
+        remote.fail = None
+        remote.calls = []
+        found = Geocoder(self.db, remote).geocode_many(addresses)
+        self.assertEqual(remote.calls, ['20 E ELM ST'])
+        self.assertEqual(found[1], (41.88, -87.62))
+        self.assertIsNone(found[2])
+
+    def test_one_remote_for_every_thread(self):
+        created = []
+
+        class SlowRemote:
+            def __init__(self):
+                time.sleep(0.05)
+                created.append(self)
+
+        geocoder = Geocoder(self.db)
+        with mock.patch('geocoding.NominatimGeocoder', SlowRemote):
+            threads = [threading.Thread(target = geocoder.get_remote)
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(created), 1)
+        self.assertIs(geocoder.remote, created[0])
+
+
+class CrimeSchemaTests(SimpleTestCase):
+    '''
+    Query plans of the crime queries on a small Crime.db with the indexes of
+    crime_schema
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        cls.c = sqlite3.connect(':memory:')
+        days = pd.date_range('2018-01-01', '2018-12-31')
+        pd.DataFrame({'Date': days.strftime('%Y-%m-%d'),
+                      'AverageTemp': rng.uniform(0, 90, len(days)).round(1),
+                      'Precip': rng.exponential(0.2, len(days)).round(2)}
+                     ).to_sql('DailyWeather', cls.c, index = False)
+        n = 3000
+        day = days[rng.integers(0, len(days), n)]
+        pd.DataFrame({'Case_Number': ['JZ{:07d}'.format(i) for i in range(n)],
+                      'Block': '001XX W 1 ST',
+                      'Primary_Type': 'THEFT',
+                      'Latitude': rng.uniform(41.65, 42.02, n),
+                      'Longitude': rng.uniform(-87.9, -87.52, n),
+                      'Day': day.strftime('%Y-%m-%d'),
+                      'Hour': rng.integers(0, 24, n)},
+                     index = pd.Index(np.arange(n), name = 'ID')
+                     ).to_sql('CrimeData1', cls.c)
+        cls.added = build_indexes(cls.c)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.c.close()
+        super().tearDownClass()
+
+    def plan(self, sample):
+        query, params = Crime_Query(self.c, *sample)
+        return ' | '.join(row[-1] for row in self.c.execute(
+            'EXPLAIN QUERY PLAN ' + query, params))
+
+    def assertNoCrimeScan(self, plan):
+        for line in plan.split(' | '):
+            self.assertFalse(line.startswith(('SCAN CrimeData1',
+                                              'SCAN TABLE CrimeData1')), plan)
+
+    def test_rtree_built(self):
+        self.assertEqual(self.added, 3000)
+        self.assertEqual(build_indexes(self.c), 0)
+
+    def test_neighbourhood_uses_rtree(self):
+        plan = self.plan(SAMPLE_QUERIES[0])
+        self.assertTrue(plan.startswith('SCAN CrimeLocation VIRTUAL TABLE'),
+                        plan)
+        self.assertIn('SEARCH CrimeData1 USING INTEGER PRIMARY KEY', plan)
+        self.assertIn('USING INDEX DailyWeather_Date', plan)
+        self.assertNoCrimeScan(plan)
+
+    def test_city_uses_weather_indexes(self):
+        plan = self.plan(SAMPLE_QUERIES[1])
+        self.assertIn('SEARCH DailyWeather USING COVERING INDEX '
+                      'DailyWeather_Temp_Precip', plan)
+        self.assertIn('SEARCH CrimeData1 USING INDEX CrimeData1_Day_Hour',
+                      plan)
+        self.assertNoCrimeScan(plan)
+
+    def test_weather_days_use_covering_index(self):
+        plan = self.plan(SAMPLE_QUERIES[2])
+        self.assertIn('SEARCH DailyWeather USING COVERING INDEX '
+                      'DailyWeather_Temp_Precip', plan)
+
+    def test_check_query_plans(self):
+        self.assertEqual(len(check_query_plans(self.c)), len(SAMPLE_QUERIES))
+
+    def test_rtree_matches_scan(self):
+        #the R*Tree query finds the same crimes as the plain coordinate query
+        temp, precip, t_sens, p_sens, low, up, lat, lon = SAMPLE_QUERIES[0]
+        lat, lon = (41.80, 41.85), (-87.70, -87.65)
+        found = DataConstructor(self.c, temp, precip, t_sens, p_sens, low, up,
+                                lat, lon)
+        self.assertIn('CrimeLocation', Crime_Query(
+            self.c, temp, precip, t_sens, p_sens, low, up, lat, lon)[0])
+        plain = pd.read_sql(
+            'SELECT CrimeData1.Day, CrimeData1.Hour FROM CrimeData1 JOIN '
+            'DailyWeather ON DailyWeather.Date = CrimeData1.Day WHERE '
+            'Precip <= ? AND Precip >= ? AND AverageTemp <= ? AND '
+            'AverageTemp >= ? AND Latitude BETWEEN ? AND ? AND Longitude '
+            'BETWEEN ? AND ? AND Hour BETWEEN ? AND ?', self.c,
+            params = [precip + p_sens, precip - p_sens, temp + t_sens,
+                      temp - t_sens, *lat, *lon, low, up])
+        self.assertGreater(len(plain), 0)
+        self.assertEqual(sorted(map(tuple, found[['Day', 'Hour']].values)),
+                         sorted(map(tuple, plain.values)))
+
+
+class RoutingTests(SimpleTestCase):
+    '''
+    bidirectional_astar, one_to_many and the landmark potential against
+    networkx's Dijkstra on a street grid snapshot with parallel edges and a
+    separate component
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(7)
+        G = grid_graph(9, 12, seed = 1)
+        #a longer second edge alongside some streets
+        for start, end, attrs in list(G.edges(data = True))[::9]:
+            G.add_edge(start, end, length = attrs['length'] *
+                       rng.uniform(1, 1.5))
+        #two nodes no route reaches
+        G.add_node(1, y = 41.70, x = -87.70)
+        G.add_node(2, y = 41.701, x = -87.70)
+        G.add_edge(1, 2, length = 120.0)
+
+        cls.root = tempfile.mkdtemp()
+        write_snapshot(G, '2000-01-01', cls.root)
+        cls.snapshot = load_snapshot('2000-01-01', cls.root)
+        build_landmarks(cls.snapshot, 4)
+        cls.landmarks = load_landmarks(cls.snapshot)
+        cls.graph = CSRGraph.from_snapshot(cls.snapshot)
+        cls.weights = cls.graph.length * rng.uniform(1, 3,
+                                                      cls.graph.num_edges)
+        cls.isolated = [int(node) for node in
+                        np.nonzero(np.isin(cls.graph.osmid, [1, 2]))[0]]
+        cls.pairs = rng.integers(0, cls.graph.num_nodes - 2, (40, 2))
+
+        cls.reference = nx.MultiGraph()
+        cls.reference.add_nodes_from(range(cls.graph.num_nodes))
+        for edge, (u, v) in enumerate(zip(cls.graph.u, cls.graph.v)):
+            cls.reference.add_edge(int(u), int(v),
+                                   weight = cls.weights[edge])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+        super().tearDownClass()
+
+    def dijkstra(self, source, target):
+        try:
+            return nx.single_source_dijkstra(self.reference, source, target)
+        except nx.NetworkXNoPath:
+            return math.inf, None
+
+    def assertRoute(self, graph, weights, route, cost, path):
+        found, found_cost = route
+        self.assertAlmostEqual(found_cost, cost, places = 6)
+        self.assertEqual(found, path)
+        self.assertAlmostEqual(
+            weights[path_edges(graph, found, weights)].sum(), found_cost,
+            places = 6)
+
+    def test_astar_matches_dijkstra(self):
+        reachable = 0
+        for source, target in self.pairs.tolist():
+            cost, path = self.dijkstra(source, target)
+            reachable += path is not None
+            #great circle, scaled great circle and landmark potentials
+            for potential in [None] + [
+                    alt_potential(self.graph, source, target, self.weights,
+                                  landmarks)
+                    for landmarks in (None, self.landmarks)]:
+                if path is None:
+                    with self.assertRaises(NoPath):
+                        bidirectional_astar(self.graph, source, target,
+                                            self.weights, potential)
+                    continue
+                self.assertRoute(self.graph, self.weights, bidirectional_astar(
+                    self.graph, source, target, self.weights, potential),
+                    cost, path)
+        self.assertGreater(reachable, 30)
+
+    def test_unreachable(self):
+        source = int(self.pairs[0, 0])
+        for target in self.isolated:
+            with self.assertRaises(NoPath):
+                bidirectional_astar(self.graph, source, target, self.weights)
+            with self.assertRaises(NoPath):
+                bidirectional_astar(self.graph, target, source, self.weights)
+        self.assertEqual(bidirectional_astar(
+            self.graph, self.isolated[0], self.isolated[1], self.weights)[0],
+            self.isolated)
+
+    def test_source_is_target(self):
+        node = int(self.pairs[0, 0])
+        self.assertEqual(bidirectional_astar(self.graph, node, node,
+                                             self.weights), ([node], 0))
+        self.assertEqual(list(one_to_many(self.graph, node, [node],
+                                          self.weights)), [(node, [node], 0)])
+
+    def test_parallel_edges(self):
+        #three nodes about 55 m apart, two edges between the first two
+        graph = CSRGraph([10, 11, 12], [41.8, 41.8005, 41.801],
+                         [-87.6] * 3, [0, 0, 1, 0], [1, 1, 2, 2],
+                         [100, 80, 100, 500])
+        weights = graph.length.copy()
+        self.assertEqual(bidirectional_astar(graph, 0, 2, weights),
+                         ([0, 1, 2], 180))
+        self.assertEqual(bidirectional_astar(graph, 2, 0, weights),
+                         ([2, 1, 0], 180))
+        self.assertEqual(path_edges(graph, [0, 1, 2], weights).tolist(),
+                         [1, 2])
+        self.assertEqual(list(one_to_many(graph, 0, [2], weights)),
+                         [(2, [0, 1, 2], 180)])
+        weights[1] = 300
+        self.assertEqual(bidirectional_astar(graph, 0, 2, weights),
+                         ([0, 1, 2], 200))
+        self.assertEqual(path_edges(graph, [0, 1, 2], weights).tolist(),
+                         [0, 2])
+
+    def test_one_to_many(self):
+        source = int(self.pairs[0, 0])
+        targets = set(self.pairs[:15, 1].tolist()) | set(self.isolated)
+        found = list(one_to_many(self.graph, source, targets, self.weights))
+        self.assertEqual({target for target, _, _ in found}, targets)
+        costs = [cost for _, _, cost in found]
+        self.assertEqual(costs, sorted(costs))
+        for target, path, cost in found:
+            reference_cost, reference_path = self.dijkstra(source, target)
+            if reference_path is None:
+                self.assertIsNone(path)
+                self.assertEqual(cost, math.inf)
+            else:
+                self.assertRoute(self.graph, self.weights, (path, cost),
+                                 reference_cost, reference_path)
+
+    def test_alt_potential_is_feasible(self):
+        #reduced edge costs stay non-negative in both directions, also when
+        #a few streets are far cheaper than the rest
+        cheap = self.weights.copy()
+        cheap[::5] = self.graph.length[::5]
+        cheap[1::5] *= 10
+        u = self.graph.u
+        v = self.graph.v
+        for weights in (self.weights, cheap):
+            for source, target in self.pairs[:10].tolist():
+                potential = alt_potential(self.graph, source, target, weights,
+                                          self.landmarks)
+                gap = potential[u] - potential[v]
+                self.assertGreaterEqual((weights - np.abs(gap)).min(), -1e-6)
+
+    def test_landmark_bounds(self):
+        #no landmark bound exceeds the walking distance
+        lengths = nx.MultiGraph()
+        lengths.add_nodes_from(range(self.graph.num_nodes))
+        lengths.add_weighted_edges_from(zip(self.graph.u.tolist(),
+                                            self.graph.v.tolist(),
+                                            self.graph.length))
+        nid = np.arange(self.graph.num_nodes)
+        for target in self.pairs[:5, 1].tolist():
+            distance = nx.single_source_dijkstra_path_length(lengths, target)
+            bound = self.landmarks.bounds(nid, [target])[0]
+            for node, walk in distance.items():
+                self.assertLessEqual(bound[node], walk + 1e-6)
+                self.assertLessEqual(great_circle(
+                    self.graph.lat[node], self.graph.lon[node],
+                    self.graph.lat[target], self.graph.lon[target]),
+                    walk + 1e-6)
+
+
+class RegressionTests(SimpleTestCase):
+    '''
+    The batched pseudo-inverse fit of Regression_Params against statsmodels
+    OLS, block by block
+    '''
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        days = pd.date_range('2012-01-01', '2018-12-31')
+        days = days[np.sort(rng.choice(len(days), 300, replace = False))]
+        self.weather = pd.DataFrame(
+            {'Date': days.values.astype('datetime64[s]').astype(np.int64)},
+            index = pd.Index(days.strftime('%Y-%m-%d'), name = 'Date'))
+        self.scores = rng.poisson(2, (6, len(days))).astype(np.float64)
+        #a block without crimes and one with the same score every day
+        self.scores[4] = 0
+        self.scores[5] = 7
+
+    def ols(self, weather, scores):
+        import statsmodels.api as sm
+
+        X = sm.add_constant(weather.Date, has_constant = 'add')
+        with warnings.catch_warnings():
+            #a constant date makes the design matrix rank-deficient
+            warnings.simplefilter('ignore')
+            return np.array([sm.OLS(block, X).fit().params.values
+                             for block in scores]).T
+
+    def test_params_match_ols(self):
+        np.testing.assert_allclose(
+            Regression_Params(self.weather, self.scores),
+            self.ols(self.weather, self.scores), rtol = 1e-6, atol = 1e-12)
+
+    def test_projection_matches_ols(self):
+        params = self.ols(self.weather, self.scores)
+        date = mktime(datetime.strptime('2019-03-16',
+                                        '%Y-%m-%d').timetuple())
+        expected = np.maximum(10**6 * params[0] + params[1] * date, 1)
+        found = Regression_Batch(self.weather, self.scores, '2019-03-16')
+        self.assertEqual(found.dtype, np.int64)
+        self.assertLessEqual(np.abs(found - expected.astype(np.int64)).max(),
+                             1)
+        self.assertEqual(found[4], 1)
+
+    def test_constant_regressor(self):
+        #every similar day at the same time: both fits take the minimum norm
+        #solution
+        weather = self.weather.copy()
+        weather['Date'] = weather.Date.iloc[0]
+        np.testing.assert_allclose(Regression_Params(weather, self.scores),
+                                   self.ols(weather, self.scores),
+                                   rtol = 1e-6, atol = 1e-12)
+
+    def test_too_few_days(self):
+        for days in (0, 1):
+            weather = self.weather.iloc[:days]
+            scores = self.scores[:, :days]
+            self.assertIsNone(Regression_Params(weather, scores))
+            self.assertEqual(Regression_Batch(weather, scores,
+                                              '2019-03-16').tolist(),
+                             [1] * len(scores))
+
+
+class SyntheticDataTest(SimpleTestCase):
+    '''
+    Base for tests on a small synthetic street grid snapshot and Crime.db
+    (see benchmarks.synthetic), written to a temporary directory
+    '''
+
+    rows = 16
+    cols = 24
+    crimes = 20000
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.snapshots = os.path.join(cls.root, SNAPSHOT_ROOT)
+        write_grid_snapshot(cls.snapshots, cls.rows, cls.cols)
+        cls.snapshot = load_snapshot(root = cls.snapshots)
+        cls.db = os.path.join(cls.root, 'Crime.db')
+        write_crime_db(cls.db, cls.snapshot, cls.crimes)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+        super().tearDownClass()
+
+    def boxes(self, count, seed = 0):
+        '''
+        Random (lat, lon) ranges inside the grid, as DataConstructor takes
+        them
+        '''
+
+        rng = np.random.default_rng(seed)
+        lat = np.sort(rng.uniform(self.snapshot.lat.min(),
+                                  self.snapshot.lat.max(), (count, 2)))
+        lon = np.sort(rng.uniform(self.snapshot.lon.min(),
+                                  self.snapshot.lon.max(), (count, 2)))
+        return [(tuple(a), tuple(b)) for a, b in zip(lat.tolist(),
+                                                     lon.tolist())]
+
+    def assertSameRows(self, store, sql):
+        columns = list(sql.columns)
+        self.assertEqual(list(store.columns), columns)
+        pd.testing.assert_frame_equal(
+            store.sort_values(columns).reset_index(drop = True),
+            sql.sort_values(columns).reset_index(drop = True),
+            check_dtype = False)
+
+    def write_crime_csv(self, path, count, start, seed = 0):
+        '''
+        Writes new synthetic crimes as a city data portal export, with IDs
+        and case numbers from start on
+        '''
+
+        rng = np.random.default_rng(seed)
+        edges = np.nonzero(np.asarray(self.snapshot.name) >= 0)[0]
+        c = sqlite3.connect(self.db)
+        days = pd.DatetimeIndex(pd.read_sql('SELECT Date FROM DailyWeather',
+                                            c).Date)
+        c.close()
+        crimes = crime_rows(rng, self.snapshot, edges,
+                            np.full(len(edges), 1 / len(edges)),
+                            block_names(self.snapshot, edges), days, start,
+                            count)
+        crimes['Date'] = pd.to_datetime(crimes.Date).dt.strftime(DATE_FORMAT)
+        crimes = crimes.drop(columns = ['Day', 'Hour'])
+        crimes.columns = [k.replace('_', ' ') for k in crimes.columns]
+        crimes.to_csv(path)
+
+
+class BlockScoreTests(SyntheticDataTest):
+    '''
+    assign_crimes and block_score_matrix against the mask over every crime
+    that Regression_Array ran for each block before them
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        snapshot = cls.snapshot
+        lat = np.asarray(snapshot.lat)
+        lon = np.asarray(snapshot.lon)
+        edges = np.nonzero(np.asarray(snapshot.name) >= 0)[0]
+        u = np.asarray(snapshot.u)[edges]
+        v = np.asarray(snapshot.v)[edges]
+        cls.blocks = list(edge_to_latlon(list(zip(zip(lat[u], lon[u]),
+                                                  zip(lat[v], lon[v])))))
+        c = sqlite3.connect(cls.db)
+        crimes = pd.read_sql('SELECT Day, Hour, Primary_Type, Block, '
+                             'Latitude, Longitude FROM CrimeData1', c)
+        c.close()
+        #crimes on the corners of boxes, without coordinates and of types
+        #without a safety score
+        extra = crimes.sample(60, random_state = 0).reset_index(drop = True)
+        for i, block in enumerate(cls.blocks[:20]):
+            extra.loc[i, ['Latitude', 'Longitude']] = block[0][0], \
+                block[1][0]
+            extra.loc[20 + i, ['Latitude', 'Longitude']] = block[0][1], \
+                block[1][1]
+        extra.loc[40:49, ['Latitude', 'Longitude']] = np.nan
+        extra.loc[50:, 'Primary_Type'] = 'ARSON'
+        cls.crimes = pd.concat([crimes, extra], ignore_index = True)
+        cls.crimes['Primary_Type'] = cls.crimes.Primary_Type.map(SAFETY_DICT)
+        #some days of the crimes are not scored
+        cls.days = pd.Index(sorted(cls.crimes.Day.unique())[::3][1:])
+
+    def mask_loop(self, blocks, crimes, days):
+        '''
+        The per-block loop of Regression_Array before assign_crimes, with a
+        stable sort so that ties go to the first block name in order
+        '''
+
+        scores = np.zeros((len(blocks), len(days)))
+        for i, block in enumerate(blocks):
+            crime = crimes[((crimes.Latitude >= block[0][0]) & (
+                crimes.Latitude <= block[0][1]) & (
+                crimes.Longitude >= block[1][0]) & (
+                crimes.Longitude <= block[1][1]))]
+            if len(crime) == 0:
+                continue
+            block_name = crime.groupby('Block').count().sort_values(
+                'Longitude', ascending = False, kind = 'stable').index[0]
+            crime = crime[crime.Block == block_name]
+            day = days.get_indexer(crime.Day)
+            found = day >= 0
+            np.add.at(scores[i], day[found],
+                      crime.Primary_Type.fillna(0).values[found])
+        return scores
+
+    def test_scores_match_mask_loop(self):
+        scores = block_score_matrix(self.blocks, self.crimes, self.days)
+        self.assertGreater(scores.sum(), 0)
+        np.testing.assert_array_equal(
+            scores, self.mask_loop(self.blocks, self.crimes, self.days))
+
+    def test_assign_crimes(self):
+        latitude = self.crimes.Latitude.values
+        longitude = self.crimes.Longitude.values
+        expected = set()
+        for i, block in enumerate(self.blocks):
+            rows = np.nonzero((latitude >= block[0][0]) &
+                              (latitude <= block[0][1]) &
+                              (longitude >= block[1][0]) &
+                              (longitude <= block[1][1]))[0]
+            expected.update((int(row), i) for row in rows)
+        #cells smaller and larger than a block
+        for cell in (0.0003, 0.001, 0.01):
+            rows, positions = assign_crimes(self.blocks, latitude,
+                                            longitude, cell)
+            self.assertEqual(set(zip(rows.tolist(), positions.tolist())),
+                             expected)
+            self.assertEqual(len(rows), len(expected))
+        self.assertEqual([len(a) for a in assign_crimes([], latitude,
+                                                        longitude)], [0, 0])
+
+
+class DataDirTest(SyntheticDataTest):
+    '''
+    Base for tests run from the synthetic data directory, as the site runs
+    from the one holding Crime.db and graph_snapshots
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cwd = os.getcwd()
+        os.chdir(cls.root)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        super().tearDownClass()
+
+
+class CrimeStoreTests(SyntheticDataTest):
+    '''
+    DataConstructor on the exported crime store against the same queries on
+    Crime.db
+    '''
+
+    #(temp, precip, t_sens, p_sens); the synthetic weather has temperatures
+    #to 0.1 degree and precipitation to 0.01 inch, so the bounds of the last
+    #two fall on recorded values
+    CONDITIONS = [(50, 0, 12, 0.5), (30, 0.1, 5, 0.5), (71.5, 0.25, 2.5, 0.15)]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.store = load_store(export_store(
+            cls.db, os.path.join(cls.root, 'crime_store')))
+        cls.c = sqlite3.connect(cls.db)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.c.close()
+        super().tearDownClass()
+
+    def test_same_rows(self):
+        lat = np.sort(self.store.lat)
+        #boxes whose edges are crime coordinates, which a rounded copy of
+        #the coordinates would move in or out of the box
+        edges = [((lat[i], lat[i + 3000]), (self.store.lon.min(),
+                                            self.store.lon[i]))
+                 for i in (100, 5000, 9000)]
+        rows = 0
+        for temp, precip, t_sens, p_sens in self.CONDITIONS:
+            for lat, lon in self.boxes(6) + edges:
+                for low, up in ((0, 23), (16, 20)):
+                    args = (temp, precip, t_sens, p_sens, low, up, lat, lon)
+                    sql = DataConstructor(self.c, *args)
+                    self.assertSameRows(DataConstructor(self.store, *args),
+                                        sql)
+                    rows += len(sql)
+        self.assertGreater(rows, 1000)
+
+    def test_same_days(self):
+        for conditions in self.CONDITIONS:
+            self.assertSameRows(DataConstructor(self.store, *conditions),
+                                DataConstructor(self.c, *conditions))
+
+
+class DataReloadTests(DataDirTest):
+    '''
+    The crime store and score cube served after an ingest
+    '''
+
+    #the weather and hours of go()'s default window
+    CONDITIONS = (50, 0, 12, 0.5, 15, 19)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        export_store()
+        build_cube(cls.snapshot, [50.0], [0.0], ref_date = '2019-01-01')
+
+    def cube_scores(self, cube):
+        eids = np.nonzero(np.asarray(self.snapshot.name) >= 0)[0]
+        return cube.scores(eids, 17, 50, 0, '2019-06-01', 12, 0.5)
+
+    def test_fresh_data_after_ingest(self):
+        box = ((self.snapshot.lat.min(), self.snapshot.lat.max()),
+               (self.snapshot.lon.min(), self.snapshot.lon.max()))
+        before = DataConstructor(Crime_Source(), *self.CONDITIONS, *box)
+        scores = self.cube_scores(get_cube(self.snapshot))
+
+        csv = os.path.join(self.root, 'crimes.csv')
+        self.write_crime_csv(csv, 5000, self.crimes, seed = 1)
+        c = sqlite3.connect('Crime.db')
+        self.assertEqual(ingest_crimes(c, csv), 5000)
+        refresh(c, 'Crime.db')
+        build_cube(self.snapshot, [50.0], [0.0], ref_date = '2019-01-01')
+
+        after = DataConstructor(Crime_Source(), *self.CONDITIONS, *box)
+        self.assertGreater(len(after), len(before))
+        self.assertSameRows(after, DataConstructor(c, *self.CONDITIONS, *box))
+        c.close()
+        fresh = self.cube_scores(get_cube(self.snapshot))
+        self.assertFalse(np.array_equal(fresh, scores))
+        np.testing.assert_array_equal(
+            fresh, self.cube_scores(load_cube(self.snapshot)))
+
+
+class IngestTests(DataDirTest):
+    '''
+    ingest.py on the synthetic Crime.db, with a crime store and score cube
+    exported beforehand
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        export_store()
+        build_cube(cls.snapshot, [50.0], [0.0], ref_date = '2019-01-01')
+
+    def setUp(self):
+        self.c = sqlite3.connect('Crime.db')
+
+    def tearDown(self):
+        self.c.close()
+
+    def test_ingest(self):
+        c = self.c
+        weather = os.path.join(self.root, 'weather.csv')
+        days = pd.read_sql('SELECT MIN(Date), MAX(Date) FROM DailyWeather', c)
+        first, last = pd.to_datetime(days.iloc[0])
+        day = pd.Timedelta(days = 1)
+        dates = [first - 2 * day, first - day, first, last + day]
+        pd.DataFrame({'DATE': [d.strftime('%Y-%m-%d') for d in dates],
+                      'DAILYAverageDryBulbTemp': ['41', '38s', '50', '60'],
+                      'DAILYPrecip': ['T', '0.10', '0', '0']}).to_csv(
+                          weather, index = False)
+        self.assertEqual(ingest_weather(c, weather), 3)
+
+        #500 case numbers already in Crime.db and 100 new crimes without
+        #coordinates, which the block means fill in
+        crimes = os.path.join(self.root, 'crimes.csv')
+        self.write_crime_csv(crimes, 3000, self.crimes - 500, seed = 2)
+        csv = pd.read_csv(crimes, index_col = 0)
+        held = csv['Case Number'].iloc[500:600].tolist()
+        csv.iloc[500:600, [csv.columns.get_loc(col.replace('_', ' '))
+                           for col in FILL_COLS]] = np.nan
+        csv.to_csv(crimes)
+        self.assertEqual(ingest_crimes(c, crimes, chunk_size = 1000), 2500)
+        self.assertEqual(ingest_crimes(c, crimes), 0)
+        refresh(c, 'Crime.db')
+
+        filled = pd.read_sql('SELECT Latitude, Longitude FROM CrimeData1 '
+                             'WHERE Case_Number IN ({})'.format(
+                                 ', '.join('?' * len(held))), c,
+                             params = held)
+        self.assertEqual(len(filled), 100)
+        self.assertFalse(filled.isna().any().any())
+
+        #the block sums cover every crime written with its own coordinates
+        sums = pd.read_sql('SELECT Block, Latitude_Sum, Latitude_Count FROM '
+                           'BlockCoordinates', c, index_col = 'Block')
+        expected = pd.read_sql(
+            'SELECT Block, SUM(Latitude) AS Latitude_Sum, COUNT(Latitude) AS '
+            'Latitude_Count FROM CrimeData1 WHERE Case_Number NOT IN ({}) '
+            'GROUP BY Block'.format(', '.join('?' * len(held))), c,
+            params = held, index_col = 'Block')
+        pd.testing.assert_frame_equal(sums.sort_index(),
+                                      expected.sort_index(),
+                                      check_dtype = False)
+
+        check_query_plans(c)
+        last = c.execute('SELECT MAX(rowid) FROM CrimeData1').fetchone()[0]
+        self.assertEqual(c.execute("SELECT Value FROM SeverityMeta WHERE Key "
+                                   "= 'last_rowid'").fetchone()[0], str(last))
+        self.assertIsNone(get_cube(self.snapshot))
+
+        #the store got the new rows as a full export would have written them
+        store = load_store()
+        full = load_store(export_store(out = 'exported_store'))
+        for key in {**CRIME_COLUMNS, **WEATHER_COLUMNS}:
+            np.testing.assert_array_equal(getattr(store, key),
+                                          getattr(full, key), err_msg = key)
+        self.assertEqual(list(store.blocks), list(full.blocks))
+        self.assertEqual(dict(store.manifest, built = None),
+                         dict(full.manifest, built = None))
+        self.assertEqual(store.manifest['crimes'], self.crimes + 2500)
+
+    def test_refresh_without_new_rows(self):
+        version = store_version()
+        refresh(self.c, 'Crime.db', added = False)
+        self.assertEqual(store_version(), version)
+
+
+class SeverityTests(DataDirTest):
+    '''
+    The regression on the per-edge daily severity against the one matching
+    raw crimes to blocks
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        lat = np.asarray(cls.snapshot.lat)
+        lon = np.asarray(cls.snapshot.lon)
+        cls.G = bbox_subgraph(cls.snapshot, lat.max(), lat.min(), lon.max(),
+                              lon.min())
+        cls.edges = np.nonzero(cls.G.named)[0]
+        cls.pairs = [edge_to_latlon_pair(cls.G, edge) for edge in cls.edges]
+        shutil.copy('Crime.db', 'unbuilt.db')
+        c = sqlite3.connect('Crime.db')
+        refresh_severity(c, cls.snapshot)
+        c.close()
+
+    def test_ready_follows_the_database(self):
+        self.assertFalse(severity_ready(self.snapshot, 'unbuilt.db'))
+        c = sqlite3.connect('unbuilt.db')
+        refresh_severity(c, self.snapshot)
+        c.close()
+        self.assertTrue(severity_ready(self.snapshot, 'unbuilt.db'))
+        #asked on every request, so answered without opening the database
+        with mock.patch('severity.sqlite3.connect') as connect:
+            self.assertTrue(severity_ready(self.snapshot, 'unbuilt.db'))
+        connect.assert_not_called()
+
+    def test_edges_match_blocks(self):
+        eids = self.G.eid[self.edges]
+        for temp, precip, hour, date in [(50, 0, 17, '2019-01-01'),
+                                         (40, 0.5, 8, '2019-06-01')]:
+            edges = Regression_Edges(eids, temp, precip, 12, 0.5, date,
+                                     hour - 2, hour + 2)
+            blocks = Regression_Array(self.pairs, temp, precip, 12, 0.5,
+                                      date, hour - 2, hour + 2)
+            self.assertGreater(blocks.max(), 1)
+            np.testing.assert_array_equal(edges, blocks)
+        windows = [(hour - 2, hour + 2) for hour in (0, 9, 17)]
+        np.testing.assert_array_equal(
+            Regression_Edge_Hours(eids, 50, 0, 12, 0.5, '2019-01-01',
+                                  windows),
+            Regression_Hours(self.pairs, 50, 0, 12, 0.5, '2019-01-01',
+                             windows))
+
+
+class DictBackend:
+    '''
+    Shared route cache backend with the get/set methods of Django's caches
+    '''
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key, default = None):
+        return self.entries.get(key, default)
+
+    def set(self, key, value, timeout = None):
+        self.entries[key] = value
+
+
+class RouteCacheTests(DataDirTest):
+    '''
+    Route cache keys and tiers
+    '''
+
+    def setUp(self):
+        lat = np.asarray(self.snapshot.lat)
+        lon = np.asarray(self.snapshot.lon)
+        self.start = (float(lat[0]), float(lon[0]))
+        self.end = (float(lat[-1]), float(lon[-1]))
+
+    def key(self, start = None, hour = 17, temp = 50, precip = 0.0,
+            date = '2019-06-01'):
+        return RouteCache().key(start or self.start, self.end, date, hour,
+                                temp, precip)
+
+    def test_key_bands(self):
+        key = self.key()
+        #ends snapped to the same nodes, conditions in the same bands
+        near = (self.start[0] + 1e-5, self.start[1] - 1e-5)
+        self.assertEqual(self.key(start = near), key)
+        self.assertEqual(self.key(temp = 48), self.key(temp = 52))
+        self.assertEqual(self.key(precip = 0.04), key)
+        self.assertNotEqual(self.key(temp = 53), key)
+        self.assertNotEqual(self.key(precip = 0.06), key)
+        self.assertNotEqual(self.key(hour = 18), key)
+        self.assertNotEqual(self.key(date = '2019-06-02'), key)
+        other = (self.start[0] + BLOCK_LAT, self.start[1])
+        self.assertNotEqual(self.key(start = other), key)
+
+        #an ingest writes to Crime.db
+        stat = os.stat('Crime.db')
+        os.utime('Crime.db', ns = (stat.st_atime_ns,
+                                   stat.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(self.key(), key)
+
+    def test_tiers(self):
+        backend = DictBackend()
+        first = RouteCache(size = 2, backend = backend)
+        second = RouteCache(size = 2, backend = backend)
+        self.assertIsNone(first.get('a'))
+        first.put('a', 1)
+        self.assertEqual(first.get('a'), 1)
+        self.assertEqual(first.stats(), {'hits': 1, 'shared_hits': 0,
+                                         'misses': 1, 'entries': 1})
+
+        #computed by another process, then held locally
+        self.assertEqual(second.get('a'), 1)
+        backend.entries.clear()
+        self.assertEqual(second.get('a'), 1)
+        self.assertEqual(second.stats(), {'hits': 2, 'shared_hits': 1,
+                                          'misses': 0, 'entries': 1})
+
+        #the local tier keeps the most recently used entries
+        second.put('b', 2)
+        second.get('a')
+        second.put('c', 3)
+        backend.entries.clear()
+        self.assertIsNone(second.get('b'))
+        self.assertEqual((second.get('a'), second.get('c')), (1, 3))
+
+        second.clear()
+        self.assertIsNone(second.get('a'))
+
+    def test_counters_across_threads(self):
+        cache = RouteCache(backend = DictBackend())
+        cache.put('hit', 1)
+        keys = ['hit', 'miss'] * 2000
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            list(pool.map(cache.get, keys))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2000, 2000))
+
+
+class RouteDataTest(DataDirTest):
+    '''
+    Base for tests routing on the synthetic data, with the stub geocoder and
+    weather of the benchmarks
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.provider = current_weather._PROVIDER
+        cls.geocoder = install_stubs()
+        route_cache._ROUTE_CACHE = None
+
+    @classmethod
+    def tearDownClass(cls):
+        current_weather.set_provider(cls.provider)
+        geocoding._GEOCODERS.pop(geocoding.GEOCODE_DB, None)
+        route_cache._ROUTE_CACHE = None
+        super().tearDownClass()
+
+    def route_args(self, start, end, hour = 17):
+        '''
+        Arguments of go() for a route between two (lat, lon) points
+        '''
+
+        self.geocoder.add(str(start), start)
+        self.geocoder.add(str(end), end)
+        return {'start_address': str(start), 'end_address': str(end),
+                'date_of_travel': '2019-06-01', 'hour_of_travel': hour,
+                'temperature': None, 'precipitation': None}
+
+
+class RouteTests(RouteDataTest):
+    '''
+    go() and its variants on the synthetic data
+    '''
+
+    INVALID = "Please enter valid addresses within the City of Chicago."
+
+    def test_addresses_off_the_grid(self):
+        #far enough from the grid that no node is in the bounding box
+        north = float(self.snapshot.lat.max()) + 0.5
+        east = float(self.snapshot.lon.max()) + 0.5
+        args = self.route_args((north, east), (north + 0.001, east))
+        self.assertEqual(go(args), self.INVALID)
+        self.assertEqual(go_sweep(args), self.INVALID)
+        self.assertEqual(go_alternatives(args), self.INVALID)
+        pairs = [(args['start_address'], args['end_address'])]
+        self.assertEqual(list(go_batch(pairs, '2019-06-01', 17)),
+                         [(0, self.INVALID, None)])
+
+    def test_alternatives_cost(self):
+        lat = np.asarray(self.snapshot.lat)
+        lon = np.asarray(self.snapshot.lon)
+        start = (float(lat[0]), float(lon[0]))
+        end = (float(lat[-1]), float(lon[-1]))
+        G = get_graph(lat.max(), lat.min(), lon.max(), lon.min())
+        scores = graph_scores(G, '2019-06-01', 17, 50, 0.0)
+        #every way out of the start is unscored, so every route has some
+        source = G.node_index().nearest(start)
+        out = G.edge_ids[G.offsets[source]:G.offsets[source + 1]]
+        scores[out] = UNSCORED
+        routes = get_alternatives(start, end, G, scores)
+        self.assertGreater(len(routes), 1)
+        for path, distance, cost, unscored in routes:
+            edges = path_edges(G, path, G.length * scores)
+            off = scores[edges] == UNSCORED
+            self.assertAlmostEqual(unscored, G.length[edges[off]].sum())
+            self.assertGreater(unscored, 0)
+            self.assertAlmostEqual(cost,
+                                   (G.length * scores)[edges[~off]].sum())
+            self.assertAlmostEqual(distance, G.length[edges].sum())
+        ranks = [(route[3], route[2]) for route in routes]
+        self.assertEqual(ranks, sorted(ranks))
+
+        for route, score, distance, cost, unscored in go_alternatives(
+                self.route_args(start, end)):
+            self.assertLess(cost, UNSCORED)
+            self.assertTrue(0 <= score <= 100)
+
+    def test_route_on_the_grid(self):
+        lat = np.asarray(self.snapshot.lat)
+        lon = np.asarray(self.snapshot.lon)
+        start = (float(lat[0]), float(lon[0]))
+        end = (float(lat[-1]), float(lon[-1]))
+        path, score = go(self.route_args(start, end))
+        self.assertGreater(len(path), 2)
+        self.assertLess(great_circle(*start, *path[0]), 1)
+        self.assertLess(great_circle(*end, *path[-1]), 1)
+        self.assertTrue(0 <= score <= 100)
+
+
+def slow_go(args):
+    '''
+    go(args) half a second late
+    '''
+
+    time.sleep(0.5)
+    return go(args)
+
+
+def kill_workers(executor):
+    '''
+    Kills the worker processes of a pool, as the OS would when out of memory
+    '''
+
+    for process in list(executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+
+class RoutePoolTests(RouteDataTest):
+    '''
+    RoutePool forking workers from the test process
+    '''
+
+    def setUp(self):
+        lat = np.asarray(self.snapshot.lat)
+        lon = np.asarray(self.snapshot.lon)
+        #the stub geocoder is copied into the workers when they are forked
+        self.args = self.route_args((float(lat[0]), float(lon[0])),
+                                    (float(lat[-1]), float(lon[-1])))
+        self.pool = RoutePool(workers = 2, queue_limit = 1,
+                              queue_wait = 0.05)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_start_forks_every_worker(self):
+        executor = self.pool.start()
+        self.assertEqual(len(executor._processes), 2)
+        self.assertIs(self.pool.start(), executor)
+
+    def test_route(self):
+        self.assertEqual(self.pool.route(self.args), go(self.args))
+
+    def test_busy_and_timeout(self):
+        #two jobs running and one queued fill the pool
+        jobs = [self.pool.submit(time.sleep, 0.5)[0] for _ in range(3)]
+        with self.assertRaises(PoolBusy):
+            self.pool.submit(time.sleep, 0.5)
+        concurrent.futures.wait(jobs)
+        #a route queued behind two running jobs
+        for _ in range(2):
+            self.pool.submit(time.sleep, 0.5)
+        self.pool.timeout = 0.1
+        with self.assertRaises(RouteTimeout):
+            self.pool.route(self.args)
+
+    def test_worker_killed(self):
+        executor = self.pool.start()
+        kill_workers(executor)
+        self.assertEqual(self.pool.route(self.args), go(self.args))
+        self.assertIsNot(self.pool.executor, executor)
+
+    def test_worker_killed_during_route(self):
+        #a kind of job slow enough to kill its worker half way
+        with mock.patch.dict(worker_pool.ROUTE_KINDS, {'slow': 'slow_go'}), \
+                mock.patch.object(dijkstra_path1, 'slow_go', slow_go,
+                                  create = True):
+            executor = self.pool.start()
+            killer = threading.Timer(0.2, kill_workers, (executor,))
+            killer.start()
+            result = self.pool.route(self.args, 'slow')
+            killer.join()
+        self.assertEqual(result, go(self.args))
+        self.assertIsNot(self.pool.executor, executor)
+
+
+class SubgraphTests(SyntheticDataTest):
+    '''
+    induced_subgraph, largest_component and bbox_subgraph against the same
+    cuts of the snapshot in networkx
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reference = nx.MultiGraph()
+        cls.reference.add_nodes_from(range(len(cls.snapshot.lat)))
+        for edge, (u, v) in enumerate(zip(cls.snapshot.u, cls.snapshot.v)):
+            cls.reference.add_edge(int(u), int(v), key = edge)
+
+    def edges(self, nodes):
+        '''
+        Snapshot ids of the edges between a set of snapshot nodes
+        '''
+
+        return {key for _, _, key in self.reference.subgraph(
+            nodes).edges(keys = True)}
+
+    def assertCut(self, G, nodes):
+        '''
+        Checks that a CSRGraph is the snapshot cut down to a set of nodes
+        '''
+
+        self.assertEqual(set(G.nid.tolist()), set(nodes))
+        self.assertEqual(set(G.eid.tolist()), self.edges(nodes))
+        snapshot = self.snapshot
+        np.testing.assert_array_equal(G.nid[G.u], np.asarray(snapshot.u)[
+            G.eid])
+        np.testing.assert_array_equal(G.nid[G.v], np.asarray(snapshot.v)[
+            G.eid])
+        for name in ('osmid', 'lat', 'lon'):
+            np.testing.assert_array_equal(
+                getattr(G, name), np.asarray(getattr(snapshot, name))[G.nid])
+        for name in ('length', 'name'):
+            np.testing.assert_array_equal(
+                getattr(G, name), np.asarray(getattr(snapshot, name))[G.eid])
+
+    def assertLargest(self, G, nodes):
+        '''
+        Checks that a CSRGraph is a largest connected component of the
+        snapshot cut down to a set of nodes
+        '''
+
+        components = list(nx.connected_components(
+            self.reference.subgraph(nodes)))
+        size = max(map(len, components), default = 0)
+        largest = set(G.nid.tolist())
+        if size == 0:
+            self.assertEqual(G.num_nodes, 0)
+            return
+        self.assertIn(largest, [c for c in components if len(c) == size])
+        self.assertCut(G, largest)
+
+    def test_random_masks(self):
+        rng = np.random.default_rng(0)
+        n = len(self.snapshot.lat)
+        #sparse masks leave many components
+        for share in (0, 0.3, 0.5, 0.7, 1):
+            mask = rng.random(n) < share
+            nodes = np.nonzero(mask)[0].tolist()
+            G = induced_subgraph(self.snapshot, mask)
+            self.assertCut(G, nodes)
+            self.assertLargest(G.largest_component(), nodes)
+
+            #cut again out of the cut, ids still refer to the snapshot
+            inner = rng.random(G.num_nodes) < 0.7
+            self.assertCut(G.subgraph(inner), G.nid[inner].tolist())
+
+    def test_bbox_subgraph(self):
+        lat = np.asarray(self.snapshot.lat)
+        lon = np.asarray(self.snapshot.lon)
+        for (s_lat, n_lat), (w_lon, e_lon) in self.boxes(20):
+            nodes = np.nonzero((lat <= n_lat) & (lat >= s_lat) &
+                               (lon <= e_lon) & (lon >= w_lon))[0].tolist()
+            self.assertLargest(bbox_subgraph(self.snapshot, n_lat, s_lat,
+                                             e_lon, w_lon), nodes)
+
+
+class TileTests(SyntheticDataTest):
+    '''
+    Graphs and snapping from the tiles of the synthetic snapshot against the
+    same on the whole snapshot
+    '''
+
+    #degrees; a few blocks, so that boxes and rings cross many tiles
+    SIZE = 0.005
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        build_tiles(cls.snapshot, cls.SIZE)
+        cls.tiles = load_tiles(cls.snapshot)
+
+    def test_subgraph(self):
+        #the whole grid, random boxes and a box off the grid
+        lat = np.asarray(self.snapshot.lat)
+        lon = np.asarray(self.snapshot.lon)
+        boxes = [((lat.min(), lat.max()), (lon.min(), lon.max())),
+                 ((lat.max() + 0.01, lat.max() + 0.02), (lon.min(),
+                                                        lon.max()))]
+        for (s_lat, n_lat), (w_lon, e_lon) in self.boxes(20) + boxes:
+            tiled = self.tiles.subgraph(n_lat, s_lat, e_lon, w_lon)
+            whole = bbox_subgraph(self.snapshot, n_lat, s_lat, e_lon, w_lon)
+            for name in ('nid', 'eid', 'osmid', 'lat', 'lon', 'u', 'v',
+                         'length', 'name', 'named', 'offsets', 'targets',
+                         'edge_ids'):
+                np.testing.assert_array_equal(getattr(tiled, name),
+                                              getattr(whole, name),
+                                              err_msg = name)
+
+    def test_nearest_nodes(self):
+        rng = np.random.default_rng(0)
+        lat = np.asarray(self.snapshot.lat)
+        lon = np.asarray(self.snapshot.lon)
+        #points on and around the grid, some several tiles off it
+        points = np.column_stack((
+            rng.uniform(lat.min() - 0.02, lat.max() + 0.02, 200),
+            rng.uniform(lon.min() - 0.02, lon.max() + 0.02, 200)))
+        points = np.vstack((points, np.column_stack((lat[:20], lon[:20]))))
+        expected = [int(np.argmin(great_circle(a, b, lat, lon)))
+                    for a, b in points]
+        self.assertEqual(self.tiles.nearest_nodes(points.tolist()),
+                         expected)
+
+
+class ScoreCubeTests(DataDirTest):
+    '''
+    Score cube lookups against the live regression they stand in for
+    '''
+
+    TEMPS = [40.0, 50.0, 60.0]
+    PRECIPS = [0.0, 0.5]
+    REF_DATE = '2019-01-01'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        build_cube(cls.snapshot, cls.TEMPS, cls.PRECIPS,
+                   ref_date = cls.REF_DATE)
+        cls.cube = load_cube(cls.snapshot)
+        lat = np.asarray(cls.snapshot.lat)
+        lon = np.asarray(cls.snapshot.lon)
+        cls.G = bbox_subgraph(cls.snapshot, lat.max(), lat.min(), lon.max(),
+                              lon.min())
+        cls.edges = np.nonzero(cls.G.named)[0]
+
+    def test_centres_match_the_regression(self):
+        pairs = [edge_to_latlon_pair(self.G, edge) for edge in self.edges]
+        for temp, precip, hour, date in [(50, 0, 17, self.REF_DATE),
+                                         (40, 0.5, 8, '2019-06-01'),
+                                         (60, 0, 0, '2018-03-15')]:
+            cube = self.cube.scores(self.G.eid[self.edges], hour, temp,
+                                    precip, date, 12, 0.5)
+            live = Regression_Array(pairs, temp, precip, 12, 0.5, date,
+                                    hour - 2, hour + 2)
+            self.assertGreater(live.max(), 1)
+            #ref and slope are stored as 32 bit floats
+            np.testing.assert_allclose(cube, live, rtol = 1e-5, atol = 1)
+
+    def test_tolerance(self):
+        key = self.cube.key
+        #half a step by default: every condition in range is approximated
+        self.assertEqual(key(17, 54.9, 0.2, 12, 0.5), (17, 1, 0))
+        self.assertIsNone(key(17, 65.1, 0, 12, 0.5))
+        self.assertIsNone(key(17, 50, 0, 5, 0.5))
+        build_cube(self.snapshot, self.TEMPS, self.PRECIPS,
+                   ref_date = self.REF_DATE, temp_tolerance = 1,
+                   precip_tolerance = 0.05)
+        key = load_cube(self.snapshot).key
+        self.assertEqual(key(17, 50.9, 0.04, 12, 0.5), (17, 1, 0))
+        self.assertIsNone(key(17, 52, 0, 12, 0.5))
+        self.assertIsNone(key(17, 50, 0.1, 12, 0.5))
@@ -2,5 +2,8 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('', views.plot_route, name = 'plot_route')
+    path('', views.plot_route, name = 'plot_route'),
+    path('sweep', views.sweep, name = 'sweep'),
+    path('alternatives', views.alternatives, name = 'alternatives'),
+    path('metrics', views.metrics, name = 'metrics'),
               ]
\ No newline at end of file
@@ -2,9 +2,12 @@ import csv
 import os
 import datetime
 
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from django import forms
-from dijkstra_path1 import go
+from metrics import REGISTRY
+from worker_pool import route as compute_route, PoolBusy, RouteTimeout
 
 
 class AddressEntry(forms.Form):
@@ -64,11 +67,20 @@ def plot_route(request):
                                                          None)
             args["precipitation"] = form.cleaned_data.get('precipitation',\
                                                            None)
-            route, relative_score = go(args)
-            if type(route) == str:
-                route_info['error'] = route
+            try:
+                result = compute_route(
+                    args, workers = settings.ROUTE_WORKERS,
+                    queue_limit = settings.ROUTE_QUEUE_LIMIT,
+                    queue_wait = settings.ROUTE_QUEUE_WAIT,
+                    timeout = settings.ROUTE_TIMEOUT)
+            except (PoolBusy, RouteTimeout):
+                result = "The server is busy, please try again in a moment."
+            #go() returns an error message instead of a route when it fails
+            if type(result) == str:
+                route_info['error'] = result
                 route_info['relative_score'] = "No score can be computed."
             else:
+                route, relative_score = result
                 route_info['route'] = route
                 route_info['start_address'] = form.cleaned_data['start_address']
                 route_info['end_address'] = form.cleaned_data['end_address']
@@ -77,4 +89,67 @@ def plot_route(request):
                                                 "% of all paths in Chicago."
     route_info['address_form'] = form
 
-    return render(request, 'routemanager/index.html', route_info)
\ No newline at end of file
+    return render(request, 'routemanager/index.html', route_info)
+
+
+def json_route(request, kind, to_json):
+    '''
+    Takes in the same submission as plot_route, computes a job of the given
+    kind (see worker_pool.ROUTE_KINDS) and outputs to_json(result) as JSON,
+    or {"error": (string)} when there is no result
+    '''
+    form = AddressEntry(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Please enter a start and an end '
+                                      'address.'}, status = 400)
+    args = {key: form.cleaned_data.get(key, None) for key in
+            ('start_address', 'end_address', 'date_of_travel',
+             'hour_of_travel', 'temperature', 'precipitation')}
+    try:
+        result = compute_route(
+            args, kind = kind, workers = settings.ROUTE_WORKERS,
+            queue_limit = settings.ROUTE_QUEUE_LIMIT,
+            queue_wait = settings.ROUTE_QUEUE_WAIT,
+            timeout = settings.ROUTE_TIMEOUT)
+    except (PoolBusy, RouteTimeout):
+        return JsonResponse({'error': 'The server is busy, please try '
+                                      'again in a moment.'}, status = 503)
+    if type(result) == str:
+        return JsonResponse({'error': result})
+    return JsonResponse(to_json(result))
+
+
+def sweep(request):
+    '''
+    The safest route's cost and relative score for every hour of departure
+    on the date of travel (see dijkstra_path1.go_sweep):
+    {"hours": [{"hour": (int), "cost": (float), "relative_score": (float)},
+    ...]}, cost and relative_score being null for an hour with no route
+    '''
+    return json_route(request, 'sweep', lambda hours: {'hours': [
+        {'hour': hour, 'cost': cost, 'relative_score': relative_score}
+        for hour, _, relative_score, cost in hours]})
+
+
+def alternatives(request):
+    '''
+    A few different routes, from the safest to the shortest (see
+    dijkstra_path1.go_alternatives):
+    {"routes": [{"route": [[lat, lon], ...], "distance": (float, meters),
+    "safety_cost": (float), "unscored_distance": (float, meters),
+    "relative_score": (float)}, ...]}, the safety cost covering the edges
+    that have a safety score and unscored_distance the length of the others
+    '''
+    return json_route(request, 'alternatives', lambda routes: {'routes': [
+        {'route': route, 'distance': distance, 'safety_cost': cost,
+         'unscored_distance': unscored, 'relative_score': relative_score}
+        for route, relative_score, distance, cost, unscored in routes]})
+
+
+def metrics(request):
+    '''
+    Latency histograms and counters of the route requests served by this
+    process, in the Prometheus text format
+    '''
+    return HttpResponse(REGISTRY.render(),
+                        content_type = 'text/plain; version=0.0.4')
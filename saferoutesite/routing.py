@@ -0,0 +1,284 @@
+'''
+Shortest-path search for the safest route.
+
+A single bidirectional A* search over the arrays of a CSRGraph returns both
+the path and its cost. Edge weights are score * length with every score
+>= 1, so the great circle distance between two nodes never overestimates the
+weighted distance and is used as the heuristic. For batches of routes
+sharing an origin, one_to_many runs one Dijkstra search to all of their
+destinations. alternative_paths repeats the search under other weights, and
+with the edges of the paths already found made more expensive, to offer a
+few different routes.
+'''
+
+import heapq
+import itertools
+import math
+import time
+
+import numpy as np
+
+#Same radius as dijkstra_path1.haversine; slightly below the radius osmnx
+#uses for edge lengths, which keeps the heuristic a lower bound
+EARTH_RADIUS_M = 6367000
+#alternative_paths: factor applied to the weights of edges already used and
+#largest share of a path's length allowed on edges of paths already kept
+PENALTY = 1.5
+MAX_SHARED = 0.8
+
+
+class NoPath(Exception):
+    '''
+    Raised when the destination cannot be reached from the start
+    '''
+
+
+def great_circle(lat1, lon1, lat2, lon2):
+    '''
+    Calculate the circle distance in meters between points given in decimal
+    degrees. Works element-wise on numpy arrays.
+    '''
+
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    return 2 * np.arcsin(np.minimum(1, np.sqrt(a))) * EARTH_RADIUS_M
+
+
+def potentials(graph, source, target):
+    '''
+    Average A* potential of every node of a CSRGraph,
+        p(v) = (h(v, target) - h(source, v)) / 2
+    with h the great circle distance, computed in one vectorized pass
+    '''
+
+    lat = graph.lat
+    lon = graph.lon
+    to_target = great_circle(lat, lon, lat[target], lon[target])
+    from_source = great_circle(lat, lon, lat[source], lon[source])
+    return (to_target - from_source) / 2
+
+
+def bidirectional_astar(graph, source, target, weights, potential = None,
+                        stats = None):
+    '''
+    Find the cheapest path between two nodes of a CSRGraph with one
+    bidirectional A* search over its adjacency arrays.
+
+    Both searches use the same average potential, which keeps reduced edge
+    costs non-negative in both directions, so the search can stop as soon as
+    the two smallest queue keys add up to the best path found so far.
+
+    Inputs:
+        graph (CSRGraph): the graph
+        source, target (ints): node numbers of the ends of the route
+        weights (array): the cost of every edge, indexed by edge id
+        potential (array): optional per-node potential; defaults to the
+            great circle one from potentials()
+        stats (dictionary): if given, filled with the number of settled
+            nodes
+    Outputs:
+        (tuple) the path as a list of node numbers and its cost
+    '''
+
+    if source == target:
+        return [source], 0
+
+    if potential is None:
+        potential = potentials(graph, source, target)
+    potential = potential.tolist()
+    weights = weights.tolist() if hasattr(weights, 'tolist') else weights
+    offsets, targets, edge_ids = graph.adjacency()
+
+    counter = itertools.count()
+    #index 0 searches forward from source, index 1 backward from target
+    sign = (1, -1)
+    dists = ({source: 0}, {target: 0})
+    preds = ({source: None}, {target: None})
+    settled = (set(), set())
+    heaps = ([(potential[source], next(counter), source)],
+             [(-potential[target], next(counter), target)])
+    best = math.inf
+    meet = None
+
+    while heaps[0] and heaps[1]:
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+        d = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        _, _, v = heapq.heappop(heaps[d])
+        if v in settled[d]:
+            continue
+        settled[d].add(v)
+        dist = dists[d]
+        other = dists[1 - d]
+        dist_v = dist[v]
+        for k in range(offsets[v], offsets[v + 1]):
+            w = targets[k]
+            new_dist = dist_v + weights[edge_ids[k]]
+            if w in dist and new_dist >= dist[w]:
+                continue
+            dist[w] = new_dist
+            preds[d][w] = v
+            heapq.heappush(heaps[d], (new_dist + sign[d] * potential[w],
+                                      next(counter), w))
+            if w in other and new_dist + other[w] < best:
+                best = new_dist + other[w]
+                meet = w
+
+    if stats is not None:
+        stats['settled'] = len(settled[0]) + len(settled[1])
+    if meet is None:
+        raise NoPath('Node {} not reachable from {}'.format(target, source))
+
+    path = []
+    node = meet
+    while node is not None:
+        path.append(node)
+        node = preds[0][node]
+    path.reverse()
+    node = preds[1][meet]
+    while node is not None:
+        path.append(node)
+        node = preds[1][node]
+    return path, best
+
+
+def one_to_many(graph, source, targets, weights, stats = None):
+    '''
+    Find the cheapest paths from one node of a CSRGraph to several others
+    with a single Dijkstra search, which stops once every target is settled.
+
+    Inputs:
+        graph (CSRGraph): the graph
+        source (int): node number the paths start from
+        targets (iterable of ints): node numbers the paths end at
+        weights (array): the cost of every edge, indexed by edge id
+        stats (dictionary): if given, filled with the number of settled
+            nodes
+    Outputs:
+        generator of (target, path, cost) tuples, yielded as soon as each
+        target is settled; a target that cannot be reached comes last with
+        a path of None and an infinite cost
+    '''
+
+    weights = weights.tolist() if hasattr(weights, 'tolist') else weights
+    offsets, targets_arr, edge_ids = graph.adjacency()
+    remaining = set(targets)
+
+    dist = {source: 0}
+    preds = {source: None}
+    settled = set()
+    heap = [(0, source)]
+    while heap and remaining:
+        dist_v, v = heapq.heappop(heap)
+        if v in settled:
+            continue
+        settled.add(v)
+        if v in remaining:
+            remaining.discard(v)
+            path = []
+            node = v
+            while node is not None:
+                path.append(node)
+                node = preds[node]
+            path.reverse()
+            yield v, path, dist_v
+        for k in range(offsets[v], offsets[v + 1]):
+            w = targets_arr[k]
+            new_dist = dist_v + weights[edge_ids[k]]
+            if w in dist and new_dist >= dist[w]:
+                continue
+            dist[w] = new_dist
+            preds[w] = v
+            heapq.heappush(heap, (new_dist, w))
+
+    if stats is not None:
+        stats['settled'] = len(settled)
+    for target in remaining:
+        yield target, None, math.inf
+
+
+def path_edges(graph, path, weights):
+    '''
+    Edge ids along a path of node numbers, taking the cheapest of parallel
+    edges as the search does
+    '''
+
+    weights = np.asarray(weights)
+    edges = []
+    for a, b in zip(path[:-1], path[1:]):
+        k = slice(graph.offsets[a], graph.offsets[a + 1])
+        candidates = graph.edge_ids[k][graph.targets[k] == b]
+        edges.append(candidates[np.argmin(weights[candidates])])
+    return np.array(edges, dtype = np.int64)
+
+
+def alternative_paths(graph, source, target, weight_sets, count,
+                      potential = None, penalty = PENALTY,
+                      max_shared = MAX_SHARED, deadline = None):
+    '''
+    Find up to count different cheap paths between two nodes of a CSRGraph.
+    The cheapest path under each array of weight_sets is tried first, in
+    order; while fewer than count paths have been kept, the weights of the
+    first array are multiplied by penalty on every edge of each path found
+    and the search is repeated. A path is kept only when at most
+    max_shared of its length lies on edges of paths kept before it.
+
+    Inputs:
+        graph (CSRGraph): the graph
+        source, target (ints): node numbers of the ends of the route
+        weight_sets (list of arrays): edge weights to try, every one at
+            least the edge lengths; the first is also the one penalized
+        count (int): most paths returned
+        potential: optional function of an array of weights returning the
+            node potential for bidirectional_astar
+        penalty (float): factor applied to the weights of used edges
+        max_shared (float): largest share of a kept path's length on edges
+            of other kept paths
+        deadline (float): time.perf_counter() value after which no new
+            search starts; the first search always runs
+    Outputs:
+        (list of tuples) each kept path as a list of node numbers and an
+        array of its edge ids, in the order found; raises NoPath when the
+        target cannot be reached
+    '''
+
+    def search(weights, node_potential):
+        path, _ = bidirectional_astar(graph, source, target, weights,
+                                      node_potential)
+        return path, path_edges(graph, path, weights)
+
+    def keep(path, edges):
+        if any(len(path) == len(other) and path == other
+               for other, _ in kept):
+            return
+        total = graph.length[edges].sum()
+        shared = graph.length[edges[used[edges]]].sum()
+        if kept and shared > max_shared * total:
+            return
+        kept.append((path, edges))
+        used[edges] = True
+
+    def out_of_time():
+        return deadline is not None and time.perf_counter() > deadline
+
+    kept = []
+    used = np.zeros(graph.num_edges, dtype = bool)
+    for weights in weight_sets:
+        if len(kept) >= count or (kept and out_of_time()):
+            break
+        keep(*search(weights, None if potential is None else
+                     potential(weights)))
+
+    #raising weights keeps the potential of the first array valid
+    penalized = np.array(weight_sets[0], dtype = np.float64)
+    base_potential = None if potential is None else potential(penalized)
+    penalized[used] *= penalty
+    for _ in range(2 * count):
+        if len(kept) >= count or out_of_time():
+            break
+        path, edges = search(penalized, base_potential)
+        keep(path, edges)
+        penalized[edges] *= penalty
+    return kept
@@ -83,6 +83,72 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# 'routes' is shared by every worker process serving the site (see
+# route_cache.py); point it at memcached or redis when running on several
+# machines.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'routes': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'route_cache'),
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+
+# Routing workers (see worker_pool.py)
+# Routes are computed in ROUTE_WORKERS forked processes (0 computes them in
+# the request thread). At most ROUTE_QUEUE_LIMIT more routes wait for a
+# worker; a request that finds the queue full for ROUTE_QUEUE_WAIT seconds,
+# or whose route takes longer than ROUTE_TIMEOUT seconds, gets an error page.
+
+ROUTE_WORKERS = os.cpu_count() or 1
+ROUTE_QUEUE_LIMIT = 64
+ROUTE_QUEUE_WAIT = 1
+ROUTE_TIMEOUT = 120
+
+# Import the routing code and load the graph, indexes and crime data when
+# the WSGI application starts rather than on the first request, then fork
+# the routing workers (see saferoutesite/wsgi.py); "python3 manage.py warmup"
+# runs the same loading steps and prints their timings.
+
+ROUTE_WARMUP = True
+
+# Once "python3 graph_tiles.py build" has cut the graph snapshot into tiles,
+# each process keeps at most GRAPH_TILE_MEMORY bytes of them in memory and
+# reads the others from disk when a route needs them.
+
+GRAPH_TILE_MEMORY = 256 * 2**20
+
+
+# Metrics
+# Stage timings of every route request are served at /routemanager/metrics
+# (see metrics.py). A METRICS_TRACE_SAMPLE share of requests, and every
+# request slower than METRICS_SLOW_TRACE seconds, is logged in full on the
+# 'saferoute.trace' logger.
+
+METRICS_TRACE_SAMPLE = 0.01
+METRICS_SLOW_TRACE = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'saferoute.trace': {'handlers': ['console'], 'level': 'INFO'},
+        'saferoute.warmup': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
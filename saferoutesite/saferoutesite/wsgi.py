@@ -7,10 +7,33 @@ For more information on this file, see
 https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'saferoutesite.settings')
 
 application = get_wsgi_application()
+
+#graph tiles kept in memory by each process (see graph_tiles)
+from graph_tiles import configure as configure_tiles
+
+configure_tiles(settings.GRAPH_TILE_MEMORY)
+
+#load the routing data before the first request rather than during it
+if settings.ROUTE_WARMUP:
+    from worker_pool import get_pool, warm
+
+    steps = warm()
+    logging.getLogger('saferoute.warmup').info(
+        'warmed up in %.2f s (%s)', sum(seconds for _, seconds in steps),
+        ', '.join('{} {:.2f} s'.format(name, seconds)
+                  for name, seconds in steps))
+    #fork the routing workers now, while the process has no request threads
+    #and the warmed data is fresh in memory
+    pool = get_pool(settings.ROUTE_WORKERS, settings.ROUTE_QUEUE_LIMIT,
+                    settings.ROUTE_QUEUE_WAIT, settings.ROUTE_TIMEOUT)
+    if pool is not None:
+        pool.start()
@@ -0,0 +1,345 @@
+'''
+Materialized safety scores for common travel conditions.
+
+An offline job fits the per-block regression of SQLRequest3 for every named
+edge of the citywide snapshot under discretized conditions: hour of travel
+(with the same +-2 hour window as go()), a temperature bucket and a
+precipitation bucket. For each key it stores the projected score at a
+reference date and its slope per second, so the score for any projection
+date is a single multiply-add over an array slice. The arrays are written
+next to the graph snapshot they were built from and memory-mapped when
+serving.
+
+A request is served the bucket whose centre is nearest to its conditions
+when that centre is within the bucket tolerance, which defaults to half the
+bucket step: the buckets then cover their whole range, and the scores of a
+temperature or precipitation between two centres are approximated by those
+fitted at the nearest centre (the similar-weather days of the centre, not
+of the request). A smaller tolerance (--temp-tolerance, --precip-tolerance)
+serves only conditions close to a centre. Conditions outside the buckets
+fall back to live regression, as does everything once an ingest has marked
+the cube stale, until it is built again.
+
+Usage:
+    python score_cube.py build [--temps -10:100:10] [--precips 0:1:0.5]
+        [--temp-tolerance DEGREES] [--precip-tolerance INCHES]
+'''
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime as dt
+from time import mktime
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from graph_snapshot import get_snapshot, CHICAGO_BBOX
+from SQLRequest3 import (DataConstructor, Weather_Days, Regression_Params,
+                         block_score_matrix, edge_to_latlon, SAFETY_DICT)
+
+CUBE_DIR = 'score_cube'
+CUBE_FORMAT = 1
+HOURS = 24
+#edges fitted together; bounds the size of the blocks x days matrix
+CHUNK_SIZE = 20000
+
+_CUBES = {}
+
+
+class ScoreCube:
+    '''
+    Read-only view of a materialized score cube.
+
+    ref and slope have shape (hours, temperature buckets, precipitation
+    buckets, columns); columns maps a snapshot edge id to its column (-1 for
+    unnamed edges, which are never scored).
+    '''
+
+    def __init__(self, path, manifest, ref, slope, columns):
+        self.path = path
+        self.manifest = manifest
+        self.temps = np.array(manifest['temps'])
+        self.precips = np.array(manifest['precips'])
+        self.ref_secs = mktime(dt.strptime(manifest['ref_date'],
+                                           '%Y-%m-%d').timetuple())
+        self.ref = ref
+        self.slope = slope
+        self.columns = columns
+
+    def bucket(self, value, centers, tolerance):
+        '''
+        Position of the bucket whose center is within tolerance of value,
+        or None
+        '''
+
+        position = int(np.argmin(np.abs(centers - value)))
+        if abs(centers[position] - value) > tolerance + 1e-9:
+            return None
+        return position
+
+    def key(self, hour, temp, precip, t_sens, p_sens):
+        '''
+        The (hour, temperature bucket, precipitation bucket) position of some
+        travel conditions, or None when the cube does not cover them
+        '''
+
+        manifest = self.manifest
+        if t_sens != manifest['t_sens'] or p_sens != manifest['p_sens']:
+            return None
+        if hour is None or not 0 <= hour < HOURS or hour != int(hour):
+            return None
+        t = self.bucket(temp, self.temps, manifest['temp_tolerance'])
+        p = self.bucket(precip, self.precips, manifest['precip_tolerance'])
+        if t is None or p is None:
+            return None
+        return int(hour), t, p
+
+    def scores(self, eids, hour, temp, precip, date, t_sens, p_sens):
+        '''
+        Looks up the safety score of some snapshot edges
+        Inputs:
+            eids: (array of ints) snapshot edge ids of named edges
+            hour: (int) hour of travel
+            temp, precip: (floats) travel conditions
+            date: date as a string (yyyy-mm-dd format)
+            t_sens, p_sens: the sensitivities the request uses
+        Outputs:
+            (numpy array of ints) scores aligned with eids, or None when the
+            conditions are not covered by the cube
+        '''
+
+        key = self.key(hour, temp, precip, t_sens, p_sens)
+        columns = self.columns[eids]
+        if key is None or (columns < 0).any():
+            return None
+        t, p = key[1:]
+        secs = mktime(dt.strptime(date, '%Y-%m-%d').timetuple())
+        projection = self.ref[int(hour), t, p, columns].astype(np.float64) + \
+            self.slope[int(hour), t, p, columns] * (secs - self.ref_secs)
+        return np.maximum(projection, 1).astype(np.int64)
+
+
+def cube_path(snapshot):
+    '''
+    Directory of the cube belonging to a snapshot
+    '''
+
+    return os.path.join(snapshot.path, CUBE_DIR)
+
+
+def buckets(spec):
+    '''
+    Parses a 'start:stop:step' bucket specification (stop included)
+    '''
+
+    start, stop, step = [float(x) for x in spec.split(':')]
+    return np.arange(start, stop + step / 2, step)
+
+
+def half_step(centers):
+    '''
+    Half the smallest step between bucket centers, 0 for a single center
+    '''
+
+    if len(centers) < 2:
+        return 0.0
+    return float(np.min(np.diff(centers))) / 2
+
+
+def build_cube(snapshot, temps, precips, t_sens = 12, p_sens = 0.5,
+               ref_date = None, db = 'Crime.db', chunk_size = CHUNK_SIZE,
+               temp_tolerance = None, precip_tolerance = None):
+    '''
+    Fits and stores the scores of every named snapshot edge for every hour,
+    temperature bucket and precipitation bucket
+    Inputs:
+        snapshot: GraphSnapshot the cube is built for
+        temps, precips: (arrays of floats) evenly spaced bucket centers
+        t_sens, p_sens: sensitivities used for the similar-weather days, as
+            in go()
+        ref_date: (string) yyyy-mm-dd reference date, defaults to today
+        db: (string) path to the crime database
+        chunk_size: (int) number of edges fitted at once
+        temp_tolerance, precip_tolerance: (floats) largest distance from a
+            bucket center at which it is served, defaults to half the step
+            between centers (0 for a single center)
+    Outputs:
+        (string) path of the written cube
+    '''
+
+    if not ref_date:
+        ref_date = datetime.date.today().strftime('%Y-%m-%d')
+    ref_secs = mktime(dt.strptime(ref_date, '%Y-%m-%d').timetuple())
+    lat = np.asarray(snapshot.lat)
+    lon = np.asarray(snapshot.lon)
+    u = np.asarray(snapshot.u)
+    v = np.asarray(snapshot.v)
+    named = np.nonzero(np.asarray(snapshot.name) >= 0)[0]
+    #sort by latitude so each chunk covers a compact band of the city
+    named = named[np.argsort((lat[u[named]] + lat[v[named]]) / 2,
+                             kind = 'stable')]
+    columns = np.full(snapshot.num_edges, -1, dtype = np.int32)
+    columns[named] = np.arange(len(named))
+
+    path = cube_path(snapshot)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    shape = (HOURS, len(temps), len(precips), len(named))
+    ref = open_memmap(os.path.join(tmp_path, 'ref.npy'), mode = 'w+',
+                      dtype = np.float32, shape = shape)
+    slope = open_memmap(os.path.join(tmp_path, 'slope.npy'), mode = 'w+',
+                        dtype = np.float32, shape = shape)
+    np.save(os.path.join(tmp_path, 'columns.npy'), columns)
+
+    n_lat, s_lat, e_lon, w_lon = CHICAGO_BBOX
+    c = sqlite3.connect(db)
+    for t, temp in enumerate(temps):
+        for p, precip in enumerate(precips):
+            weather = Weather_Days(c, temp, precip, t_sens, p_sens)
+            #every hour window of the day comes out of one pull
+            crimes = DataConstructor(c, temp, precip, t_sens, p_sens, 0,
+                                     HOURS - 1, (s_lat, n_lat),
+                                     (w_lon, e_lon))
+            crimes['Primary_Type'] = crimes['Primary_Type'].map(SAFETY_DICT)
+            for start in range(0, len(named), chunk_size):
+                eids = named[start:start + chunk_size]
+                pairs = list(zip(zip(lat[u[eids]], lon[u[eids]]),
+                                 zip(lat[v[eids]], lon[v[eids]])))
+                blocks = list(edge_to_latlon(pairs).keys())
+                local = crimes[
+                    (crimes.Latitude >= min(b[0][0] for b in blocks)) &
+                    (crimes.Latitude <= max(b[0][1] for b in blocks))]
+                for hour in range(HOURS):
+                    window = local[(local.Hour >= hour - 2) &
+                                   (local.Hour <= hour + 2)]
+                    scores = block_score_matrix(blocks, window, weather.index)
+                    params = Regression_Params(weather, scores)
+                    cells = (hour, t, p, slice(start, start + len(eids)))
+                    if params is None:
+                        ref[cells] = 1
+                        slope[cells] = 0
+                    else:
+                        ref[cells] = 10**6 * params[0] + params[1] * ref_secs
+                        slope[cells] = params[1]
+    c.close()
+    ref.flush()
+    slope.flush()
+
+    manifest = {'format': CUBE_FORMAT,
+                'snapshot': snapshot.extract_date,
+                'built': datetime.datetime.now().isoformat(timespec='seconds'),
+                'ref_date': ref_date,
+                'temps': [float(x) for x in temps],
+                'precips': [float(x) for x in precips],
+                'temp_tolerance': half_step(temps)
+                                  if temp_tolerance is None else
+                                  float(temp_tolerance),
+                'precip_tolerance': half_step(precips)
+                                    if precip_tolerance is None else
+                                    float(precip_tolerance),
+                't_sens': t_sens,
+                'p_sens': p_sens,
+                'edges': int(len(named))}
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_cube(snapshot):
+    '''
+    Memory-maps the cube of a snapshot
+    Inputs:
+        snapshot: GraphSnapshot
+    Outputs:
+        ScoreCube, or None when no cube was built for the snapshot
+    '''
+
+    path = cube_path(snapshot)
+    if not os.path.exists(os.path.join(path, 'manifest.json')):
+        return None
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['format'] != CUBE_FORMAT or manifest.get('stale'):
+        return None
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r')
+              for name in ('ref', 'slope', 'columns')]
+    return ScoreCube(path, manifest, *arrays)
+
+
+def invalidate_cube(snapshot):
+    '''
+    Marks the cube of a snapshot stale, so it is no longer served, once the
+    crime data it was fitted on has changed
+    Outputs:
+        (bool) whether the snapshot had a cube
+    '''
+
+    path = os.path.join(cube_path(snapshot), 'manifest.json')
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest['stale'] = True
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def cube_version(snapshot):
+    '''
+    Version of the cube of a snapshot: the modification time of its
+    manifest, which every build writes anew, or None when no cube was built
+    '''
+
+    try:
+        return os.stat(os.path.join(cube_path(snapshot),
+                                    'manifest.json')).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_cube(snapshot):
+    '''
+    Returns the cube of a snapshot (or None), loading it on first use and
+    again whenever it has been rebuilt
+    '''
+
+    version = cube_version(snapshot)
+    if version is None:
+        return None
+    if snapshot.path not in _CUBES or _CUBES[snapshot.path][0] != version:
+        _CUBES[snapshot.path] = (version, load_cube(snapshot))
+    return _CUBES[snapshot.path][1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Precompute edge safety scores for common conditions')
+    parser.add_argument('command', choices = ['build'])
+    parser.add_argument('--temps', default = '-10:100:10',
+                        help = 'temperature bucket centers start:stop:step')
+    parser.add_argument('--precips', default = '0:1:0.5',
+                        help = 'precipitation bucket centers start:stop:step')
+    parser.add_argument('--temp-tolerance', type = float,
+                        help = 'degrees from a center served by its bucket '
+                               '(default half the step)')
+    parser.add_argument('--precip-tolerance', type = float,
+                        help = 'inches from a center served by its bucket '
+                               '(default half the step)')
+    parser.add_argument('--ref-date', help = 'reference date (yyyy-mm-dd)')
+    parser.add_argument('--db', default = 'Crime.db')
+    args = parser.parse_args()
+    print(build_cube(get_snapshot(), buckets(args.temps),
+                     buckets(args.precips), ref_date = args.ref_date,
+                     db = args.db, temp_tolerance = args.temp_tolerance,
+                     precip_tolerance = args.precip_tolerance))
@@ -0,0 +1,194 @@
+'''
+Pre-aggregated daily crime severity of the edges of the graph snapshot.
+
+The regression of SQLRequest3 only needs, for every block (edge) and day,
+the sum of the safety scores of the crimes on it. Instead of reading every
+crime in the bounding box and matching crimes to blocks at request time,
+Crime.db keeps:
+
+  EdgeBlockSeverity: crimes and summed safety scores per snapshot edge,
+      block name, day and hour, for every crime inside the edge's box
+  SeverityMeta: the snapshot the edges belong to and the last CrimeData1
+      rowid added
+
+A request then reads at most one row per edge, block name, day and hour of
+its window and picks the block name of each edge among them as before (see
+SQLRequest3.Severity_Matrix), so the reads grow with the number of block
+days instead of the number of crimes, and no crime is matched to a block at
+request time.
+
+refresh_severity adds the CrimeData1 rows it has not seen yet, so the same
+call builds the tables or brings them up to date after an ingest; they are
+rebuilt from scratch when the snapshot changes.
+
+Usage:
+    python severity.py build [--db Crime.db] [--rebuild]
+'''
+
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from graph_snapshot import get_snapshot
+from SQLRequest3 import SAFETY_DICT, assign_crimes, edge_to_latlon
+
+CHUNK_SIZE = 200000
+
+_BLOCKS = {}
+_READY = {}
+
+
+def create_tables(c):
+    '''
+    Creates the tables if needed
+    '''
+
+    c.execute('CREATE TABLE IF NOT EXISTS EdgeBlockSeverity (Edge INTEGER, '
+              'Block TEXT, Day TEXT, Hour INTEGER, Crimes INTEGER, '
+              'Severity INTEGER, PRIMARY KEY (Edge, Block, Day, Hour)) '
+              'WITHOUT ROWID')
+    c.execute('CREATE TABLE IF NOT EXISTS SeverityMeta (Key TEXT PRIMARY '
+              'KEY, Value TEXT)')
+
+
+def read_meta(c):
+    '''
+    Returns the SeverityMeta table as a dictionary (empty when there is none)
+    '''
+
+    if c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND "
+                 "name = 'SeverityMeta'").fetchone() is None:
+        return {}
+    return dict(c.execute('SELECT Key, Value FROM SeverityMeta'))
+
+
+def severity_ready(snapshot, db = 'Crime.db'):
+    '''
+    Checks whether a crime database has the tables, built for the edges of
+    a snapshot. The answer is kept until the database is modified, as every
+    request asks
+    Inputs:
+        snapshot: GraphSnapshot
+        db: (string) path to the crime database
+    '''
+
+    try:
+        version = os.stat(db).st_mtime_ns
+    except OSError:
+        return False
+    key = (os.path.abspath(db), snapshot.path)
+    if key not in _READY or _READY[key][0] != version:
+        c = sqlite3.connect(db)
+        try:
+            ready = read_meta(c).get('snapshot') == snapshot.extract_date
+        finally:
+            c.close()
+        _READY[key] = (version, ready)
+    return _READY[key][1]
+
+
+def snapshot_blocks(snapshot):
+    '''
+    Boxes (as in SQLRequest3.edge_to_latlon) and edge ids of the named edges
+    of a snapshot, computed once per snapshot
+    '''
+
+    if snapshot.path not in _BLOCKS:
+        lat = np.asarray(snapshot.lat)
+        lon = np.asarray(snapshot.lon)
+        u = np.asarray(snapshot.u)
+        v = np.asarray(snapshot.v)
+        eids = np.nonzero(np.asarray(snapshot.name) >= 0)[0]
+        pairs = list(zip(zip(lat[u[eids]], lon[u[eids]]),
+                         zip(lat[v[eids]], lon[v[eids]])))
+        _BLOCKS[snapshot.path] = (list(edge_to_latlon(pairs).keys()), eids)
+    return _BLOCKS[snapshot.path]
+
+
+def add_crimes(c, blocks, eids, crimes):
+    '''
+    Adds crimes to EdgeBlockSeverity, once for every edge whose box they lie
+    in
+    Inputs:
+        c: SQL connection
+        blocks, eids: from snapshot_blocks
+        crimes: (pd dataframe) CrimeData1 rows with Day, Hour, Primary_Type,
+            Block, Latitude and Longitude columns
+    '''
+
+    rows, positions = assign_crimes(blocks, crimes.Latitude.values,
+                                    crimes.Longitude.values)
+    if len(rows) == 0:
+        return
+    severity = crimes.Primary_Type.map(SAFETY_DICT).fillna(0).values
+    added = pd.DataFrame({'Edge': eids[positions],
+                          'Block': crimes.Block.values[rows],
+                          'Day': crimes.Day.values[rows],
+                          'Hour': crimes.Hour.values[rows],
+                          'Crimes': 1,
+                          'Severity': severity[rows]}).groupby(
+        ['Edge', 'Block', 'Day', 'Hour'], as_index = False).sum()
+    c.executemany('INSERT INTO EdgeBlockSeverity VALUES (?, ?, ?, ?, ?, ?) '
+                  'ON CONFLICT(Edge, Block, Day, Hour) DO UPDATE SET '
+                  'Crimes = Crimes + excluded.Crimes, '
+                  'Severity = Severity + excluded.Severity',
+                  [(int(edge), block, day, int(hour), int(n), int(s))
+                   for edge, block, day, hour, n, s in added.itertuples(
+                       index = False)])
+
+
+def refresh_severity(c, snapshot, rebuild = False, chunk_size = CHUNK_SIZE):
+    '''
+    Adds to the tables every CrimeData1 row they do not cover yet
+    Inputs:
+        c: SQL connection
+        snapshot: GraphSnapshot whose edges the crimes are matched to
+        rebuild: (bool) drop the tables and rebuild them from scratch, as
+            happens anyway when they were built for another snapshot
+        chunk_size: (int) crimes read at once
+    Outputs:
+        (int) number of crimes added
+    '''
+
+    meta = read_meta(c)
+    if rebuild or meta.get('snapshot') != snapshot.extract_date:
+        for table in ('EdgeBlockSeverity', 'SeverityMeta'):
+            c.execute('DROP TABLE IF EXISTS ' + table)
+        meta = {}
+    create_tables(c)
+    last = int(meta.get('last_rowid', -1))
+    blocks, eids = snapshot_blocks(snapshot)
+
+    added = 0
+    for crimes in pd.read_sql(
+            'SELECT rowid AS Id, Day, Hour, Primary_Type, Block, Latitude, '
+            'Longitude FROM CrimeData1 WHERE rowid > ? AND Latitude IS NOT '
+            'NULL AND Longitude IS NOT NULL', c, params = (last,),
+            chunksize = chunk_size):
+        #with no new rows, pandas still yields one empty chunk
+        if crimes.empty:
+            continue
+        add_crimes(c, blocks, eids, crimes)
+        last = max(last, int(crimes.Id.max()))
+        added += len(crimes)
+    c.executemany('INSERT OR REPLACE INTO SeverityMeta VALUES (?, ?)',
+                  [('snapshot', snapshot.extract_date),
+                   ('last_rowid', str(last))])
+    c.commit()
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Build or update the per-edge daily crime severity')
+    parser.add_argument('command', choices = ['build'])
+    parser.add_argument('--db', default = 'Crime.db')
+    parser.add_argument('--rebuild', action = 'store_true')
+    args = parser.parse_args()
+    c = sqlite3.connect(args.db)
+    print('{} crimes added'.format(refresh_severity(c, get_snapshot(),
+                                                    args.rebuild)))
+    c.close()
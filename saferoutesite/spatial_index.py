@@ -0,0 +1,126 @@
+'''
+Nearest-node and nearest-edge snapping for route endpoints.
+
+Node coordinates are projected to a local equirectangular plane in meters
+and stored in a KD-tree, so snapping is a true nearest-by-distance lookup in
+O(log n) instead of a scan over every node in the graph.
+'''
+
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+#Meters per degree of latitude on a sphere of radius 6367 km (as haversine)
+METERS_PER_DEGREE = 6367000 * math.pi / 180
+
+
+class NodeIndex:
+    '''
+    KD-tree over the nodes (and optionally the edges) of a graph.
+
+    Inputs:
+        nodes: sequence of node keys
+        lat, lon: arrays of node coordinates aligned with nodes
+        edges: optional sequence of edges (node key pairs, extra items such
+            as multigraph keys are kept) used for nearest-edge snapping
+    '''
+
+    def __init__(self, nodes, lat, lon, edges = None):
+        self.nodes = list(nodes)
+        lat = np.asarray(lat, dtype = np.float64)
+        lon = np.asarray(lon, dtype = np.float64)
+        self.ref_lat = float(lat.mean()) if len(lat) else 0.0
+        self.points = self.project(np.column_stack((lat, lon)))
+        self.tree = cKDTree(self.points)
+        self.edges = None
+        if edges is not None:
+            self._build_edge_index(edges)
+
+    def project(self, coords):
+        '''
+        Projects an (n, 2) array of (lat, lon) pairs to meters
+        '''
+
+        coords = np.atleast_2d(np.asarray(coords, dtype = np.float64))
+        scale = math.cos(math.radians(self.ref_lat))
+        return np.column_stack((coords[:, 0] * METERS_PER_DEGREE,
+                                coords[:, 1] * METERS_PER_DEGREE * scale))
+
+    def nearest(self, coord):
+        '''
+        Finds the node closest to a (lat, lon) pair
+        Inputs:
+            coord: (tuple of floats) the point to snap
+        Outputs:
+            the node key
+        '''
+
+        return self.nearest_many([coord])[0]
+
+    def nearest_many(self, coords, return_distance = False):
+        '''
+        Snaps many (lat, lon) pairs in one vectorized query
+        Inputs:
+            coords: sequence of (lat, lon) pairs
+            return_distance: (bool) also return the snapping distances
+        Outputs:
+            list of node keys (and an array of distances in meters)
+        '''
+
+        distances, positions = self.tree.query(self.project(coords))
+        nodes = [self.nodes[i] for i in positions]
+        if return_distance:
+            return nodes, distances
+        return nodes
+
+    def _build_edge_index(self, edges):
+        '''
+        Indexes edge midpoints so the nearest segment can be found by
+        checking only edges whose midpoint is close enough to the query
+        '''
+
+        position = {node: i for i, node in enumerate(self.nodes)}
+        self.edges = list(edges)
+        ends = np.array([(position[edge[0]], position[edge[1]])
+                         for edge in self.edges], dtype = np.int64)
+        ends = ends.reshape(-1, 2)
+        self.edge_a = self.points[ends[:, 0]]
+        self.edge_b = self.points[ends[:, 1]]
+        midpoints = (self.edge_a + self.edge_b) / 2
+        self.edge_reach = float(np.max(np.linalg.norm(
+            self.edge_b - self.edge_a, axis = 1)) / 2) if len(ends) else 0.0
+        self.edge_tree = cKDTree(midpoints)
+
+    def nearest_edge(self, coord, return_distance = False):
+        '''
+        Finds the edge whose straight segment is closest to a (lat, lon) pair
+        Inputs:
+            coord: (tuple of floats) the point to snap
+            return_distance: (bool) also return the distance in meters
+        Outputs:
+            the edge as given to the index (and the distance)
+        '''
+
+        if self.edges is None:
+            raise ValueError('NodeIndex was built without edges')
+        point = self.project([coord])[0]
+        closest, _ = self.edge_tree.query(point)
+        #any segment closer than the nearest midpoint has its own midpoint
+        #within that distance plus half of the longest segment
+        candidates = np.array(self.edge_tree.query_ball_point(
+            point, closest + self.edge_reach), dtype = np.int64)
+        a = self.edge_a[candidates]
+        b = self.edge_b[candidates]
+        ab = b - a
+        denom = np.einsum('ij,ij->i', ab, ab)
+        t = np.where(denom > 0, np.einsum('ij,ij->i', point - a, ab) /
+                     np.where(denom > 0, denom, 1), 0)
+        t = np.clip(t, 0, 1)
+        distances = np.linalg.norm(a + t[:, None] * ab - point, axis = 1)
+        best = int(np.argmin(distances))
+        edge = self.edges[candidates[best]]
+        if return_distance:
+            return edge, float(distances[best])
+        return edge
+
@@ -0,0 +1,288 @@
+'''
+Pool of long-lived routing worker processes.
+
+The web process imports the routing code and loads the graph snapshot, its
+node index (unless it has tiles) and landmarks, the score cube and the crime
+store once (warm) and then forks the workers, so they start with all of it
+in memory. The snapshot, cube and store are read-only memory-maps, so every
+worker reads the same pages of the OS page cache; the rest is shared
+copy-on-write.
+Graph tiles (see graph_tiles), when built, are read by each worker as its
+routes need them.
+
+Importing this module is cheap: the routing code and its dependencies are
+only imported by warm() or the first route, so the web process can call
+warm() before it accepts traffic (see ROUTE_WARMUP in settings.py) instead
+of paying for it on the first request. Route jobs reach the workers over
+the executor's local queue.
+
+Back-pressure: at most workers + queue_limit jobs are accepted at once; a
+request that cannot get a slot within queue_wait seconds fails with
+PoolBusy instead of piling up. A request whose route takes longer than
+timeout seconds fails with RouteTimeout (the worker finishes the job, which
+then still fills the route cache). When a worker dies (e.g. killed by the
+OS), the pool is replaced by a freshly forked one and the request is tried
+once more there.
+
+Each job runs go() (or go_sweep() or go_alternatives(), see ROUTE_KINDS)
+inside a metrics trace that is sent back with the result and published by
+the web process (see metrics).
+'''
+
+import concurrent.futures
+import importlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from metrics import count_request, publish, trace
+
+ROUTE_WORKERS = os.cpu_count() or 1
+ROUTE_QUEUE_LIMIT = 64
+ROUTE_QUEUE_WAIT = 1
+ROUTE_TIMEOUT = 120
+#function of dijkstra_path1 computing each kind of job
+ROUTE_KINDS = {'route': 'go', 'sweep': 'go_sweep',
+               'alternatives': 'go_alternatives'}
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+class PoolBusy(Exception):
+    '''
+    Raised when every worker is busy and the queue is full
+    '''
+
+
+class RouteTimeout(Exception):
+    '''
+    Raised when a route is not computed within the pool's timeout
+    '''
+
+
+def warm():
+    '''
+    Imports the routing code and loads everything the workers share, before
+    they are forked; each step is skipped when already done
+    Outputs:
+        (list of tuples) name and duration in seconds of each step
+    '''
+
+    steps = []
+
+    def timed(name, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        steps.append((name, time.perf_counter() - start))
+        return result
+
+    timed('imports', importlib.import_module, 'dijkstra_path1')
+    from crime_store import get_store
+    from graph_snapshot import get_snapshot
+    from graph_tiles import get_tiles
+    from landmarks import get_landmarks
+    from score_cube import get_cube
+
+    snapshot = timed('snapshot', get_snapshot)
+    #with tiles, route ends are snapped from the tiles around them
+    if timed('tiles', get_tiles, snapshot) is None:
+        timed('node_index', snapshot.node_index)
+    timed('landmarks', get_landmarks, snapshot)
+    timed('score_cube', get_cube, snapshot)
+    timed('crime_store', get_store)
+    return steps
+
+
+def traced_go(args, publish_trace = False, kind = 'route'):
+    '''
+    Computes go(args) inside a metrics trace
+    Inputs:
+        args: as for go()
+        publish_trace: (bool) publish the trace here rather than in the
+            process that submitted the job
+        kind: (string) key of ROUTE_KINDS, e.g. 'sweep' to compute
+            go_sweep(args) instead
+    Outputs:
+        (tuple) the result of go() and the Trace
+    '''
+
+    fn = getattr(importlib.import_module('dijkstra_path1'), ROUTE_KINDS[kind])
+    with trace(publish_trace) as request_trace:
+        result = fn(args)
+        if isinstance(result, str):
+            request_trace.outcome = 'no_route'
+    return result, request_trace
+
+
+def init_worker():
+    '''
+    Runs in each worker as it starts; Ctrl-C is left to the web process,
+    which shuts the pool down
+    '''
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class RoutePool:
+    '''
+    Forked routing workers with bounded queueing and a per-request timeout
+    Inputs:
+        workers: (int) number of worker processes
+        queue_limit: (int) jobs accepted beyond one per worker
+        queue_wait: (float) seconds a request waits for a queue slot
+        timeout: (float) seconds a request waits for its route
+    '''
+
+    def __init__(self, workers = ROUTE_WORKERS,
+                 queue_limit = ROUTE_QUEUE_LIMIT,
+                 queue_wait = ROUTE_QUEUE_WAIT, timeout = ROUTE_TIMEOUT):
+        self.workers = workers
+        self.queue_wait = queue_wait
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers + queue_limit)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        '''
+        Warms the shared data and forks the workers, unless they are running
+        already; the web process calls it at startup (see wsgi.py), and it
+        runs again on the next job after a worker died
+        Outputs:
+            the ProcessPoolExecutor of the workers
+        '''
+
+        with self.lock:
+            if self.executor is None:
+                warm()
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, multiprocessing.get_context('fork'),
+                    initializer = init_worker)
+                #the executor forks its workers on the first job
+                self.executor.submit(os.getpid).result()
+            return self.executor
+
+    def submit(self, fn, *args):
+        '''
+        Queues a job for the workers
+        Outputs:
+            concurrent.futures.Future of the job and the executor running
+            it; raises PoolBusy when no queue slot frees up within
+            queue_wait seconds
+        '''
+
+        if not self.slots.acquire(timeout = self.queue_wait):
+            raise PoolBusy('The routing queue is full')
+        executor = None
+        try:
+            executor = self.start()
+            future = executor.submit(fn, *args)
+        except concurrent.futures.process.BrokenProcessPool:
+            self.slots.release()
+            self.reset(executor)
+            raise
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        return future, executor
+
+    def route(self, args, kind = 'route'):
+        '''
+        Computes go(args), or the function of another kind of ROUTE_KINDS,
+        in a worker and publishes its trace; when the worker dies, the job
+        is run once more on a fresh pool
+        Outputs:
+            same as go(); raises PoolBusy or RouteTimeout, or
+            BrokenProcessPool when the retry fails too
+        '''
+
+        for attempt in range(2):
+            try:
+                future, executor = self.submit(traced_go, args, False, kind)
+            except concurrent.futures.process.BrokenProcessPool:
+                if attempt:
+                    raise
+                continue
+            try:
+                result, request_trace = future.result(timeout = self.timeout)
+            except concurrent.futures.TimeoutError:
+                raise RouteTimeout('No route after {} seconds'.format(
+                    self.timeout))
+            except concurrent.futures.process.BrokenProcessPool:
+                self.reset(executor)
+                if attempt:
+                    raise
+                continue
+            publish(request_trace)
+            return result
+
+    def reset(self, executor):
+        '''
+        Drops a pool whose worker died, so the next job forks a fresh one;
+        a pool that already replaced it is kept
+        '''
+
+        with self.lock:
+            if executor is not None and self.executor is executor:
+                self.executor = None
+        if executor is not None:
+            #the surviving workers exit once the executor sees the pool
+            #is broken, which does not need waiting for here
+            executor.shutdown(wait = False)
+
+    def shutdown(self):
+        '''
+        Stops the workers once their current jobs are done
+        '''
+
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+def get_pool(workers = ROUTE_WORKERS, queue_limit = ROUTE_QUEUE_LIMIT,
+             queue_wait = ROUTE_QUEUE_WAIT, timeout = ROUTE_TIMEOUT):
+    '''
+    Returns the process-wide pool, creating it on first use, or None when
+    workers is 0 or the platform cannot fork
+    '''
+
+    global _POOL
+    if not workers or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = RoutePool(workers, queue_limit, queue_wait, timeout)
+    return _POOL
+
+
+def route(args, kind = 'route', **pool_settings):
+    '''
+    Computes go(args) in the worker pool, or in the calling thread when
+    there is no pool
+    Inputs:
+        args: as for go()
+        kind: (string) key of ROUTE_KINDS
+        pool_settings: workers, queue_limit, queue_wait and timeout, see
+            RoutePool
+    '''
+
+    pool = get_pool(**pool_settings)
+    if pool is None:
+        return traced_go(args, True, kind)[0]
+    try:
+        return pool.route(args, kind)
+    except PoolBusy:
+        count_request('busy')
+        raise
+    except RouteTimeout:
+        count_request('timeout')
+        raise
+    except Exception:
+        count_request('error')
+        raise